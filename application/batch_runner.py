@@ -0,0 +1,145 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import zip_longest
+
+from application.estudio_contable_service import EstudioContableService
+from cross_cutting.settings import Settings
+
+logger = logging.getLogger(__name__)
+
+
+class BatchWorker:
+    """
+    Browser session, extractor and persistence of one worker thread of the batch.
+    """
+    def __init__(self, factory, config, extractor_name, save_to):
+        self.factory = factory
+        self.config = config
+        self.process_sunat = factory.create_notification_sunat(
+            config,
+            factory.create_extractor(extractor_name, config),
+            # Launched on the first RUC: a browser that cannot start fails that RUC, and the next one retries
+            None,
+            factory.create_persist(save_to, config),
+            None)
+
+    @property
+    def session(self):
+        return self.process_sunat.session
+
+    def process(self, estudio_contable_ruc, context):
+        self.process_sunat.settings = Settings(ESTUDIO_CONTABLE_RUC=estudio_contable_ruc)
+        outcome = self.process_sunat.process_ruc_safe(context)
+        if outcome["status"] != "ok":
+            # The browser may be left in an unknown state (or closed): start a fresh one
+            self.process_sunat.renew_session()
+        return outcome
+
+    def close(self):
+        self.process_sunat.close()
+
+
+class BatchRunner:
+    def __init__(self, config, estudio_contable_svc: EstudioContableService, factory,
+                 workers=4, extractor_name="manual", save_to="db", progress=None):
+        """
+        Processes the RUCs of many estudios contables as one work queue.
+        The RUCs are interleaved round-robin across estudios, so a large estudio does not delay the small ones,
+        and run on a bounded pool of worker threads (one browser each). The calls to every SUNAT host are also
+        capped by the shared HostLimiter.
+
+        :param config: config.ini loaded.
+        :param estudio_contable_svc: Service returning the RUCs of every estudio.
+        :param factory: Module building the extractor, persistence and sessions (notification_factory).
+        :param workers: Global limit of RUCs processed at the same time.
+        :param extractor_name: Extractor used by the workers.
+        :param save_to: Persistence used by the workers.
+        :param progress: Optional callable progress(key, status, outcome=None); key is "estudio/ruc".
+        """
+        self.config = config
+        self.estudio_contable_svc = estudio_contable_svc
+        self.factory = factory
+        self.workers = max(1, int(workers))
+        self.extractor_name = extractor_name
+        self.save_to = save_to
+        self.progress = progress
+        self._local = threading.local()
+        self._workers = []
+        self._workers_lock = threading.Lock()
+
+    def resolve_estudios(self, estudios):
+        """
+        Returns the RUCs of the estudios to process; "all" means every estudio of the persistence API.
+        """
+        if estudios == "all" or estudios == ["all"]:
+            return [estudio["numero_ruc"] for estudio in self.estudio_contable_svc.get_estudios_contables()]
+        return list(dict.fromkeys(str(estudio) for estudio in estudios))
+
+    @staticmethod
+    def interleave(work_by_estudio):
+        """
+        Round-robin merge of the per-estudio RUC lists: e1r1, e2r1, e3r1, e1r2, e2r2, ...
+        """
+        return [item for round_items in zip_longest(*work_by_estudio.values()) for item in round_items if item is not None]
+
+    def expand(self, estudios):
+        work_by_estudio = {}
+        for estudio in self.resolve_estudios(estudios):
+            try:
+                companies = self.estudio_contable_svc.get_rucs_by_estudio_contable(estudio)
+            except Exception as e:
+                logger.error(f"Estudio Contable {estudio} could not be loaded: {e}")
+                self.report(estudio, "-", "failed", {"notifications": 0, "error": str(e)})
+                continue
+            work_by_estudio[estudio] = [(estudio, context) for context in companies]
+        return self.interleave(work_by_estudio)
+
+    def report(self, estudio, ruc, status, outcome=None):
+        if self.progress is not None:
+            self.progress(f"{estudio}/{ruc}", status, outcome)
+
+    def worker(self):
+        # One worker (browser) per thread, created on its first RUC
+        worker = getattr(self._local, "worker", None)
+        if worker is None:
+            worker = BatchWorker(self.factory, self.config, self.extractor_name, self.save_to)
+            self._local.worker = worker
+            with self._workers_lock:
+                self._workers.append(worker)
+        return worker
+
+    def process(self, estudio, context):
+        self.report(estudio, context["RUC"], "running")
+        try:
+            outcome = self.worker().process(estudio, context)
+        except Exception as e:
+            # The extractor or the persistence of this thread could not be created
+            logger.exception(f"Error processing RUC {context['RUC']} of {estudio}: {e}")
+            outcome = {"ruc": context["RUC"], "status": "failed", "notifications": 0, "error": str(e)}
+        outcome["estudio_contable_ruc"] = estudio
+        self.report(estudio, context["RUC"], outcome["status"], outcome)
+        return outcome
+
+    def run(self, estudios):
+        """
+        :param estudios: List of estudio RUCs, or "all".
+        :return: List of per-RUC outcomes (with estudio_contable_ruc), in processing order.
+        """
+        work = self.expand(estudios)
+        logger.info(f"Batch: {len(work)} RUCs with {self.workers} workers")
+        for estudio, context in work:
+            self.report(estudio, context["RUC"], "pending")
+
+        try:
+            # map keeps the interleaved order: the pool takes the RUCs in that order as threads get free
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="batch") as executor:
+                outcomes = list(executor.map(lambda item: self.process(*item), work))
+        finally:
+            for worker in self._workers:
+                worker.close()
+            self._workers = []
+
+        failed = [outcome for outcome in outcomes if outcome["status"] != "ok"]
+        logger.info(f"Batch finished. RUCs processed: {len(outcomes) - len(failed)}, failed: {len(failed)}")
+        return outcomes
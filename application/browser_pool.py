@@ -0,0 +1,149 @@
+import logging
+import queue
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class BrowserPool:
+    def __init__(self, factory, size=2, max_uses=20, acquire_timeout=300):
+        """
+        Pool of pre-launched browser sessions handed out per job.
+        A session is recycled (closed and replaced in background) after max_uses jobs, when the job fails,
+        or when it does not pass the health check.
+
+        :param factory: Callable returning a new HttpSessionRpa.
+        :param size: Number of browsers kept warm.
+        :param max_uses: Jobs served by a browser before it is replaced.
+        :param acquire_timeout: Seconds a job waits for a free browser.
+        """
+        self.factory = factory
+        self.size = size
+        self.max_uses = max_uses
+        self.acquire_timeout = acquire_timeout
+        self._idle = queue.Queue()
+        self._uses = {}
+        # Sessions handed out and not released yet (a session released early is not released twice)
+        self._leased = set()
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def start(self):
+        """
+        Launches the browsers of the pool. A browser that fails to start is retried on the first acquire.
+        """
+        for _ in range(self.size):
+            self._launch()
+        logger.info(f"Browser pool ready: {self._idle.qsize()}/{self.size} browsers")
+
+    def _launch(self):
+        try:
+            session = self.factory()
+        except Exception as e:
+            logger.error(f"Browser could not be launched: {e}")
+            # Placeholder: the slot is refilled when a job acquires it
+            self._idle.put(None)
+            return
+        with self._lock:
+            self._uses[id(session)] = 0
+        self._idle.put(session)
+
+    def _launch_async(self):
+        threading.Thread(target=self._launch, name="browser-launch", daemon=True).start()
+
+    def _discard(self, session):
+        with self._lock:
+            self._uses.pop(id(session), None)
+        try:
+            session.close()
+        except Exception as e:
+            logger.warning(f"Error closing a pooled browser: {e}")
+
+    def acquire(self):
+        """
+        Takes a healthy browser from the pool, waiting up to acquire_timeout seconds.
+
+        :raises TimeoutError: No browser was free within acquire_timeout.
+        """
+        if self._closed:
+            raise RuntimeError("Browser pool is closed")
+        try:
+            session = self._idle.get(timeout=self.acquire_timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No pooled browser available after {self.acquire_timeout}s "
+                               f"({self.size} browsers, all in use)") from None
+        if session is not None and session.is_alive():
+            with self._lock:
+                self._leased.add(id(session))
+            return session
+
+        if session is not None:
+            logger.warning("Pooled browser failed the health check, launching a new one")
+            self._discard(session)
+        # Launched in the caller's thread: the job cannot go on without a browser
+        try:
+            session = self.factory()
+        except Exception:
+            # The slot goes back to the pool, so a failed launch does not shrink it
+            self._idle.put(None)
+            raise
+        with self._lock:
+            self._uses[id(session)] = 0
+            self._leased.add(id(session))
+        return session
+
+    def release(self, session, failed=False):
+        """
+        Returns a browser to the pool, or replaces it when it failed or reached max_uses.
+        A session already released (e.g. recycled by the job before its lease ended) is ignored.
+        """
+        with self._lock:
+            if id(session) not in self._leased:
+                logger.debug("Pooled browser already released")
+                return
+            self._leased.discard(id(session))
+            uses = self._uses.get(id(session), 0) + 1
+            self._uses[id(session)] = uses
+
+        if self._closed:
+            self._discard(session)
+            return
+
+        if not failed:
+            try:
+                session.reset()
+            except Exception as e:
+                logger.warning(f"Pooled browser could not be reset: {e}")
+                failed = True
+
+        if failed or uses >= self.max_uses:
+            logger.info(f"Recycling pooled browser ({'failed' if failed else f'{uses} uses'})")
+            self._discard(session)
+            self._launch_async()
+        else:
+            self._idle.put(session)
+
+    @contextmanager
+    def lease(self):
+        """
+        with pool.lease() as session: ... — the browser is recycled if the block raises.
+        """
+        session = self.acquire()
+        try:
+            yield session
+        except Exception:
+            self.release(session, failed=True)
+            raise
+        self.release(session)
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                session = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if session is not None:
+                self._discard(session)
+        logger.info("Browser pool closed")
@@ -3,12 +3,18 @@ import logging
 import requests
 
 from application.estudio_contable_not_found_error import EstudioContableNotFoundError
+from application.rate_controller import rate_controller
+from application.reference_data_cache import reference_data_cache
 
 logger = logging.getLogger(__name__)
 
 class EstudioContableService():
     def __init__(self, config=None):
         self.config = config
+        self.http = requests.Session()
+        self.cache = reference_data_cache
+        # Short TTL: the estudio carries fecha_ultima_notificacion, which changes after every run
+        self.estudios_ttl = config.getint("CACHE", "estudios_contables_ttl", fallback=60) if config else 60
 
     def get_rucs_by_estudio_contable(self, numero_ruc):
         # Call the endpoint and get the response
@@ -22,17 +28,22 @@ class EstudioContableService():
                  "PSW": r['password_buzon'],
                  "LAST": r['fecha_ultima_notificacion']} for r in response['rucs']]
 
+    def get_estudios_contables(self):
+        """
+        Returns every estudio contable registered in the persistence API (used by the "all" batch).
+        """
+        base_url = self.config["URLS"]["persist_base_url"]
+        url = f"{base_url.rstrip('/')}/estudios_contables/?skip=0&limit=1000"
+        with rate_controller.request(url) as call:
+            response = self.http.get(url)
+            call.done(response)
+        response.raise_for_status()
+        return response.json()
+
     def __call_get_estudios_contables_by_ruc_endpoint(self, numero_ruc):
         # Construct the endpoint URL
         base_url = self.config["URLS"]["persist_base_url"]
         url = f"{base_url.rstrip('/')}/estudios_contables/ruc/{numero_ruc}"
-        logger.info(f"Calling endpoint: {url}")
-        
-        # Send the GET request
-        response = requests.get(url)
-
-        # Raise an exception for HTTP error responses
-        response.raise_for_status()
 
-        # Return the response as JSON
-        return json.loads(response.text)
+        # Send the GET request (cached, revalidated with ETag once expired)
+        return self.cache.get_json(url, http=self.http, ttl=self.estudios_ttl)
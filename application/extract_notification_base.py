@@ -1,11 +1,40 @@
 from abc import ABC, abstractmethod
+import logging
 
 from application.http_session_rpa import HttpSessionRpa
 
+logger = logging.getLogger(__name__)
+
 class ExtractNotificationBase(ABC):
     def __init__(self):
         super().__init__()
 
     @abstractmethod
     def extract(self, session:HttpSessionRpa):
-        pass
\ No newline at end of file
+        pass
+
+    def iter_extract(self, session: HttpSessionRpa, context=None):
+        """
+        Yields the notifications as they are extracted, so they can be persisted while the mailbox is still read.
+        Extractors that can stream override it; by default the list returned by extract is yielded.
+        """
+        yield from self.extract(session, context)
+
+    @staticmethod
+    def mark_incomplete(context, reason):
+        """
+        Records in the extraction context that some notifications of the mailbox could not be extracted,
+        so the RUC is not reported as ok and its watermark is not moved past them.
+
+        :param context: Extraction context of the RUC (may be None when extract is called directly).
+        :param reason: Why the extraction is incomplete; the first one is kept.
+        """
+        logger.error(f"Extracción incompleta: {reason}")
+        if context is not None:
+            context.setdefault("incomplete", reason)
+
+    def close(self):
+        """
+        Releases the resources of the extractor (background threads, HTTP pools) once the run is over.
+        """
+        pass
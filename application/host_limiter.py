@@ -0,0 +1,62 @@
+import logging
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+
+class HostLimiter:
+    def __init__(self, default_limit=4, limits=None):
+        """
+        Caps the concurrent requests/browser workflows against every host, shared by all the threads of the process.
+
+        :param default_limit: Slots of a host not listed in limits (0 = unlimited).
+        :param limits: Dictionary host -> slots.
+        """
+        self.default_limit = default_limit
+        self.limits = dict(limits or {})
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def configure(self, config):
+        """
+        Loads the limits from the [HOSTS] section of config.ini (default_limit and one option per host).
+        """
+        if not config.has_section("HOSTS"):
+            return self
+        with self._lock:
+            self.default_limit = config.getint("HOSTS", "default_limit", fallback=self.default_limit)
+            self.limits = {host: int(value) for host, value in config["HOSTS"].items() if host != "default_limit"}
+            self._semaphores = {}
+        return self
+
+    @staticmethod
+    def host_of(url_or_host):
+        return urlparse(url_or_host).hostname if "//" in url_or_host else url_or_host
+
+    def _semaphore(self, host):
+        with self._lock:
+            if host not in self._semaphores:
+                limit = self.limits.get(host, self.default_limit)
+                self._semaphores[host] = threading.BoundedSemaphore(limit) if limit > 0 else None
+            return self._semaphores[host]
+
+    @contextmanager
+    def slot(self, url_or_host):
+        """
+        with host_limiter.slot(url): ... — waits for a free slot of the host of url.
+        """
+        semaphore = self._semaphore(self.host_of(url_or_host))
+        if semaphore is None:
+            yield
+            return
+        semaphore.acquire()
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+
+# Shared by every session, extractor and pipeline of the process
+host_limiter = HostLimiter()
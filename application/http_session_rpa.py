@@ -1,4 +1,4 @@
-# import requests
+import requests
 import configparser
 import time
 import logging
@@ -7,6 +7,9 @@ from datetime import datetime
 
 from selenium.webdriver.common.by import By
 
+from application.host_limiter import host_limiter
+from application.rate_controller import rate_controller
+from cross_cutting import metrics
 from infrastructure.selenium_rpa import SeleniumRpa
 from bs4 import BeautifulSoup
 import json
@@ -16,16 +19,23 @@ import pandas as pd
 # logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Cookie fields accepted back by CDP Network.setCookies
+COOKIE_PARAMS = ("name", "value", "domain", "path", "secure", "httpOnly", "sameSite", "expires")
+
 class HttpSessionRpa:
-    def __init__(self, headless=False, config=None):
+    def __init__(self, headless=False, config=None, session_cache=None):
         """        
         Initialize the Selenium WebDriver and the requests session.
 
         :param headless: Boolean indicating whether to run browser in headless mode.
         :param config: config.ini loaded.
+        :param session_cache: (Optional) SessionCookieCache to reuse authenticated sessions per RUC.
         """
         self.current_cookies = []
         self.config = config
+        self.session_cache = session_cache
+        self._closed = False
+        self._current_ruc = None
         self._automator = SeleniumRpa(headless=headless, config=config)
 
         # Initialize requests session
@@ -36,6 +46,7 @@ class HttpSessionRpa:
     def automator(self) -> SeleniumRpa:
         return self._automator
     
+    @metrics.stage("login")
     def login(self, RUC, USER, PSW):
         logger.info(f"Logging in with RUC: {RUC}")
         x_input_login_ruc = self.config["XPATHS"]["x_input_login_ruc"]
@@ -44,12 +55,14 @@ class HttpSessionRpa:
         x_bottom_login_ingreso = self.config["XPATHS"]["x_bottom_login_ingreso"]
 
         workflow = [
-            {"action": "enter_text", "by": By.XPATH, "value": x_input_login_ruc, "text": RUC},
-            {"action": "enter_text", "by": By.XPATH, "value": x_input_login_user, "text": USER},
-            {"action": "enter_text", "by": By.XPATH, "value": x_input_login_psw, "text": PSW},
-            {"action": "click", "by": By.XPATH, "value": x_bottom_login_ingreso, "delay": 5},
+            {"action": "enter_text", "by": By.XPATH, "value": x_input_login_ruc, "text": RUC, "delay": 0},
+            {"action": "enter_text", "by": By.XPATH, "value": x_input_login_user, "text": USER, "delay": 0},
+            {"action": "enter_text", "by": By.XPATH, "value": x_input_login_psw, "text": PSW, "delay": 0},
+            {"action": "click", "by": By.XPATH, "value": x_bottom_login_ingreso, "timeout": 30,
+             "until": [{"condition": "url_changes"}, {"condition": "network_idle"}]},
         ]
-        self._automator.execute_workflow(self.config["WEBSITE"]["url_start"], workflow)
+        with host_limiter.slot(self.config["WEBSITE"]["url_start"]):
+            self._automator.execute_workflow(self.config["WEBSITE"]["url_start"], workflow)
         logger.info(f"Login completed. RUC: {RUC}")
 
     def __modal_validation_datos(self):
@@ -59,7 +72,8 @@ class HttpSessionRpa:
     def __process_modal_validation_datos(self):
         x_button_cerrar = self.config["XPATHS"]["x_modal_valida_datos_button"]
         workflow = [
-            {"action": "click", "by": By.XPATH, "value": x_button_cerrar, "delay": 2},
+            {"action": "click", "by": By.XPATH, "value": x_button_cerrar, "timeout": 10,
+             "until": {"condition": "invisible", "by": By.XPATH, "value": self.config["XPATHS"]["x_modal_valida_datos"]}},
         ]
         self._automator.execute_workflow("", workflow)
 
@@ -70,10 +84,12 @@ class HttpSessionRpa:
     def __process_modal_validation_datos_informativo(self):
         button_aceptar = self.config["XPATHS"]["x_modal_valida_datos_informativo_button"]
         workflow = [
-            {"action": "click", "by": By.XPATH, "value": button_aceptar, "delay": 2},
+            {"action": "click", "by": By.XPATH, "value": button_aceptar, "timeout": 10,
+             "until": {"condition": "invisible", "by": By.XPATH, "value": self.config["XPATHS"]["x_modal_valida_datos_informativo"]}},
         ]
         self._automator.execute_workflow("", workflow)
 
+    @metrics.stage("clear_modals")
     def clear_modal_validation_datos(self):
         _iframe = self._automator.find_element(By.ID, "ifrVCE")
         if _iframe and _iframe.is_displayed() and _iframe.is_enabled():
@@ -87,8 +103,74 @@ class HttpSessionRpa:
 
             self._automator.driver.switch_to.default_content()
 
+    def is_session_valid(self, ruc, cookies):
+        """
+        Probes the visor with the cached cookies (consultarAlertas is a cheap call).
+        An expired session is redirected to the login page instead of answering JSON.
+        """
+        url = f"{self.config['WEBSITE']['url_visor'].rstrip('/')}/consultarAlertas"
+        jar = requests.cookies.RequestsCookieJar()
+        for cookie in cookies:
+            jar.set(cookie["name"], cookie["value"], domain=cookie.get("domain"), path=cookie.get("path", "/"))
+        try:
+            with host_limiter.slot(url), rate_controller.request(url) as call:
+                response = requests.post(url, cookies=jar, allow_redirects=False, timeout=10,
+                                         headers={"X-Ruc": str(ruc), "X-Requested-With": "XMLHttpRequest"})
+                call.done(response)
+            return response.status_code == 200 and "json" in response.headers.get("Content-Type", "")
+        except requests.RequestException as e:
+            logger.warning(f"Session probe failed: {e}")
+            return False
+
+    @metrics.stage("restore_session")
+    def restore_session(self, ruc):
+        """
+        Loads the cached cookies of the RUC into the browser and opens the menu, skipping the login.
+
+        :return: True when the cached session is valid and the menu is loaded.
+        """
+        if self.session_cache is None:
+            return False
+
+        cookies = self.session_cache.get(ruc)
+        if cookies is None:
+            return False
+
+        if not self.is_session_valid(ruc, cookies):
+            logger.info(f"Cached session is no longer valid. RUC: {ruc}")
+            self.session_cache.invalidate(ruc)
+            return False
+
+        driver = self._automator.driver
+        try:
+            driver.execute_cdp_cmd("Network.setCookies", {"cookies": cookies})
+            with host_limiter.slot(self.config["WEBSITE"]["url_menu"]):
+                self._automator.open_page(self.config["WEBSITE"]["url_menu"])
+            restored = self._automator.find_element(By.XPATH, self.config["XPATHS"]["x_bottom_buzon"]) is not None
+            if not restored:
+                logger.info(f"Cached session rejected by the menu. RUC: {ruc}")
+        except Exception as e:
+            # CDP error or page load timeout: fall back to a normal login
+            logger.warning(f"Cached session could not be restored, logging in. RUC: {ruc}: {e}")
+            restored = False
+
+        if not restored:
+            self.session_cache.invalidate(ruc)
+            try:
+                driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+            except Exception as e:
+                logger.warning(f"Browser cookies could not be cleared: {e}")
+            return False
+
+        logger.info(f"Session restored from cache. RUC: {ruc}")
+        return True
+
+    @metrics.stage("open_mailbox")
     def open_mailbox(self, login_credentials, wait_time=5):
-        self.login(login_credentials["RUC"], login_credentials["USER"], login_credentials["PSW"])
+        self._current_ruc = login_credentials["RUC"]
+        self._automator.step_timings = []
+        if not self.restore_session(login_credentials["RUC"]):
+            self.login(login_credentials["RUC"], login_credentials["USER"], login_credentials["PSW"])
 
         self.clear_modal_validation_datos()
         
@@ -96,9 +178,12 @@ class HttpSessionRpa:
         try:
             x_bottom_buzon = self.config["XPATHS"]["x_bottom_buzon"]
             workflow = [
-                {"action": "click", "by": By.XPATH, "value": x_bottom_buzon, "delay": 5},
+                {"action": "click", "by": By.XPATH, "value": x_bottom_buzon, "timeout": 30,
+                 "until": [{"condition": "frame_available", "by": By.NAME, "value": "iframeApplication"},
+                           {"condition": "network_idle"}]},
             ]
-            self._automator.execute_workflow("", workflow)
+            with host_limiter.slot(self.config["WEBSITE"]["url_menu"]):
+                self._automator.execute_workflow("", workflow)
             logger.info(f"Mailbox opened. RUC: {login_credentials['RUC']}")
             # self.load_info_response()
         except Exception as e:
@@ -106,20 +191,62 @@ class HttpSessionRpa:
             logger.error(f"Error opening mailbox: {e}")
             raise
 
+    def workflow_seconds(self):
+        """
+        Total seconds spent in the workflow steps of the current RUC (see SeleniumRpa.step_timings).
+        """
+        return sum(step["seconds"] for step in self._automator.step_timings)
+
     def close(self):
         """
-        Close the Selenium WebDriver.
+        Close the Selenium WebDriver. Safe to call more than once.
         """
+        if self._closed:
+            return
+        self._closed = True
         self._automator.quit()
         logger.info("Selenium WebDriver closed.")
 
+    def is_alive(self):
+        """
+        True while the browser is open and responding (used by the browser pool before lending it).
+        """
+        return not self._closed and self._automator.is_alive()
+
+    def reset(self):
+        """
+        Leaves the browser clean for the next job: no cookies and a blank page.
+        """
+        driver = self._automator.driver
+        driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+        driver.get("about:blank")
+        self._current_ruc = None
+
+    @metrics.stage("close_mailbox")
     def close_extraction(self):
+        # Nothing captured for this RUC is needed by the next one
+        self._automator.clear_capture()
+        if self.session_cache is not None and self._current_ruc is not None:
+            # Keep the session alive for the next run: store the cookies and clear the browser instead of logging out
+            driver = self._automator.driver
+            cookies = driver.execute_cdp_cmd("Network.getAllCookies", {})["cookies"]
+            self.session_cache.put(self._current_ruc, [
+                {key: value for key, value in cookie.items() if key in COOKIE_PARAMS and not (key == "expires" and cookie.get("session"))}
+                for cookie in cookies
+            ])
+            driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+            self._current_ruc = None
+            logger.info(f"Mailbox closed. Session kept in cache.")
+            return
+
         x_bottom_salir = self.config["XPATHS"]["x_bottom_logout"]
         workflow = [
-            {"action": "click", "by": By.XPATH, "value": x_bottom_salir, "delay": 5},
+            {"action": "click", "by": By.XPATH, "value": x_bottom_salir, "timeout": 15,
+             "until": {"condition": "url_changes"}},
         ]
-        self._automator.execute_workflow("", workflow)
-        logger.info(f"Mailbox closed.")
+        with host_limiter.slot(self.config["WEBSITE"]["url_menu"]):
+            self._automator.execute_workflow("", workflow)
+        logger.info(f"Mailbox closed. Workflow wait time: {self.workflow_seconds():.2f}s")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,106 @@
+import logging
+from datetime import datetime
+
+from dateutil import parser
+
+logger = logging.getLogger(__name__)
+
+SUNAT_DATE_FORMAT = "%d/%m/%Y %H:%M:%S"
+
+
+def parse_sunat_date(value):
+    """
+    Parses a mailbox date (dd/mm/YYYY HH:MM:SS), falling back to dateutil for other formats.
+
+    :return: Naive datetime, or None when the value cannot be parsed.
+    """
+    if not value:
+        return None
+    value = str(value).strip()
+    try:
+        return datetime.strptime(value, SUNAT_DATE_FORMAT)
+    except ValueError:
+        pass
+    try:
+        # ISO dates (LLM, JSON endpoints): dayfirst would swap their day and month
+        return datetime.fromisoformat(value).replace(tzinfo=None)
+    except ValueError:
+        pass
+    try:
+        return parser.parse(value, dayfirst=True).replace(tzinfo=None)
+    except (ValueError, OverflowError) as e:
+        logger.warning(f"Error parsing date {value}: {e}")
+        return None
+
+
+def format_sunat_date(value):
+    """
+    Normalizes a date (ISO, dd/mm/YYYY, ...) to the mailbox format dd/mm/YYYY HH:MM:SS expected by the persistence.
+
+    :return: The formatted date, or None when the value cannot be parsed.
+    """
+    date = parse_sunat_date(value)
+    return date.strftime(SUNAT_DATE_FORMAT) if date is not None else None
+
+
+class IncrementalScanner:
+    def __init__(self, last_date=None, watermark=None):
+        """
+        Decides which mailbox messages are new, walking the pages newest-first and stopping at the
+        first message older than the watermark.
+
+        :param last_date: fecha_ultima_notificacion from the persistence API (inclusive limit).
+        :param watermark: Local watermark {"date": ISO date, "ids": [ids published at that date]}
+                          (exclusive limit: the ids already persisted at that date are skipped).
+        """
+        self.since = None
+        self.seen_ids = set()
+        self.inclusive = True
+
+        api_date = None
+        if last_date:
+            try:
+                api_date = parser.parse(str(last_date)).replace(tzinfo=None)
+            except (ValueError, OverflowError) as e:
+                logger.warning(f"Error parsing last_date {last_date}: {e}")
+
+        local_date = datetime.fromisoformat(watermark["date"]) if watermark and watermark.get("date") else None
+        if local_date is not None and (api_date is None or local_date >= api_date):
+            self.since = local_date
+            self.seen_ids = set(str(i) for i in watermark.get("ids", []))
+        else:
+            self.since = api_date
+
+    def classify(self, row_id, row_date):
+        """
+        :return: "new", "seen" (at the watermark, already persisted) or "old" (before the watermark).
+        """
+        if self.since is None:
+            return "new"
+        date = parse_sunat_date(row_date)
+        if date is None:
+            # Cannot tell: include it rather than lose it
+            return "new"
+        if date > self.since:
+            return "new"
+        if date == self.since:
+            return "seen" if str(row_id) in self.seen_ids else "new"
+        return "old"
+
+    def scan(self, pages, id_of, date_of):
+        """
+        Yields the new rows of the pages (newest-first) and stops at the first row older than the watermark,
+        so the next pages are never requested.
+
+        :param pages: Iterable of pages (lists of rows); it can be a lazy generator of HTTP calls.
+        :param id_of: Callable returning the id of a row.
+        :param date_of: Callable returning the publish date (text) of a row.
+        """
+        for page_number, rows in enumerate(pages, start=1):
+            for row in rows:
+                status = self.classify(id_of(row), date_of(row))
+                if status == "old":
+                    logger.info(f"Watermark {self.since} reached at page {page_number}")
+                    return
+                if status == "new":
+                    yield row
@@ -0,0 +1,103 @@
+import logging
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+
+class JobProgress:
+    """
+    Progress reporter handed to a running job. Records the status of every RUC.
+    """
+    def __init__(self, job, lock):
+        self._job = job
+        self._lock = lock
+
+    def __call__(self, ruc, status, outcome=None):
+        with self._lock:
+            entry = self._job["rucs"].setdefault(ruc, {"status": status})
+            entry["status"] = status
+            entry["updated_at"] = datetime.now(timezone.utc).isoformat()
+            if outcome is not None:
+                entry["notifications"] = outcome.get("notifications")
+                entry["error"] = outcome.get("error")
+
+
+class JobManager:
+    def __init__(self, max_workers=2, max_jobs=200):
+        """
+        Runs the notification jobs on a bounded thread pool and keeps their status in memory.
+
+        :param max_workers: Maximum number of jobs running at the same time.
+        :param max_jobs: Maximum number of jobs kept; the oldest finished jobs are dropped first.
+        """
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self.max_jobs = max_jobs
+
+    def submit(self, fn, params):
+        """
+        Queues a job and returns immediately.
+
+        :param fn: Callable fn(progress, **params) executed on the pool.
+        :param params: Job parameters (also returned in the job status).
+        :return: The job id.
+        """
+        job_id = uuid.uuid4().hex
+        job = {
+            "id": job_id,
+            "status": "queued",
+            "params": params,
+            "submitted_at": datetime.now(timezone.utc).isoformat(),
+            "started_at": None,
+            "finished_at": None,
+            "error": None,
+            "rucs": {},
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+            self._evict()
+
+        self._executor.submit(self._run, job, fn, params)
+        logger.info(f"Job {job_id} queued: {params}")
+        return job_id
+
+    def get(self, job_id):
+        """
+        Returns a snapshot of the job status, or None when the job is unknown.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            snapshot = dict(job)
+            snapshot["rucs"] = {ruc: dict(entry) for ruc, entry in job["rucs"].items()}
+            return snapshot
+
+    def shutdown(self, wait=False):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+    def _run(self, job, fn, params):
+        with self._lock:
+            job["status"] = "running"
+            job["started_at"] = datetime.now(timezone.utc).isoformat()
+        try:
+            fn(JobProgress(job, self._lock), **params)
+            status, error = "completed", None
+        except Exception as e:
+            logger.exception(f"Job {job['id']} failed: {e}")
+            status, error = "failed", str(e)
+
+        with self._lock:
+            job["status"] = status
+            job["error"] = error
+            job["finished_at"] = datetime.now(timezone.utc).isoformat()
+
+    def _evict(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job["status"] in ("completed", "failed")]
+        while len(self._jobs) > self.max_jobs and finished:
+            del self._jobs[finished.pop(0)]
@@ -5,39 +5,247 @@ import pandas as pd
 
 from application.estudio_contable_service import EstudioContableService
 from application.save_notification_base import SaveNotificationBase
+from cross_cutting import metrics
 from cross_cutting.settings import Settings
 from infrastructure.extract_notification_manual import ExtractNotificationManual
 from application.http_session_rpa import HttpSessionRpa
+from application.incremental_scanner import parse_sunat_date
+from application.persist_stage import PersistStage
 logger = logging.getLogger(__name__)
 
 class NotificationSunat():
-    def __init__(self, extractor: ExtractNotificationManual, 
+    def __init__(self, extractor: ExtractNotificationManual,
                  session: HttpSessionRpa,
                  persist: SaveNotificationBase,
                  estudio_contable_svc: EstudioContableService,
-                 settings: Settings):
+                 settings: Settings,
+                 worker_pool=None,
+                 progress=None,
+                 watermarks=None,
+                 close_session=True,
+                 journal=None,
+                 session_factory=None,
+                 persist_batch_size=20,
+                 persist_queue_size=100,
+                 release_session=None,
+                 run_id=None):
         self.extractor = extractor
         self.session = session
         self.persist = persist
         self.estudio_contable_svc = estudio_contable_svc
         self.settings = settings
-    
+        self.worker_pool = worker_pool
+        # Optional callable progress(ruc, status, outcome=None) to report the status of every RUC
+        self.progress = progress
+        # Optional WatermarkStore, advanced after every successful save
+        self.watermarks = watermarks
+        # False when the session is borrowed from a BrowserPool, which keeps it open for the next job
+        self.close_session = close_session
+        # Optional RunJournal: an interrupted run is resumed from the RUCs not persisted yet
+        self.journal = journal
+        # Run of the journal; set by process_notification, or by the caller when the run was started elsewhere
+        self._run_id = run_id
+        # Optional callable returning a new session, to replace the browser after a failed RUC
+        self.session_factory = session_factory
+        # Optional callable release_session(session, failed) returning a borrowed session to its BrowserPool
+        self.release_session = release_session
+        # Notifications are saved in batches while the mailbox is extracted (0 = saved once extracted)
+        self.persist_batch_size = persist_batch_size
+        self.persist_queue_size = persist_queue_size
+
     def process_notification(self):
         companies = self.estudio_contable_svc.get_rucs_by_estudio_contable(self.settings.ESTUDIO_CONTABLE_RUC)
         logger.info(f"Rucs: {len(companies)}")
         logger.info(f"RUC values: {json.dumps([context['RUC'] for context in companies], indent=4)}")
+
+        if self.journal is not None:
+            self._run_id, todo = self.journal.start(self.settings.ESTUDIO_CONTABLE_RUC,
+                                                    [context["RUC"] for context in companies])
+            for context in companies:
+                if context["RUC"] not in todo:
+                    self.report(context["RUC"], "skipped")
+            companies = [context for context in companies if context["RUC"] in todo]
+
         for context in companies:
-            logger.info(f"Credencial RUC: {context["RUC"]}")
-            self.session.open_mailbox(context)
-            notifications = self.extractor.extract(self.session, 
-                                                   { 
-                                                       "estudio_contable_ruc": self.settings.ESTUDIO_CONTABLE_RUC,
-                                                        "ruc": context["RUC"],
-                                                        "last_date": context["LAST"]
-                                                   })
+            self.report(context["RUC"], "pending")
+
+        try:
+            if self.worker_pool is not None:
+                for context in companies:
+                    self.report(context["RUC"], "running")
+                outcomes = self.worker_pool.run(companies, self.settings.ESTUDIO_CONTABLE_RUC, self._run_id)
+                for outcome in outcomes:
+                    self.journal_outcome(outcome)
+                    self.report(outcome["ruc"], outcome["status"], outcome)
+            else:
+                outcomes = []
+                for context in companies:
+                    self.report(context["RUC"], "running")
+                    # A failing RUC is isolated: recorded as failed and the loop goes on with a fresh browser
+                    outcome = self.process_ruc_safe(context)
+                    if outcome["status"] != "ok":
+                        self.renew_session()
+                    self.report(context["RUC"], outcome["status"], outcome)
+                    outcomes.append(outcome)
+        finally:
+            self.close()
+
+        if self.journal is not None:
+            self.journal.finish(self._run_id)
+
+        failed = [outcome for outcome in outcomes if outcome["status"] != "ok"]
+        logger.info(f"RUCs processed: {len(outcomes) - len(failed)}, failed: {len(failed)}")
+        for outcome in failed:
+            logger.error(f"RUC {outcome['ruc']} failed: {outcome['error']}")
+        return outcomes
+
+    def renew_session(self):
+        """
+        Replaces the browser after a failed RUC (it may be closed or left in an unknown page).
+        When the new browser cannot be launched the session is left empty and the next RUC retries the launch,
+        so one launch failure only fails the RUC that hits it.
+        """
+        if self.session_factory is None:
+            return
+        if self.session is not None:
+            if self.close_session:
+                try:
+                    self.session.close()
+                except Exception as e:
+                    logger.warning(f"Error closing the failed session: {e}")
+            elif self.release_session is not None:
+                # Borrowed from the BrowserPool: the pool discards it and launches a replacement
+                try:
+                    self.release_session(self.session, failed=True)
+                except Exception as e:
+                    logger.warning(f"Error releasing the failed session: {e}")
+            # Otherwise a borrowed session is left to its lease, which returns it to the pool
+            self.session = None
+        # The new browser belongs to this run
+        self.close_session = True
+        try:
+            self.session = self.session_factory()
+        except Exception as e:
+            logger.error(f"A new browser session could not be launched, retried with the next RUC: {e}")
+
+    def ensure_session(self):
+        """
+        Launches the browser session when the previous one could not be replaced.
+        """
+        if self.session is None:
+            if self.session_factory is None:
+                raise RuntimeError("No browser session to process the RUC")
+            self.session = self.session_factory()
+            self.close_session = True
+        return self.session
+
+    def close(self):
+        """
+        Closes the browser session (when it belongs to this run), the extractor and the persistence.
+        A failure closing one of them is logged and does not skip the others.
+        """
+        resources = [("extractor", self.extractor), ("persistence", self.persist)]
+        if self.session is not None and self.close_session:
+            resources.insert(0, ("browser session", self.session))
+        for name, resource in resources:
+            try:
+                resource.close()
+            except Exception as e:
+                logger.warning(f"Error closing the {name}: {e}")
+
+    def journal_outcome(self, outcome):
+        """
+        Journals the outcome of a RUC: persisted, partial (some notifications were rejected) or failed.
+        """
+        if outcome["status"] != "ok":
+            self.journal_mark(outcome["ruc"], "failed", outcome["error"])
+        elif outcome.get("failed_notifications"):
+            self.journal_mark(outcome["ruc"], "partial",
+                              f"{len(outcome['failed_notifications'])} notifications not saved")
+        else:
+            self.journal_mark(outcome["ruc"], "persisted")
+
+    def journal_mark(self, ruc, status, reason=None):
+        if self.journal is not None and self._run_id is not None:
+            self.journal.mark(self._run_id, ruc, status, reason)
+
+    def report(self, ruc, status, outcome=None):
+        if self.progress is not None:
+            self.progress(ruc, status, outcome)
+
+    def process_ruc(self, context):
+        with metrics.bind(estudio=self.settings.ESTUDIO_CONTABLE_RUC, ruc=context["RUC"]):
+            try:
+                outcome = self._process_ruc(context)
+            except Exception:
+                metrics.count_ruc("failed")
+                raise
+            metrics.count_ruc(outcome["status"])
+        return outcome
+
+    def _process_ruc(self, context):
+        logger.info(f"Credencial RUC: {context['RUC']}")
+        self.ensure_session().open_mailbox(context)
+        extract_context = {
+            "estudio_contable_ruc": self.settings.ESTUDIO_CONTABLE_RUC,
+            "ruc": context["RUC"],
+            "last_date": context["LAST"],
+            "watermark": self.watermarks.get(context["RUC"]) if self.watermarks else None
+        }
+        stage = PersistStage(self.persist, context['RUC'], self.persist_batch_size, self.persist_queue_size)
+        try:
+            for notification in self.extractor.iter_extract(self.session, extract_context):
+                stage.put(notification)
             self.session.close_extraction()
-            
-            self.persist.save(notifications, context['RUC'])
+        except BaseException:
+            # The notifications extracted before the failure (or a failed logout) are persisted anyway,
+            # and the persistence thread is not left waiting
+            stage.close(raise_errors=False)
+            raise
+        self.journal_mark(context["RUC"], "extracted")
+
+        saved = stage.close()
+        notifications = stage.notifications
+        outcome = {"ruc": context["RUC"], "status": "ok", "notifications": len(notifications), "error": None}
+        if isinstance(saved, dict) and saved.get("failed"):
+            # Persisted partially: report the notifications the backend rejected
+            outcome["failed_notifications"] = saved["failed"]
+        if extract_context.get("incomplete"):
+            # The mailbox was not read to the end: the notifications extracted are kept, but the RUC is
+            # retried and the watermark stays, so the older notifications not read are not skipped later
+            outcome["status"] = "failed"
+            outcome["error"] = extract_context["incomplete"]
+        self.journal_outcome(outcome)
+
+        if self.watermarks is not None and outcome["status"] == "ok":
+            self.watermarks.advance(context["RUC"], self.persisted(notifications, saved))
+        return outcome
+
+    @staticmethod
+    def persisted(notifications, saved):
+        """
+        Notifications that can move the watermark: all of them, or when some failed to save,
+        only the ones older than the oldest failure (so the failed ones are extracted again).
+        """
+        if not isinstance(saved, dict) or not saved.get("failed"):
+            return notifications
 
+        failed_ids = {str(f["id"]) for f in saved["failed"]}
+        failed_dates = [parse_sunat_date(n["publish_date"]) for n in notifications if str(n["id"]) in failed_ids]
+        failed_dates = [d for d in failed_dates if d is not None]
+        if not failed_dates:
+            return []
+        cutoff = min(failed_dates)
+        return [n for n in notifications
+                if str(n["id"]) not in failed_ids and (parse_sunat_date(n["publish_date"]) or cutoff) < cutoff]
 
-        self.session.close()
+    def process_ruc_safe(self, context):
+        """
+        Same as process_ruc, but a failure is reported in the outcome instead of aborting the caller.
+        """
+        try:
+            return self.process_ruc(context)
+        except Exception as e:
+            logger.exception(f"Error processing RUC {context['RUC']}: {e}")
+            self.journal_mark(context["RUC"], "failed", str(e))
+            return {"ruc": context["RUC"], "status": "failed", "notifications": 0, "error": str(e)}
@@ -0,0 +1,102 @@
+import contextvars
+import logging
+import queue
+import threading
+
+from application.save_notification_base import SaveNotificationBase
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of the notifications of the RUC in the queue
+_END = object()
+
+
+class PersistStage:
+    def __init__(self, persist: SaveNotificationBase, ruc, batch_size=20, queue_size=100):
+        """
+        Persists the notifications of a RUC while they are extracted: the extractor puts them in a bounded queue
+        and a thread saves them in batches of batch_size. When the queue is full the extractor waits,
+        so the notifications held in memory are bounded.
+
+        :param persist: Persistence (SaveNotificationBase); save is called once per batch.
+        :param ruc: RUC of the mailbox.
+        :param batch_size: Notifications per save. 0 = save all of them in close (no overlap).
+        :param queue_size: Notifications waiting to be saved before the extractor is blocked.
+        """
+        self.persist = persist
+        self.ruc = ruc
+        self.batch_size = batch_size
+        # Only id and publish_date are kept, for the watermark
+        self.notifications = []
+        self._results = []
+        self._error = None
+        self._buffer = []
+        self._queue = None
+        self._thread = None
+        if batch_size > 0:
+            self._queue = queue.Queue(maxsize=max(queue_size, batch_size))
+            # The thread keeps the estudio/RUC bound for the metrics of the saves
+            context = contextvars.copy_context()
+            self._thread = threading.Thread(target=context.run, args=(self._consume,),
+                                            name=f"persist-{ruc}", daemon=True)
+            self._thread.start()
+
+    def put(self, notification):
+        self.notifications.append({"id": notification["id"], "publish_date": notification["publish_date"]})
+        if self._queue is None:
+            self._buffer.append(notification)
+        else:
+            self._queue.put(notification)
+
+    def _save(self, batch):
+        if self._error is not None:
+            # After a failed save the rest of the RUC is not saved (the queue is still drained)
+            return
+        try:
+            self._results.append(self.persist.save(batch, self.ruc))
+        except Exception as e:
+            logger.error(f"Error saving {len(batch)} notifications of RUC {self.ruc}: {e}")
+            self._error = e
+
+    def _consume(self):
+        batch = []
+        while True:
+            notification = self._queue.get()
+            if notification is _END:
+                break
+            batch.append(notification)
+            if len(batch) >= self.batch_size:
+                self._save(batch)
+                batch = []
+        # A RUC without new notifications is still saved once (the persistence records the run)
+        if batch or not self._results:
+            self._save(batch)
+
+    def close(self, raise_errors=True):
+        """
+        Saves the notifications left and waits for the persistence thread.
+
+        :return: Results of the saves merged ({"saved", "failed", "skipped"}), or None when the persistence
+                 returns nothing.
+        :raises Exception: The first error of a save, when raise_errors.
+        """
+        if self._queue is None:
+            self._save(self._buffer)
+            self._buffer = []
+        else:
+            self._queue.put(_END)
+            self._thread.join()
+
+        if self._error is not None and raise_errors:
+            raise self._error
+        return self.merge(self._results)
+
+    @staticmethod
+    def merge(results):
+        merged = None
+        for result in results:
+            if isinstance(result, dict):
+                merged = merged or {"saved": [], "failed": [], "skipped": []}
+                for key in merged:
+                    merged[key].extend(result.get(key) or [])
+        return merged
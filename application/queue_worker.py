@@ -0,0 +1,121 @@
+import logging
+import os
+import socket
+import threading
+import uuid
+
+from application.batch_runner import BatchWorker
+from application.estudio_contable_service import EstudioContableService
+from application.work_queue import WorkQueue
+
+logger = logging.getLogger(__name__)
+
+
+class QueueWorker:
+    def __init__(self, queue: WorkQueue, estudio_contable_svc: EstudioContableService, factory, config,
+                 extractor_name="manual", save_to="db", lease_seconds=600, heartbeat_seconds=60, poll_seconds=5):
+        """
+        Claims RUC tasks from the WorkQueue and processes them with its own browser, renewing the lease with
+        heartbeats while a mailbox is processed. Any number of workers (threads or processes of the host) can share a queue.
+
+        :param queue: WorkQueue with the RUC tasks.
+        :param estudio_contable_svc: Service returning the credentials of the RUCs (tasks do not carry them).
+        :param factory: Module building the extractor, persistence and sessions (notification_factory).
+        :param config: config.ini loaded.
+        :param lease_seconds: Seconds a claimed task is reserved without a heartbeat.
+        :param heartbeat_seconds: Seconds between two lease renewals.
+        :param poll_seconds: Seconds to wait when the queue is empty.
+        """
+        self.queue = queue
+        self.estudio_contable_svc = estudio_contable_svc
+        self.factory = factory
+        self.config = config
+        self.extractor_name = extractor_name
+        self.save_to = save_to
+        self.lease_seconds = lease_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.poll_seconds = poll_seconds
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._worker = None
+        # Estudio -> {RUC: credentials}, read once per estudio (again when a RUC is missing or a task fails)
+        self._credentials = {}
+
+    def credentials(self, task):
+        estudio, ruc = task["estudio_contable_ruc"], task["ruc"]
+        if ruc not in self._credentials.get(estudio, {}):
+            self._credentials[estudio] = {str(context["RUC"]): context
+                                          for context in self.estudio_contable_svc.get_rucs_by_estudio_contable(estudio)}
+        if ruc not in self._credentials[estudio]:
+            raise LookupError(f"RUC {ruc} is not registered in Estudio Contable {estudio}")
+        return self._credentials[estudio][ruc]
+
+    def _heartbeat(self, task, stop, lost):
+        while not stop.wait(self.heartbeat_seconds):
+            if not self.queue.heartbeat(task["id"], self.worker_id, self.lease_seconds):
+                logger.warning(f"Lease of task {task['id']} (RUC {task['ruc']}) lost, aborting its extraction")
+                lost.set()
+                # Another worker owns the RUC now: closing the browser stops this extraction
+                if self._worker is not None and self._worker.session is not None:
+                    try:
+                        self._worker.session.close()
+                    except Exception as e:
+                        logger.warning(f"Error closing the session of task {task['id']}: {e}")
+                return
+
+    def process(self, task):
+        """
+        Processes one claimed task and completes or fails it.
+        """
+        logger.info(f"Worker {self.worker_id} processing task {task['id']}: "
+                    f"{task['estudio_contable_ruc']}/{task['ruc']} (attempt {task['attempts']})")
+        stop = threading.Event()
+        lost = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(task, stop, lost), daemon=True, name="lease-heartbeat")
+        heartbeat.start()
+        try:
+            context = self.credentials(task)
+            if self._worker is None:
+                self._worker = BatchWorker(self.factory, self.config, self.extractor_name, self.save_to)
+            outcome = self._worker.process(task["estudio_contable_ruc"], context)
+        except Exception as e:
+            logger.exception(f"Task {task['id']} failed: {e}")
+            outcome = {"ruc": task["ruc"], "status": "failed", "notifications": 0, "error": str(e)}
+        finally:
+            stop.set()
+            heartbeat.join()
+
+        if lost.is_set():
+            # The task belongs to the worker that claimed it again: it completes or fails it
+            logger.warning(f"Task {task['id']} (RUC {task['ruc']}) not completed: its lease was lost")
+            return dict(outcome, status="lease_lost")
+        if outcome["status"] == "ok":
+            self.queue.complete(task["id"], self.worker_id, outcome)
+        else:
+            self._credentials.pop(task["estudio_contable_ruc"], None)
+            self.queue.fail(task["id"], self.worker_id, outcome["error"])
+        return outcome
+
+    def run(self, stop_event=None, until_empty=False):
+        """
+        Claims and processes tasks until stop_event is set (or, with until_empty, until the queue is empty).
+
+        :return: Number of tasks processed.
+        """
+        stop_event = stop_event or threading.Event()
+        processed = 0
+        try:
+            while not stop_event.is_set():
+                task = self.queue.claim(self.worker_id, self.lease_seconds)
+                if task is None:
+                    if until_empty:
+                        break
+                    self.queue.requeue_expired()
+                    stop_event.wait(self.poll_seconds)
+                    continue
+                self.process(task)
+                processed += 1
+        finally:
+            if self._worker is not None:
+                self._worker.close()
+                self._worker = None
+        return processed
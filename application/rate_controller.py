@@ -0,0 +1,159 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+# Responses that mean "slow down"
+CONGESTION_STATUS = {429, 500, 502, 503, 504}
+
+
+class HostRate:
+    """
+    AIMD state of one host: concurrency window, minimum interval between requests and latency average.
+    """
+    def __init__(self, controller):
+        self.limit = float(controller.initial_limit)
+        self.interval = controller.min_interval
+        self.in_flight = 0
+        self.last_start = 0.0
+        self.blocked_until = 0.0
+        self.latency = None
+        self.condition = threading.Condition()
+
+
+class RateCall:
+    """
+    Handle of one request: report the response with done(response) to feed the controller.
+    """
+    def __init__(self):
+        self.status_code = None
+        self.retry_after = None
+
+    def done(self, response):
+        self.status_code = response.status_code
+        retry_after = response.headers.get("Retry-After")
+        if retry_after and retry_after.isdigit():
+            self.retry_after = int(retry_after)
+
+
+class AdaptiveRateController:
+    def __init__(self, initial_limit=4, min_limit=1, max_limit=16, min_interval=0.0, max_interval=10.0,
+                 target_latency=5.0, transfer_target_latency=60.0, decrease=0.5):
+        """
+        Shared back-pressure for the outbound calls, per host (AIMD): every successful fast response widens the
+        concurrency window by about one request per window and shortens the interval between requests;
+        a 429/5xx, a timeout/connection error or a latency over target_latency halves the window and
+        doubles the interval (a Retry-After header pauses the host).
+
+        :param initial_limit: Concurrent requests allowed per host at start.
+        :param min_limit: Lowest concurrency window.
+        :param max_limit: Highest concurrency window.
+        :param min_interval: Lowest seconds between two requests to the same host.
+        :param max_interval: Highest seconds between two requests to the same host.
+        :param target_latency: Seconds over which a response counts as congestion.
+        :param transfer_target_latency: Same, for the calls that move a large body (attachment downloads,
+                                        bulk saves), whose time grows with the size and not only with the load.
+        :param decrease: Multiplicative decrease of the window on congestion.
+        """
+        self.initial_limit = initial_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.target_latency = target_latency
+        self.transfer_target_latency = transfer_target_latency
+        self.decrease = decrease
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def configure(self, config):
+        """
+        Loads the parameters from the [RATE] section of config.ini.
+        """
+        if not config.has_section("RATE"):
+            return self
+        section = config["RATE"]
+        self.initial_limit = section.getint("initial_limit", self.initial_limit)
+        self.min_limit = section.getint("min_limit", self.min_limit)
+        self.max_limit = section.getint("max_limit", self.max_limit)
+        self.min_interval = section.getfloat("min_interval", self.min_interval)
+        self.max_interval = section.getfloat("max_interval", self.max_interval)
+        self.target_latency = section.getfloat("target_latency", self.target_latency)
+        self.transfer_target_latency = section.getfloat("transfer_target_latency", self.transfer_target_latency)
+        self.decrease = section.getfloat("decrease", self.decrease)
+        with self._lock:
+            self._hosts = {}
+        return self
+
+    def host(self, url):
+        host = urlparse(url).hostname or url
+        with self._lock:
+            return self._hosts.setdefault(host, HostRate(self))
+
+    def snapshot(self):
+        """
+        Current window and interval of every host (for logs and diagnostics).
+        """
+        with self._lock:
+            return {host: {"limit": round(state.limit, 2), "interval": round(state.interval, 3),
+                           "in_flight": state.in_flight, "latency": state.latency}
+                    for host, state in self._hosts.items()}
+
+    def _acquire(self, state):
+        with state.condition:
+            while True:
+                now = time.monotonic()
+                wait = max(state.blocked_until - now, state.last_start + state.interval - now)
+                if state.in_flight < int(state.limit) and wait <= 0:
+                    state.in_flight += 1
+                    state.last_start = now
+                    return
+                state.condition.wait(timeout=wait if wait > 0 else None)
+
+    def _release(self, state, seconds, congested, retry_after):
+        with state.condition:
+            state.in_flight -= 1
+            state.latency = seconds if state.latency is None else 0.8 * state.latency + 0.2 * seconds
+            if congested:
+                state.limit = max(self.min_limit, state.limit * self.decrease)
+                state.interval = min(self.max_interval, max(state.interval * 2, 0.1))
+                if retry_after:
+                    state.blocked_until = time.monotonic() + retry_after
+                logger.info(f"Rate limited: window {state.limit:.1f}, interval {state.interval:.2f}s")
+            else:
+                state.limit = min(self.max_limit, state.limit + 1.0 / state.limit)
+                state.interval = max(self.min_interval, state.interval * 0.9)
+            state.condition.notify_all()
+
+    @contextmanager
+    def request(self, url, target_latency=None):
+        """
+        with rate_controller.request(url) as call:
+            response = http.post(url, ...)
+            call.done(response)
+
+        Waits for the host's window/interval; an exception raised inside counts as congestion.
+
+        :param url: URL of the call (paced per host).
+        :param target_latency: Seconds over which this call counts as congestion (default: target_latency;
+                               the transfers pass transfer_target_latency).
+        """
+        target_latency = self.target_latency if target_latency is None else target_latency
+        state = self.host(url)
+        self._acquire(state)
+        call = RateCall()
+        start = time.monotonic()
+        congested = True
+        try:
+            yield call
+            seconds = time.monotonic() - start
+            congested = call.status_code in CONGESTION_STATUS or seconds > target_latency
+        finally:
+            self._release(state, time.monotonic() - start, congested, call.retry_after)
+
+
+# Shared by the extractors, the attachment pipeline and the savers of the process
+rate_controller = AdaptiveRateController()
@@ -0,0 +1,103 @@
+import logging
+import threading
+import time
+
+import requests
+
+from application.rate_controller import rate_controller
+
+logger = logging.getLogger(__name__)
+
+
+class ReferenceDataCache:
+    def __init__(self, default_ttl=300):
+        """
+        Process-wide cache of reference data returned by the persistence API (tipos de notificación,
+        RUCs, estudios contables), with TTL and ETag/If-None-Match revalidation.
+
+        :param default_ttl: Seconds a cached value is served without asking the API again.
+        """
+        self.default_ttl = default_ttl
+        self._entries = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def get_json(self, url, http=None, ttl=None, transform=None):
+        """
+        Returns the (transformed) JSON of url, from the cache while it is fresh.
+        Once expired, the API is asked again with If-None-Match and a 304 keeps the cached value.
+
+        :param url: Endpoint URL, also the cache key.
+        :param http: requests.Session (or the requests module) used for the call.
+        :param ttl: Seconds the value is considered fresh. Default is default_ttl.
+        :param transform: Optional callable applied once to the JSON before caching it (e.g. build an index).
+        :return: The cached value.
+        :raises requests.HTTPError: If the request fails.
+        """
+        http = http or requests
+        ttl = self.default_ttl if ttl is None else ttl
+
+        # One lock per key: concurrent callers of the same URL wait for a single request
+        with self._key_lock(url):
+            entry = self._entries.get(url)
+            now = time.monotonic()
+            if entry is not None and now - entry["fetched_at"] < ttl:
+                return entry["value"]
+
+            headers = {}
+            if entry is not None and entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+
+            logger.info(f"Calling endpoint: {url}")
+            with rate_controller.request(url) as call:
+                response = http.get(url, headers=headers)
+                call.done(response)
+            if response.status_code == 304 and entry is not None:
+                entry["fetched_at"] = now
+                return entry["value"]
+
+            # Raise an exception for HTTP error responses
+            response.raise_for_status()
+
+            data = response.json()
+            value = transform(data) if transform else data
+            self._entries[url] = {"value": value, "etag": response.headers.get("ETag"), "fetched_at": now}
+            return value
+
+    def invalidate(self, url=None):
+        """
+        Removes one URL (or everything) from the cache.
+        """
+        with self._lock:
+            if url is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(url, None)
+
+
+class TiposNotificacionIndex:
+    """
+    Tipos de notificación indexed by their upper-cased name.
+    """
+    DEFAULT = "SIN TIPO"
+
+    def __init__(self, tipos):
+        self.tipos = tipos
+        self._by_name = {str(t['nombre']).upper(): t for t in tipos}
+
+    def get(self, name):
+        """
+        Returns the tipo whose name matches (case-insensitive), or the "SIN TIPO" one.
+        """
+        return self._by_name.get(str(name).upper()) or self._by_name.get(self.DEFAULT)
+
+    def __contains__(self, name):
+        return str(name).upper() in self._by_name
+
+
+# Shared by every service of the process
+reference_data_cache = ReferenceDataCache()
@@ -0,0 +1,118 @@
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+logger = logging.getLogger(__name__)
+
+
+def process_shard(config_values, extractor_name, save_to, estudio_contable_ruc, shard, run_id=None):
+    """
+    Worker process entry point: opens its own browser session and processes a shard of RUCs.
+
+    :param config_values: config.ini as a plain dict (see notification_factory.config_to_dict).
+    :param extractor_name: Extractor to build in the worker ("manual", "http" or "llm").
+    :param save_to: Persistence to build in the worker ("db" or "excel").
+    :param estudio_contable_ruc: RUC of the Estudio Contable being processed.
+    :param shard: List of RUC contexts (RUC, USER, PSW, LAST).
+    :param run_id: (Optional) Run of the RunJournal: every RUC is journaled as soon as the worker finishes it,
+                   so a run whose worker process crashed is resumed from the RUCs not persisted.
+    :return: List of per-RUC outcomes.
+    """
+    # Imported here so the worker builds everything inside its own process
+    from application.host_limiter import host_limiter
+    from application.rate_controller import rate_controller
+    from cross_cutting.settings import Settings
+    from infrastructure import notification_factory
+
+    if not logging.getLogger().handlers:
+        logging.basicConfig(level=logging.INFO,
+                            format='%(asctime)s - %(processName)s - %(name)s - %(levelname)s - %(message)s',
+                            datefmt='%Y-%m-%dT%H:%M:%S')
+
+    config = notification_factory.config_from_dict(config_values)
+    # Per-process limits: each worker process caps its own calls to every host
+    host_limiter.configure(config)
+    rate_controller.configure(config)
+    process_sunat = notification_factory.create_notification_sunat(
+        config,
+        notification_factory.create_extractor(extractor_name, config),
+        # Launched on the first RUC: a browser that cannot start fails that RUC, and the next one retries
+        None,
+        notification_factory.create_persist(save_to, config),
+        Settings(ESTUDIO_CONTABLE_RUC=estudio_contable_ruc),
+        journal=notification_factory.create_run_journal(config) if run_id is not None else None,
+        # The run was started by the parent process
+        run_id=run_id)
+
+    outcomes = []
+    try:
+        for context in shard:
+            outcome = process_sunat.process_ruc_safe(context)
+            outcomes.append(outcome)
+            if outcome["status"] != "ok":
+                # The browser may be left in an unknown state (or closed): start a fresh one
+                process_sunat.renew_session()
+    finally:
+        process_sunat.close()
+    return outcomes
+
+
+class RucWorkerPool:
+    def __init__(self, workers, config, extractor_name="manual", save_to="db"):
+        """
+        Pool of isolated browser workers, each one running in its own process.
+
+        :param workers: Number of worker processes (one Chrome per process).
+        :param config: config.ini loaded.
+        :param extractor_name: Extractor used by the workers.
+        :param save_to: Persistence used by the workers.
+        """
+        self.workers = max(1, int(workers))
+        self.config = config
+        self.extractor_name = extractor_name
+        self.save_to = save_to
+
+    @staticmethod
+    def shard(companies, workers):
+        """
+        Splits the RUC list round-robin so every worker gets a similar amount of work.
+        """
+        return [shard for shard in (companies[i::workers] for i in range(workers)) if shard]
+
+    def run(self, companies, estudio_contable_ruc, run_id=None):
+        """
+        Processes all the RUCs concurrently and merges the per-RUC outcomes.
+
+        :param companies: List of RUC contexts returned by EstudioContableService.
+        :param estudio_contable_ruc: RUC of the Estudio Contable.
+        :param run_id: (Optional) Run of the RunJournal, journaled per RUC by the workers.
+        :return: List of outcomes, in the same order as companies.
+        """
+        from infrastructure.notification_factory import config_to_dict
+
+        shards = self.shard(companies, min(self.workers, len(companies)))
+        if not shards:
+            return []
+        logger.info(f"Processing {len(companies)} RUCs with {len(shards)} workers")
+
+        config_values = config_to_dict(self.config)
+        outcomes = {}
+        # spawn: never fork a process that already has browser/driver threads running
+        with ProcessPoolExecutor(max_workers=len(shards), mp_context=multiprocessing.get_context("spawn")) as executor:
+            futures = {
+                executor.submit(process_shard, config_values, self.extractor_name, self.save_to,
+                                estudio_contable_ruc, shard, run_id): shard
+                for shard in shards
+            }
+            for future in as_completed(futures):
+                try:
+                    for outcome in future.result():
+                        outcomes[outcome["ruc"]] = outcome
+                except Exception as e:
+                    # The whole worker died (e.g. Chrome could not start): mark its RUCs as failed
+                    logger.error(f"Worker failed: {e}")
+                    for context in futures[future]:
+                        outcomes[context["RUC"]] = {"ruc": context["RUC"], "status": "failed",
+                                                    "notifications": 0, "error": str(e)}
+
+        return [outcomes[context["RUC"]] for context in companies]
@@ -6,4 +6,10 @@ class SaveNotificationBase(ABC):
 
     @abstractmethod
     def save(self, notifications, ruc):
-        pass
\ No newline at end of file
+        pass
+
+    def close(self):
+        """
+        Called once the run is over, so outputs spanning several RUCs can be completed.
+        """
+        pass
@@ -0,0 +1,90 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+from datetime import datetime
+
+from application.incremental_scanner import parse_sunat_date
+from cross_cutting.file_lock import file_lock
+
+logger = logging.getLogger(__name__)
+
+
+class WatermarkStore:
+    def __init__(self, path):
+        """
+        Per-RUC watermark of the newest notification persisted: {"date": ISO date, "ids": [...]}.
+        Stored in a JSON file that is replaced atomically; every update holds a lock file (path + ".lock"),
+        so the threads and worker processes writing the same file do not drop each other's RUCs.
+        When [STATE] state_db is set the watermarks are kept in the state store instead (see StateWatermarkStore).
+
+        :param path: JSON file of the watermarks.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def newest(notifications):
+        """
+        Returns (newest publish date, ids published at that date) of the notifications, or None.
+        """
+        dated = [(parse_sunat_date(n["publish_date"]), str(n["id"])) for n in notifications]
+        dated = [(date, notification_id) for date, notification_id in dated if date is not None]
+        if not dated:
+            return None
+
+        newest = max(date for date, _ in dated)
+        return newest, {notification_id for date, notification_id in dated if date == newest}
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Watermarks {self.path} could not be read: {e}")
+            return {}
+
+    def get(self, ruc):
+        """
+        Returns the watermark of the RUC, or None.
+        """
+        with self._lock:
+            return self._load().get(str(ruc))
+
+    def advance(self, ruc, notifications):
+        """
+        Moves the watermark of the RUC to the newest of the persisted notifications. Never moves it back.
+
+        :param ruc: RUC of the mailbox.
+        :param notifications: Notifications already persisted (id, publish_date).
+        """
+        found = self.newest(notifications)
+        if found is None:
+            return
+        newest, ids = found
+
+        with self._lock, file_lock(self.path):
+            # Re-read under the lock so watermarks of other RUCs written meanwhile are kept
+            watermarks = self._load()
+            current = watermarks.get(str(ruc))
+            if current is not None:
+                current_date = datetime.fromisoformat(current["date"])
+                if current_date > newest:
+                    return
+                if current_date == newest:
+                    ids |= set(current.get("ids", []))
+
+            watermarks[str(ruc)] = {"date": newest.isoformat(), "ids": sorted(ids)}
+            self._write(watermarks)
+        logger.info(f"Watermark RUC {ruc}: {newest.isoformat()}")
+
+    def _write(self, watermarks):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(watermarks, f, indent=2)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,62 @@
+from abc import ABC, abstractmethod
+
+
+class WorkQueue(ABC):
+    """
+    Queue of RUC tasks shared by the workers that can reach the backend (SqliteWorkQueue: the workers of
+    one host; replicas on several hosts need a backend they can all reach). A task only carries the estudio and the RUC
+    (never the credentials); it is claimed with a lease that the worker extends with heartbeats,
+    and a task whose lease expired is handed to another worker.
+
+    Task: {"id", "estudio_contable_ruc", "ruc", "attempts"}
+    """
+
+    @abstractmethod
+    def enqueue(self, estudio_contable_ruc, rucs):
+        """
+        Adds one task per RUC; RUCs already queued or leased for the estudio are not added twice.
+
+        :return: Number of tasks added.
+        """
+
+    @abstractmethod
+    def claim(self, worker_id, lease_seconds):
+        """
+        Leases the oldest available task (queued, or leased with an expired lease) to worker_id.
+
+        :return: The task, or None when the queue is empty.
+        """
+
+    @abstractmethod
+    def heartbeat(self, task_id, worker_id, lease_seconds):
+        """
+        Extends the lease of a task.
+
+        :return: False when the lease was lost (expired and claimed by another worker).
+        """
+
+    @abstractmethod
+    def complete(self, task_id, worker_id, outcome):
+        """
+        Marks a leased task as done.
+        """
+
+    @abstractmethod
+    def fail(self, task_id, worker_id, error):
+        """
+        Releases a leased task after a failure: queued again until max_attempts, then failed.
+        """
+
+    @abstractmethod
+    def requeue_expired(self):
+        """
+        Puts the tasks whose lease expired back in the queue (or fails them after max_attempts).
+
+        :return: Number of tasks requeued.
+        """
+
+    @abstractmethod
+    def stats(self):
+        """
+        :return: Dictionary status -> number of tasks.
+        """
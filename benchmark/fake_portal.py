@@ -0,0 +1,329 @@
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+logger = logging.getLogger(__name__)
+
+SESSION_COOKIE = "ITMENUSESSION"
+TIPOS = ["NOTIFICACIONES", "RESOLUCIONES", "AVISOS", "SIN TIPO"]
+
+LOGIN_PAGE = """<!DOCTYPE html>
+<html><body>
+<form onsubmit="return false;">
+  <input id="txtRuc" type="text">
+  <input id="txtUsuario" type="text">
+  <input id="txtContrasena" type="password">
+  <button id="btnAceptar" type="button" onclick="login()">Iniciar sesión</button>
+</form>
+<script>
+function login() {
+  document.cookie = "%(cookie)s=" + document.getElementById("txtRuc").value + "; path=/";
+  setTimeout(function () { location.href = "/menu"; }, %(delay_ms)d);
+}
+</script>
+</body></html>"""
+
+MENU_PAGE = """<!DOCTYPE html>
+<html><body>
+<button id="btnSalir" type="button" onclick="salir()">Salir</button>
+<a id="aOpcionBuzon" href="#" onclick="buzon(); return false;">Buzón electrónico</a>
+%(modal)s
+<div id="contenido"></div>
+<script>
+function buzon() {
+  document.getElementById("contenido").innerHTML = '<iframe name="iframeApplication" src="/visor"></iframe>';
+}
+function salir() {
+  document.cookie = "%(cookie)s=; expires=Thu, 01 Jan 1970 00:00:00 GMT; path=/";
+  location.href = "/login";
+}
+</script>
+</body></html>"""
+
+MODAL_IFRAME = '<iframe id="ifrVCE" src="/modal"></iframe>'
+
+MODAL_PAGE = """<!DOCTYPE html>
+<html><body>
+<div id="modalInformativoValidacionDatos">
+  <button id="btnFinalizarValidacionDatos" onclick="this.parentNode.style.display='none'">Finalizar</button>
+</div>
+<div id="divPanelIU02">
+  <button id="btnCerrar" onclick="this.parentNode.style.display='none'">Cerrar</button>
+</div>
+</body></html>"""
+
+VISOR_PAGE = """<!DOCTYPE html>
+<html><body>
+<ul id="listaMensajes">
+%(rows)s
+</ul>
+<div id="detalle"></div>
+<script>
+function abrir(id) {
+  document.getElementById("detalle").innerHTML =
+    '<iframe name="contenedorMensaje" src="/visor/detalle?id=' + id + '"></iframe>';
+}
+</script>
+</body></html>"""
+
+VISOR_ROW = """<li id="%(id)s">
+  <a class="linkMensaje" href="#" onclick="abrir('%(id)s'); return false;">%(subject)s</a>
+  <small class="fecPublica">%(date)s</small>
+  <div><span class="label tag%(tag_index)d">%(tag)s</span></div>
+</li>"""
+
+DETAIL_PAGE = """<!DOCTYPE html>
+<html><body>
+<h4>%(subject)s</h4>
+%(links)s
+</body></html>"""
+
+
+class FakeMailbox:
+    def __init__(self, messages=20, attachments=1, pdf_bytes=50 * 1024, page_size=10):
+        """
+        Deterministic synthetic mailbox: every RUC has the same number of messages, newest-first.
+
+        :param messages: Messages per RUC.
+        :param attachments: PDFs per message.
+        :param pdf_bytes: Size of every PDF.
+        :param page_size: Messages per page (the visor page renders the first one).
+        """
+        self.messages = messages
+        self.attachments = attachments
+        self.pdf_bytes = pdf_bytes
+        self.page_size = page_size
+        self.start = datetime.now().replace(microsecond=0)
+
+    def message(self, ruc, index):
+        tag_index = index % len(TIPOS)
+        return {
+            "id": f"{ruc}{index:05d}",
+            "subject": f"Notificación {index} del RUC {ruc}",
+            "date": (self.start - timedelta(hours=index)).strftime("%d/%m/%Y %H:%M:%S"),
+            "tag": TIPOS[tag_index],
+            "tag_index": tag_index,
+        }
+
+    def page(self, ruc, page):
+        first = (page - 1) * self.page_size
+        return [self.message(ruc, i) for i in range(first, min(first + self.page_size, self.messages))]
+
+    def find(self, message_id):
+        ruc, index = message_id[:-5], int(message_id[-5:])
+        return self.message(ruc, index)
+
+    def pdf(self, message_id, file_id):
+        header = f"%PDF-1.4\n% {message_id} {file_id}\n".encode()
+        return header + b"0" * max(0, self.pdf_bytes - len(header)) + b"\n%%EOF\n"
+
+
+class FakePortalHandler(BaseHTTPRequestHandler):
+    server_version = "FakeSunat/1.0"
+
+    # --- helpers -------------------------------------------------------------------------------------------------
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+    def send(self, status, body, content_type="text/html; charset=utf-8", headers=None):
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, payload, status=200):
+        self.send(status, json.dumps(payload), "application/json")
+
+    def session_ruc(self):
+        cookie = SimpleCookie(self.headers.get("Cookie", ""))
+        return cookie[SESSION_COOKIE].value if SESSION_COOKIE in cookie and cookie[SESSION_COOKIE].value else None
+
+    def body(self):
+        length = int(self.headers.get("Content-Length", 0) or 0)
+        return self.rfile.read(length) if length else b""
+
+    @property
+    def portal(self):
+        return self.server.portal
+
+    # --- routes --------------------------------------------------------------------------------------------------
+    def do_GET(self):
+        time.sleep(self.portal.latency)
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        path = url.path.rstrip("/") or "/"
+        mailbox = self.portal.mailbox
+
+        if path in ("/", "/login"):
+            return self.send(200, LOGIN_PAGE % {"cookie": SESSION_COOKIE, "delay_ms": int(self.portal.latency * 1000)})
+        if path == "/modal":
+            return self.send(200, MODAL_PAGE)
+
+        if path.startswith("/api/"):
+            return self.api_get(path[len("/api"):], query)
+
+        ruc = self.session_ruc()
+        if ruc is None:
+            # Expired session: the real portal redirects to the login page
+            return self.send(302, "", headers={"Location": "/login"})
+
+        if path == "/menu":
+            return self.send(200, MENU_PAGE % {"cookie": SESSION_COOKIE,
+                                               "modal": MODAL_IFRAME if self.portal.modals else ""})
+        if path == "/visor":
+            rows = "\n".join(VISOR_ROW % message for message in mailbox.page(ruc, 1))
+            return self.send(200, VISOR_PAGE % {"rows": rows})
+        if path == "/visor/detalle":
+            return self.send(200, self.detail_html(query.get("id", "")))
+        if path == "/visor/listNotiMenPag":
+            messages = mailbox.page(ruc, int(query.get("page", "1")))
+            return self.send_json({"rows": [{"codMensaje": m["id"], "desAsunto": m["subject"],
+                                             "fecPublica": m["date"], "desEtiqueta": m["tag"]} for m in messages]})
+        if path == "/visor/obtenerDetalleNotiMen":
+            message_id = query.get("codigoMensaje", "")
+            return self.send_json({"codMensaje": message_id,
+                                   "listArchivos": [{"idArchivo": str(i + 1), "indMensaje": "1"}
+                                                    for i in range(mailbox.attachments)]})
+        return self.send(404, "Not found")
+
+    def do_POST(self):
+        time.sleep(self.portal.latency)
+        path = urlparse(self.path).path.rstrip("/")
+
+        if path.startswith("/api/"):
+            return self.api_post(path[len("/api"):])
+
+        ruc = self.session_ruc()
+        if ruc is None:
+            return self.send(302, "", headers={"Location": "/login"})
+
+        if path == "/visor/consultarAlertas":
+            return self.send_json({"alertas": []})
+        if path == "/visor/bajarArchivo":
+            form = {k: v[0] for k, v in parse_qs(self.body().decode()).items()}
+            message_id, file_id = form.get("idMensaje", ""), form.get("idArchivo", "")
+            return self.send(200, self.portal.mailbox.pdf(message_id, file_id), "application/pdf",
+                             {"Content-Disposition": f'attachment; filename="{message_id}_{file_id}.pdf"'})
+        return self.send(404, "Not found")
+
+    def detail_html(self, message_id):
+        message = self.portal.mailbox.find(message_id)
+        links = "\n".join(
+            f'<a href="javascript:goArchivoDescarga({i + 1},1,{message_id})">archivo{i + 1}.pdf</a>'
+            for i in range(self.portal.mailbox.attachments))
+        return DETAIL_PAGE % {"subject": message["subject"], "links": links}
+
+    # --- persistence API stand-in --------------------------------------------------------------------------------
+    def api_get(self, path, query):
+        if path.startswith("/estudios_contables/ruc/"):
+            return self.send_json({"numero_ruc": path.rsplit("/", 1)[-1], "rucs": [
+                {"numero_ruc": ruc, "usuario_buzon": "USUARIO", "password_buzon": "CLAVE",
+                 "fecha_ultima_notificacion": None} for ruc in self.portal.rucs]})
+        if path.startswith("/rucs/"):
+            ruc = path.rsplit("/", 1)[-1]
+            return self.send_json({"id": self.portal.rucs.index(ruc) + 1 if ruc in self.portal.rucs else 0,
+                                   "numero_ruc": ruc})
+        if path == "/tipos_notificacion":
+            return self.send_json([{"id": i + 1, "nombre": nombre} for i, nombre in enumerate(TIPOS)])
+        return self.send(404, "Not found")
+
+    def api_post(self, path):
+        payload = json.loads(self.body() or b"null")
+        if path == "/notificaciones/bulk":
+            self.portal.record(payload)
+            return self.send_json({"created": len(payload)}, status=201)
+        if path == "/notificaciones":
+            self.portal.record([payload])
+            return self.send_json(payload, status=201)
+        return self.send(404, "Not found")
+
+
+class FakePortal:
+    def __init__(self, rucs=5, messages=20, attachments=1, pdf_bytes=50 * 1024, latency=0.05, modals=True,
+                 host="127.0.0.1", port=0):
+        """
+        Local stand-in of the SUNAT portal (login, menu, validation modals, visor, bajarArchivo and the visor
+        JSON endpoints) plus the persistence API under /api, served on a background thread.
+
+        :param rucs: Number of synthetic RUCs of the estudio contable.
+        :param messages: Messages in every mailbox.
+        :param attachments: PDFs per message.
+        :param pdf_bytes: Size of every PDF.
+        :param latency: Seconds added to every request.
+        :param modals: Show the ifrVCE validation modals after the login.
+        :param port: 0 = any free port.
+        """
+        self.rucs = [f"20{i:09d}" for i in range(1, rucs + 1)]
+        self.mailbox = FakeMailbox(messages=messages, attachments=attachments, pdf_bytes=pdf_bytes)
+        self.latency = latency
+        self.modals = modals
+        self.saved = []
+        self._saved_lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), FakePortalHandler)
+        self._server.daemon_threads = True
+        self._server.portal = self
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def record(self, payloads):
+        with self._saved_lock:
+            self.saved.extend(payloads)
+
+    def configure(self, config):
+        """
+        Points the WEBSITE and URLS sections of a loaded config.ini to this portal.
+        """
+        config["WEBSITE"]["url_start"] = f"{self.base_url}/login"
+        config["WEBSITE"]["url_menu"] = f"{self.base_url}/menu"
+        config["WEBSITE"]["url_visor"] = f"{self.base_url}/visor"
+        config["WEBSITE"]["url_download_attach"] = f"{self.base_url}/visor/bajarArchivo"
+        config["URLS"]["persist_base_url"] = f"{self.base_url}/api"
+        return config
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-portal", daemon=True)
+        self._thread.start()
+        logger.info(f"Fake SUNAT portal listening on {self.base_url}")
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Local stand-in of the SUNAT portal")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--rucs", type=int, default=5)
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    portal = FakePortal(rucs=args.rucs, messages=args.messages, latency=args.latency, port=args.port).start()
+    try:
+        portal._thread.join()
+    except KeyboardInterrupt:
+        portal.stop()
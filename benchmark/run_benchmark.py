@@ -0,0 +1,182 @@
+import argparse
+import configparser
+import functools
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from application.estudio_contable_service import EstudioContableService
+from application.ruc_worker_pool import RucWorkerPool
+from benchmark.fake_portal import FakePortal
+from cross_cutting.settings import Settings
+from infrastructure import notification_factory
+
+logger = logging.getLogger(__name__)
+
+ESTUDIO_CONTABLE_RUC = "20999999999"
+
+
+class StageRecorder:
+    """
+    Measures the seconds spent in every stage (method call) of the pipeline.
+    """
+    def __init__(self):
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    def wrap(self, instance, method_name, stage):
+        method = getattr(instance, method_name)
+
+        @functools.wraps(method)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.samples.setdefault(stage, []).append(time.perf_counter() - start)
+
+        setattr(instance, method_name, timed)
+
+    def wrap_iter(self, instance, method_name, stage):
+        """
+        Same as wrap for a generator method: measured until the generator is exhausted.
+        """
+        method = getattr(instance, method_name)
+
+        @functools.wraps(method)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                yield from method(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.samples.setdefault(stage, []).append(time.perf_counter() - start)
+
+        setattr(instance, method_name, timed)
+
+    def summary(self):
+        report = {}
+        for stage, samples in self.samples.items():
+            ordered = sorted(samples)
+            report[stage] = {
+                "count": len(samples),
+                "total_seconds": round(sum(samples), 3),
+                "mean_seconds": round(statistics.mean(samples), 3),
+                "p95_seconds": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+            }
+        return report
+
+
+def benchmark_config(portal, work_dir, args):
+    """
+    config.ini pointed to the fake portal, with every local state under work_dir.
+    """
+    config = configparser.ConfigParser()
+    config.read(args.config)
+    portal.configure(config)
+    for section in ("ATTACHMENTS", "STATE", "SESSION_CACHE", "BROWSER", "PROCESSING", "EXTRACTOR"):
+        if not config.has_section(section):
+            config.add_section(section)
+    config["ATTACHMENTS"]["storage"] = "local"
+    config["ATTACHMENTS"]["local_path"] = os.path.join(work_dir, "attachments")
+    config["ATTACHMENTS"]["manifest_path"] = os.path.join(work_dir, "attachments_manifest.json")
+    config["STATE"]["watermark_path"] = os.path.join(work_dir, "watermarks.json")
+    config["STATE"]["state_db"] = os.path.join(work_dir, "state.db") if args.state else ""
+    config["SESSION_CACHE"]["enabled"] = "false"
+    config["BROWSER"]["pool_size"] = "0"
+    config["PROCESSING"]["workers"] = str(args.workers)
+    return config
+
+
+def run(args):
+    with FakePortal(rucs=args.rucs, messages=args.messages, attachments=args.attachments,
+                    pdf_bytes=args.pdf_kb * 1024, latency=args.latency, modals=not args.no_modals) as portal, \
+            tempfile.TemporaryDirectory(prefix="sunat-benchmark-") as work_dir:
+        config = benchmark_config(portal, work_dir, args)
+        recorder = StageRecorder()
+
+        extractor = notification_factory.create_extractor(args.extractor, config)
+        persist = notification_factory.create_persist("db", config)
+        session = None
+        worker_pool = None
+        if args.workers > 1:
+            # Stages run in the worker processes: only the totals are measured
+            worker_pool = RucWorkerPool(args.workers, config, extractor_name=args.extractor, save_to="db")
+        else:
+            start = time.perf_counter()
+            session = notification_factory.create_session(config)
+            recorder.samples["browser_start"] = [time.perf_counter() - start]
+            recorder.wrap(session, "open_mailbox", "login_and_mailbox")
+            recorder.wrap(session, "close_extraction", "close_mailbox")
+            recorder.wrap_iter(extractor, "iter_extract", "extract")
+            recorder.wrap(persist, "save", "persist")
+
+        process_sunat = notification_factory.create_notification_sunat(
+            config,
+            extractor,
+            session,
+            persist,
+            Settings(ESTUDIO_CONTABLE_RUC=ESTUDIO_CONTABLE_RUC),
+            estudio_contable_svc=EstudioContableService(config=config),
+            worker_pool=worker_pool)
+
+        start = time.perf_counter()
+        outcomes = process_sunat.process_notification()
+        elapsed = time.perf_counter() - start
+
+        ok = [outcome for outcome in outcomes if outcome["status"] == "ok"]
+        return {
+            "parameters": vars(args),
+            "rucs": len(outcomes),
+            "rucs_ok": len(ok),
+            "notifications": sum(outcome["notifications"] for outcome in ok),
+            "notifications_saved": len(portal.saved),
+            "elapsed_seconds": round(elapsed, 3),
+            "rucs_per_minute": round(len(ok) / elapsed * 60, 2) if elapsed else None,
+            "stages": recorder.summary(),
+        }
+
+
+def print_report(report):
+    print(f"RUCs: {report['rucs_ok']}/{report['rucs']}  notifications: {report['notifications']} "
+          f"(saved {report['notifications_saved']})")
+    print(f"Elapsed: {report['elapsed_seconds']}s  RUCs/min: {report['rucs_per_minute']}")
+    if report["stages"]:
+        print(f"{'stage':<20}{'count':>8}{'total s':>12}{'mean s':>10}{'p95 s':>10}")
+        for stage, values in report["stages"].items():
+            print(f"{stage:<20}{values['count']:>8}{values['total_seconds']:>12}"
+                  f"{values['mean_seconds']:>10}{values['p95_seconds']:>10}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of NotificationSunat against a local fake portal")
+    parser.add_argument("--rucs", type=int, default=5, help="Synthetic RUCs of the estudio contable")
+    parser.add_argument("--messages", type=int, default=10, help="Messages per mailbox")
+    parser.add_argument("--attachments", type=int, default=1, help="PDFs per message")
+    parser.add_argument("--pdf-kb", type=int, default=50, help="Size of every PDF (KB)")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds added to every portal request")
+    parser.add_argument("--no-modals", action="store_true", help="Do not show the validation modals")
+    parser.add_argument("--extractor", choices=["manual", "http"], default="manual")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes ([PROCESSING] workers)")
+    parser.add_argument("--state", action="store_true", help="Enable the SQLite state store")
+    parser.add_argument("--config", default="config.ini")
+    parser.add_argument("--json", help="Also write the report to this file")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    report = run(args)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
@@ -4,7 +4,7 @@ from argparse import Namespace
 def parse_opt():
     parser = argparse.ArgumentParser(description='Automatic SUNAT notification extraction from mailbox')
     parser.add_argument('--extractor', dest='extractor', action='store', 
-                        default="manual", choices=['manual', 'llm'],
+                        default="manual", choices=['manual', 'http', 'llm', 'hybrid'],
                         help='List of notifications extractor from HTML', required=False)
 
     parser.add_argument('--save_to', dest='save_to', action='store', 
@@ -0,0 +1,111 @@
+import contextvars
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import CollectorRegistry, Counter, Histogram, CONTENT_TYPE_LATEST, generate_latest
+
+logger = logging.getLogger(__name__)
+
+# Seconds: from a quick JSON call to a whole mailbox
+STAGE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+STAGE_SECONDS = Histogram("sunat_stage_seconds", "Seconds spent in every stage of the extraction",
+                          ["stage", "estudio"], buckets=STAGE_BUCKETS)
+STAGE_FAILURES = Counter("sunat_stage_failures_total", "Stages that raised an exception", ["stage", "estudio"])
+NOTIFICATIONS = Counter("sunat_notifications_total", "Notifications by result (extracted, saved, failed, skipped)",
+                        ["estudio", "result"])
+ATTACHMENTS = Counter("sunat_attachments_total",
+                      "Attachments by result (downloaded, uploaded, existing, deduplicated, failed)",
+                      ["estudio", "result"])
+ATTACHMENT_BYTES = Counter("sunat_attachment_bytes_total", "Attachment bytes downloaded and uploaded",
+                           ["estudio", "direction"])
+RUCS = Counter("sunat_rucs_total", "RUCs processed by status", ["estudio", "status"])
+LIST_ROWS = Counter("sunat_list_rows_total", "Mailbox rows by parser (selectors, llm, unparsed)",
+                    ["estudio", "parser"])
+
+# Estudio and RUC being processed, so nested stages are tagged without passing them around
+_estudio = contextvars.ContextVar("estudio", default="")
+_ruc = contextvars.ContextVar("ruc", default="")
+
+
+@contextmanager
+def bind(estudio=None, ruc=None):
+    """
+    Tags the stages run inside the block (in this thread) with the estudio and the RUC.
+    """
+    tokens = []
+    if estudio is not None:
+        tokens.append((_estudio, _estudio.set(str(estudio))))
+    if ruc is not None:
+        tokens.append((_ruc, _ruc.set(str(ruc))))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+def current_estudio():
+    return _estudio.get()
+
+
+@contextmanager
+def stage(name, estudio=None, ruc=None):
+    """
+    Timing span of a stage: observed in sunat_stage_seconds and logged with the RUC.
+    The RUC is kept out of the labels (one series per RUC would not scale); it goes to the log.
+
+    :param name: Stage name (login, open_mailbox, list_extraction, ...).
+    :param estudio: Estudio contable; defaults to the bound one (see bind).
+    :param ruc: RUC; defaults to the bound one.
+    """
+    estudio = str(estudio) if estudio is not None else _estudio.get()
+    ruc = str(ruc) if ruc is not None else _ruc.get()
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_FAILURES.labels(stage=name, estudio=estudio).inc()
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        STAGE_SECONDS.labels(stage=name, estudio=estudio).observe(seconds)
+        logger.debug(f"Stage {name} - Estudio: {estudio}, RUC: {ruc}: {seconds:.3f}s")
+
+
+def count_notifications(result, amount=1, estudio=None):
+    if amount:
+        NOTIFICATIONS.labels(estudio=estudio if estudio is not None else _estudio.get(), result=result).inc(amount)
+
+
+def count_attachment(result, estudio=None, downloaded_bytes=0, uploaded_bytes=0):
+    estudio = str(estudio) if estudio is not None else _estudio.get()
+    ATTACHMENTS.labels(estudio=estudio, result=result).inc()
+    if downloaded_bytes:
+        ATTACHMENT_BYTES.labels(estudio=estudio, direction="downloaded").inc(downloaded_bytes)
+    if uploaded_bytes:
+        ATTACHMENT_BYTES.labels(estudio=estudio, direction="uploaded").inc(uploaded_bytes)
+
+
+def count_ruc(status, estudio=None):
+    RUCS.labels(estudio=estudio if estudio is not None else _estudio.get(), status=status).inc()
+
+
+def count_rows(parser, amount=1, estudio=None):
+    if amount:
+        LIST_ROWS.labels(estudio=estudio if estudio is not None else _estudio.get(), parser=parser).inc(amount)
+
+
+def render():
+    """
+    Returns (body, content type) of the /metrics endpoint. With PROMETHEUS_MULTIPROC_DIR set,
+    the metrics of the RUC worker processes are aggregated too.
+    """
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,70 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+
+from cross_cutting.file_lock import file_lock
+
+logger = logging.getLogger(__name__)
+
+
+class AttachmentManifest:
+    def __init__(self, path):
+        """
+        Local manifest of the uploaded attachments: SHA-256 of the content -> gs:// path.
+        Every add holds a lock file (path + ".lock") and merges with the file on disk, and a lookup re-reads
+        the file when another process changed it, so concurrent jobs and worker processes of the host
+        keep each other's entries. When [STATE] state_db is set the manifest is kept in the state store instead
+        (see StateAttachmentManifest).
+
+        :param path: JSON file of the manifest.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = {}
+        # Modification time of the file when it was last read
+        self._mtime = None
+        with self._lock:
+            self._reload()
+
+    def _reload(self, force=False):
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        if mtime == self._mtime and not force:
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._entries.update(json.load(f))
+            self._mtime = mtime
+        except (OSError, ValueError) as e:
+            logger.warning(f"Attachment manifest {self.path} could not be read: {e}")
+
+    def get(self, sha256):
+        """
+        Returns the gs:// path already holding this content, or None.
+        """
+        with self._lock:
+            if sha256 not in self._entries:
+                # Another process may have uploaded it since the file was read
+                self._reload()
+            return self._entries.get(sha256)
+
+    def add(self, sha256, gcs_path):
+        with self._lock, file_lock(self.path):
+            # Re-read under the lock so the entries added by other processes meanwhile are kept
+            self._reload(force=True)
+            self._entries[sha256] = gcs_path
+            self._save()
+
+    def _save(self):
+        # Write to a temp file and rename, so the manifest is never left half written
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(self._entries, f)
+        os.replace(tmp_path, self.path)
+        self._mtime = os.path.getmtime(self.path)
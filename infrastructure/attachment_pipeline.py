@@ -0,0 +1,258 @@
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import requests
+from requests.adapters import HTTPAdapter
+from google.cloud import storage
+
+from application.host_limiter import host_limiter
+from application.rate_controller import rate_controller
+from cross_cutting import metrics
+from infrastructure.attachment_manifest import AttachmentManifest
+from infrastructure.state_store import StateStore, StateAttachmentManifest
+
+logger = logging.getLogger(__name__)
+
+BUCKET_NAME = "notificaciones-sunat-store"
+GCS_PROJECT = "estudios-contables"
+
+
+class AttachmentPipeline:
+    def __init__(self, config):
+        """
+        Background stage that downloads the attachments (bajarArchivo) and uploads the PDFs to GCS.
+        The extractor enqueues the attachments of every notification while it keeps clicking,
+        and joins the results back before returning the notifications.
+
+        :param config: config.ini loaded.
+        """
+        self.config = config
+        self.workers = config.getint("ATTACHMENTS", "workers", fallback=4)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="attachment")
+        self._pending = {}
+
+        # Pooled connections to SUNAT, shared by all the download threads
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.workers, pool_maxsize=self.workers)
+        self.http.mount("https://", adapter)
+        self.http.mount("http://", adapter)
+
+        # "gcs" (bucket) or "local" (files under local_path, used by the benchmark)
+        self.storage = config.get("ATTACHMENTS", "storage", fallback="gcs")
+        self.local_path = config.get("ATTACHMENTS", "local_path", fallback="./attachments")
+        self._storage_client = None
+        self._storage_lock = threading.Lock()
+
+        # Deduplication: content hash (per estudio and RUC) -> stored path, and the objects already in the bucket per RUC
+        # (kept in the state store when it is configured, so every worker process shares it)
+        state = StateStore.from_config(config)
+        if state is not None:
+            self.manifest = StateAttachmentManifest(state)
+        else:
+            self.manifest = AttachmentManifest(config.get("ATTACHMENTS", "manifest_path",
+                                                          fallback="./state/attachments_manifest.json"))
+        self._listings = {}
+        self._listing_lock = threading.Lock()
+
+    @property
+    def storage_client(self):
+        # One storage client for the whole pipeline, created on first use
+        with self._storage_lock:
+            if self._storage_client is None:
+                self._storage_client = storage.Client(project=GCS_PROJECT)
+            return self._storage_client
+
+    @property
+    def bucket(self):
+        return self.storage_client.bucket(BUCKET_NAME)
+
+    def stored_url(self, name):
+        if self.storage == "local":
+            return "file://" + os.path.abspath(os.path.join(self.local_path, name))
+        return f"gs://{BUCKET_NAME}/{name}"
+
+    def list_objects(self, prefix):
+        if self.storage == "local":
+            root = os.path.join(self.local_path, prefix)
+            return {os.path.relpath(os.path.join(directory, f), self.local_path).replace(os.sep, "/")
+                    for directory, _, files in os.walk(root) for f in files}
+        return {blob.name for blob in self.storage_client.list_blobs(BUCKET_NAME, prefix=prefix)}
+
+    def existing_objects(self, context):
+        """
+        Names of the objects already stored for the RUC. The prefix is listed once per RUC and extraction.
+        """
+        prefix = f"{context['estudio_contable_ruc']}/{context['ruc']}/"
+        with self._listing_lock:
+            if prefix not in self._listings:
+                try:
+                    self._listings[prefix] = self.list_objects(prefix)
+                except Exception as e:
+                    logger.warning(f"No se pudo listar {self.stored_url(prefix)}: {e}")
+                    self._listings[prefix] = set()
+            return self._listings[prefix]
+
+    def find_existing(self, context, notification_type, file_prefix):
+        """
+        Returns the object name of an attachment already uploaded (same message/file ids), or None.
+        """
+        folder = f"{context['estudio_contable_ruc']}/{context['ruc']}/{notification_type}/".replace(" ", "_")
+        for name in self.existing_objects(context):
+            if name == folder + file_prefix or name.startswith(folder + file_prefix + "_"):
+                return name
+        return None
+
+    def enqueue(self, notification, attachments, notification_type, context, cookies):
+        """
+        Queues the download of the attachments of a notification.
+
+        :param notification: Notification dict; its "url_archivo" is filled by join().
+        :param attachments: List of (id_archivo, ind_mensaje, id_mensaje) tuples.
+        :param notification_type: Notification type, used in the GCS path.
+        :param context: Extraction context (estudio_contable_ruc, ruc).
+        :param cookies: Cookies of the authenticated SUNAT session.
+        """
+        futures = [
+            self._executor.submit(self.process, id_archivo, ind_mensaje, id_mensaje, notification_type, context, cookies)
+            for id_archivo, ind_mensaje, id_mensaje in attachments
+        ]
+        self._pending.setdefault(id(notification), (notification, []))[1].extend(futures)
+
+    @staticmethod
+    def _set_paths(notification, futures):
+        gcs_paths = []
+        for future in futures:
+            try:
+                gcs_path = future.result()
+                if gcs_path:
+                    gcs_paths.append(gcs_path)
+            except Exception as e:
+                logger.warning(f"Error procesando adjunto de la notificación {notification.get('id')}: {e}")
+        notification["url_archivo"] = ",".join(gcs_paths)
+
+    def completed(self, notification):
+        """
+        Returns True, without waiting, when every attachment of the notification is processed
+        ("url_archivo" is set then). A notification without queued attachments is always completed.
+        """
+        entry = self._pending.get(id(notification))
+        if entry is None:
+            return True
+        if not all(future.done() for future in entry[1]):
+            return False
+        del self._pending[id(notification)]
+        self._set_paths(*entry)
+        return True
+
+    def join(self):
+        """
+        Waits for every queued attachment and sets "url_archivo" on its notification.
+        """
+        pending, self._pending = self._pending, {}
+        for notification, futures in pending.values():
+            self._set_paths(notification, futures)
+
+        # The next extraction lists the bucket again
+        with self._listing_lock:
+            self._listings = {}
+
+    def process(self, id_archivo, ind_mensaje, id_mensaje, notification_type, context, cookies):
+        """
+        Downloads one attachment and uploads it to GCS when it is a PDF.
+        Attachments already in the bucket are not downloaded again, and a content already uploaded
+        (same SHA-256) is not uploaded again: its existing path is returned.
+
+        :return: gs:// path of the uploaded file, or None.
+        """
+        # Runs on a pipeline thread: the estudio and RUC of the metrics come from the context
+        estudio, ruc = context["estudio_contable_ruc"], context["ruc"]
+        existing = self.find_existing(context, notification_type, "{}_{}_{}".format(id_mensaje, id_archivo, ind_mensaje))
+        if existing:
+            logger.info(f"Archivo ya almacenado, se omite la descarga: {self.stored_url(existing)}")
+            metrics.count_attachment("existing", estudio=estudio)
+            return self.stored_url(existing)
+
+        logger.info(f"Descargando archivo - ID Mensaje: {id_mensaje}, ID Archivo: {id_archivo}, Ind Mensaje: {ind_mensaje}")
+
+        data = {
+            "accion": "archivo",
+            "idMensaje": id_mensaje,
+            "idArchivo": id_archivo,
+            "sistema": ind_mensaje,
+            "indMensaje": "5"
+        }
+        url = self.config["WEBSITE"]["url_download_attach"]
+        # A large PDF takes longer to download: paced with the transfer latency threshold
+        with metrics.stage("attachment_download", estudio=estudio, ruc=ruc), host_limiter.slot(url), \
+                rate_controller.request(url, target_latency=rate_controller.transfer_target_latency) as call:
+            response = self.http.post(url, data=data, cookies=cookies)
+            call.done(response)
+
+        if response.status_code != 200:
+            logger.warning(f"No se pudo descargar el archivo {id_archivo}, status: {response.status_code}")
+            metrics.count_attachment("failed", estudio=estudio)
+            return None
+        metrics.count_attachment("downloaded", estudio=estudio, downloaded_bytes=len(response.content))
+
+        content_type = response.headers.get('Content-Type', '')
+        content_disposition = response.headers.get('Content-Disposition', '')
+
+        filename = "{}_{}_{}".format(id_mensaje, id_archivo, ind_mensaje)
+        if "filename=" in content_disposition:
+            filename += "_" + content_disposition.split("filename=")[-1].strip().replace('"', '')
+
+        if "application/pdf" not in content_type:
+            logger.info(f"Archivo descargado, pero no es un PDF. Tipo de contenido: {content_type}")
+            return None
+
+        sha256 = hashlib.sha256(response.content).hexdigest()
+        # Deduplicated only within the estudio and RUC: a notification never points at another client's object
+        manifest_key = self.manifest_key(context, sha256)
+        stored_path = self.manifest.get(manifest_key)
+        if stored_path:
+            logger.info(f"Contenido ya almacenado (sha256 {sha256[:12]}), se omite la subida: {stored_path}")
+            metrics.count_attachment("deduplicated", estudio=estudio)
+            return stored_path
+
+        gcs_path = f"{context['estudio_contable_ruc']}/{context['ruc']}/{notification_type}/{filename}".replace(" ", "_")
+        try:
+            with metrics.stage("gcs_upload", estudio=estudio, ruc=ruc):
+                if self.storage == "local":
+                    self.save_local(response.content, gcs_path)
+                else:
+                    self.upload_to_gcs(BytesIO(response.content), gcs_path, sha256)
+        except Exception as e:
+            logger.warning(f"Error al subir el PDF a GCS: {e}")
+            metrics.count_attachment("failed", estudio=estudio)
+            return None
+        metrics.count_attachment("uploaded", estudio=estudio, uploaded_bytes=len(response.content))
+
+        stored_path = self.stored_url(gcs_path)
+        self.manifest.add(manifest_key, stored_path)
+        return stored_path
+
+    @staticmethod
+    def manifest_key(context, sha256):
+        return f"{context['estudio_contable_ruc']}/{context['ruc']}/{sha256}"
+
+    def upload_to_gcs(self, pdf_content, destination_path, sha256=None):
+        blob = self.bucket.blob(destination_path)
+        if sha256:
+            blob.metadata = {"sha256": sha256}
+        blob.upload_from_file(pdf_content, content_type="application/pdf")
+        logger.info(f"Archivo subido a gs://{BUCKET_NAME}/{destination_path}")
+
+    def save_local(self, content, destination_path):
+        path = os.path.join(self.local_path, destination_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(content)
+        logger.info(f"Archivo guardado en {path}")
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self.http.close()
@@ -0,0 +1,223 @@
+import logging
+import re
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+
+from application.http_session_rpa import HttpSessionRpa
+from application.incremental_scanner import IncrementalScanner, format_sunat_date
+from application.host_limiter import host_limiter
+from application.rate_controller import rate_controller
+from cross_cutting import metrics
+from infrastructure.extract_notification_manual import ExtractNotificationManual
+
+logger = logging.getLogger(__name__)
+
+# Candidate keys of the visor JSON responses (the visor is not documented, so lookups are tolerant)
+LIST_KEYS = ("rows", "lista", "listaMensajes", "mensajes", "data")
+ID_KEYS = ("codMensaje", "codigoMensaje", "idMensaje", "id")
+SUBJECT_KEYS = ("desAsunto", "asunto", "subject")
+DATE_KEYS = ("fecPublica", "fechaPublica", "fecPublicacion", "publish_date")
+TAG_KEYS = ("desEtiqueta", "etiqueta", "tag", "type")
+ATTACHMENT_LIST_KEYS = ("listArchivos", "archivos", "adjuntos", "listaArchivos")
+
+DOWNLOAD_CALL = re.compile(r"goArchivoDescarga\(([^)]*)\)")
+
+
+def first_value(item, keys, default=None):
+    """
+    Returns the value of the first key of `keys` present (and not empty) in item.
+    """
+    for key in keys:
+        if isinstance(item, dict) and item.get(key) not in (None, ""):
+            return item[key]
+    return default
+
+
+class ExtractNotificationHttp(ExtractNotificationManual):
+    """
+    Extracts the notifications calling the visor JSON endpoints (listNotiMenPag, obtenerDetalleNotiMen)
+    directly, reusing the cookies of the browser session once the mailbox is opened.
+    """
+    def __init__(self, config):
+        super().__init__(config)
+        self.pool_size = config.getint("WEBSITE", "http_pool_size", fallback=10)
+        self.max_pages = config.getint("WEBSITE", "http_max_pages", fallback=50)
+
+    def create_http_session(self, session: HttpSessionRpa, ruc):
+        """
+        Builds a pooled requests.Session with the cookies of the visor iframe.
+
+        :param session: Authenticated browser session with the mailbox opened.
+        :param ruc: RUC of the mailbox (sent in the X-Ruc header).
+        :return: requests.Session ready to call the visor.
+        """
+        driver = session.automator.driver
+        try:
+            # The visor cookies belong to the iframe domain, not to the menu page
+            WebDriverWait(driver, 10).until(
+                EC.frame_to_be_available_and_switch_to_it((By.NAME, "iframeApplication"))
+            )
+            cookies = driver.get_cookies()
+            referer = driver.current_url
+            user_agent = driver.execute_script("return navigator.userAgent")
+        finally:
+            driver.switch_to.default_content()
+
+        http_session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+        http_session.mount("https://", adapter)
+        http_session.mount("http://", adapter)
+        for cookie in cookies:
+            http_session.cookies.set(cookie["name"], cookie["value"],
+                                     domain=cookie.get("domain"), path=cookie.get("path", "/"))
+        http_session.headers.update({
+            "Accept": "application/json, text/javascript, */*; q=0.01",
+            "X-Requested-With": "XMLHttpRequest",
+            "X-Ruc": str(ruc),
+            "Referer": referer,
+            "User-Agent": user_agent,
+        })
+        return http_session
+
+    @metrics.stage("list_extraction")
+    def list_messages(self, http_session, page=1):
+        """
+        Calls listNotiMenPag and returns the list of messages of the page.
+        """
+        params = {
+            "tipoMsj": "2",
+            "codCarpeta": "00",
+            "codEtiqueta": "",
+            "page": str(page),
+            "des_asunto": "",
+            "codMensaje": "",
+            "tipoOrden": "NADA",
+            "_": str(int(time.time() * 1000)),
+        }
+        with host_limiter.slot(self.visor_url), rate_controller.request(self.visor_url) as call:
+            response = http_session.get(f"{self.visor_url}/listNotiMenPag", params=params)
+            call.done(response)
+        response.raise_for_status()
+        payload = response.json()
+        if isinstance(payload, list):
+            return payload
+        return first_value(payload, LIST_KEYS, default=[])
+
+    def pages(self, http_session, context=None):
+        """
+        Yields the pages of the mailbox (newest-first) until an empty page or max_pages.
+        When the scanner still asks for messages after max_pages, the extraction is marked incomplete.
+        """
+        for page in range(1, self.max_pages + 1):
+            messages = self.list_messages(http_session, page)
+            if not messages:
+                return
+            yield messages
+        self.mark_incomplete(context, f"Se alcanzó el máximo de páginas ({self.max_pages}) sin llegar a la última notificación")
+
+    @metrics.stage("detail_fetch")
+    def get_message_detail(self, http_session, message_id):
+        """
+        Calls obtenerDetalleNotiMen for one message.
+        """
+        params = {
+            "codigoMensaje": message_id,
+            "tipoMsj": "2",
+            "_": str(int(time.time() * 1000)),
+        }
+        with host_limiter.slot(self.visor_url), rate_controller.request(self.visor_url) as call:
+            response = http_session.get(f"{self.visor_url}/obtenerDetalleNotiMen", params=params)
+            call.done(response)
+        response.raise_for_status()
+        return response.json()
+
+    @staticmethod
+    def detail_attachment_params(detail, message_id):
+        """
+        Returns the (id_archivo, ind_mensaje, id_mensaje) tuples of the attachments of a message detail.
+        The detail may list the files, or embed the goArchivoDescarga(...) calls in its HTML.
+        """
+        params = []
+        for archivo in first_value(detail, ATTACHMENT_LIST_KEYS, default=[]) or []:
+            id_archivo = first_value(archivo, ("idArchivo", "codArchivo", "id"))
+            if id_archivo is not None:
+                ind_mensaje = first_value(archivo, ("indMensaje", "sistema", "codSistema"), default="")
+                params.append((str(id_archivo), str(ind_mensaje), str(message_id)))
+
+        if not params:
+            for call in DOWNLOAD_CALL.findall(str(detail)):
+                values = [p.strip().strip("'\"") for p in call.split(",")]
+                if len(values) == 3:
+                    params.append(tuple(values))
+        return params
+
+    def extract(self, session: HttpSessionRpa, context):
+        return list(self.iter_extract(session, context))
+
+    def iter_extract(self, session: HttpSessionRpa, context):
+        # Notifications waiting for their attachments; handed over in the list order
+        waiting = []
+        extracted = 0
+
+        try:
+            http_session = self.create_http_session(session, context["ruc"])
+        except Exception as e:
+            self.mark_incomplete(context, f"No se pudo obtener la sesión del visor: {e}")
+            return
+
+        with http_session:
+            # Pages are requested lazily, newest-first, until the scanner reaches the watermark
+            scanner = IncrementalScanner(context["last_date"], context.get("watermark"))
+            try:
+                new_messages = list(scanner.scan(self.pages(http_session, context),
+                                                 lambda m: first_value(m, ID_KEYS),
+                                                 lambda m: first_value(m, DATE_KEYS)))
+                new_messages = self.skip_processed(new_messages, context["ruc"], lambda m: first_value(m, ID_KEYS))
+            except Exception as e:
+                self.mark_incomplete(context, f"Error al listar las notificaciones: {e}")
+                return
+
+            logger.info(f"Nuevas Notificaciones: {len(new_messages)}")
+            logger.info(f"Última Notificación: {context['last_date']}")
+
+            try:
+                for message in new_messages:
+                    notification_id = first_value(message, ID_KEYS)
+                    # The persistence expects dd/mm/YYYY HH:MM:SS; the JSON may use other formats
+                    publish_date = format_sunat_date(first_value(message, DATE_KEYS))
+                    if notification_id is None or publish_date is None:
+                        logger.warning(f"Mensaje sin id o fecha de publicación, se omite: {message}")
+                        continue
+                    notification_id = str(notification_id)
+                    notification_type = first_value(message, TAG_KEYS, default="SIN TIPO")
+
+                    notification_info = {
+                        "id": notification_id,
+                        "subject": first_value(message, SUBJECT_KEYS, default=""),
+                        "publish_date": publish_date,
+                        "type": notification_type,
+                        "url_archivo": ""
+                    }
+                    waiting.append(notification_info)
+
+                    try:
+                        detail = self.get_message_detail(http_session, notification_id)
+                        self.attachments.enqueue(notification_info, self.detail_attachment_params(detail, notification_id),
+                                                 notification_type, context, http_session.cookies)
+                    except Exception as e:
+                        logger.warning(f"No se pudo obtener el detalle del mensaje {notification_id}: {e}")
+
+                    while waiting and self.attachments.completed(waiting[0]):
+                        extracted += 1
+                        yield waiting.pop(0)
+            finally:
+                with metrics.stage("attachments_wait"):
+                    self.attachments.join()
+
+        metrics.count_notifications("extracted", extracted + len(waiting))
+        yield from waiting
@@ -0,0 +1,182 @@
+import logging
+
+from lxml import etree, html
+from selenium.webdriver.common.by import By
+
+from application.incremental_scanner import format_sunat_date, parse_sunat_date
+from application.reference_data_cache import reference_data_cache, TiposNotificacionIndex
+from cross_cutting import metrics
+from infrastructure.extract_notification_manual import ExtractNotificationManual
+
+logger = logging.getLogger(__name__)
+
+# Markup that never carries row data and is dropped before a row is sent to the LLM
+DROPPED_TAGS = ("script", "style", "noscript", "img", "svg", "button", "input")
+
+
+class ExtractNotificationHybrid(ExtractNotificationManual):
+    def __init__(self, config, llm_extractor=None):
+        """
+        Manual extractor that parses the rows with the selectors and escalates to the LLM only the rows
+        the selectors could not read (no subject, no fecPublica or an unparseable date),
+        all of them in a single call. The LLM extractor is created on the first fallback.
+        A row without a tag is kept as "SIN TIPO", as in the manual extractor.
+
+        :param config: config.ini loaded ([EXTRACTOR] hybrid_required, plus [LLM] for the fallback).
+        :param llm_extractor: (Optional) ExtractNotificationLLM used for the fallback.
+        """
+        super().__init__(config)
+        self.llm_extractor = llm_extractor
+        # Fields a row needs from the selectors; a row missing any of them goes to the LLM
+        self.required = [field.strip() for field in config.get(
+            "EXTRACTOR", "hybrid_required", fallback="subject, publish_date").split(",") if field.strip()]
+
+    def llm(self):
+        if self.llm_extractor is None:
+            from infrastructure.extract_notification_llm import ExtractNotificationLLM
+            self.llm_extractor = ExtractNotificationLLM(config=self.config)
+        return self.llm_extractor
+
+    def known_types(self):
+        """
+        Returns the tipos de notificación of the persistence API (cached, shared with SaveNotificationDb),
+        or None when they cannot be read.
+        """
+        base_url = self.config["URLS"]["persist_base_url"]
+        url = f"{base_url.rstrip('/')}/tipos_notificacion?skip=0&limit=100"
+        try:
+            return reference_data_cache.get_json(url, ttl=self.config.getint("CACHE", "tipos_notificacion_ttl", fallback=3600),
+                                                 transform=TiposNotificacionIndex)
+        except Exception as e:
+            logger.warning(f"No se pudo obtener los tipos de notificación, no se validan los tipos del LLM: {e}")
+            return None
+
+    def is_parsed(self, row):
+        """
+        True when the selectors read every required field of the row (and the date can be parsed).
+        """
+        if not row.get("id"):
+            return False
+        for field in self.required:
+            if not row.get(field):
+                return False
+        return "publish_date" not in self.required or parse_sunat_date(row["publish_date"]) is not None
+
+    @staticmethod
+    def is_readable(row):
+        """
+        True when the selectors read the id and a parseable date: the row is kept with the selector values
+        even when the LLM cannot complete it.
+        """
+        return bool(row.get("id")) and parse_sunat_date(row.get("publish_date")) is not None
+
+    @staticmethod
+    def fallback_rows(lista_html, indexes):
+        """
+        Returns the li of listaMensajes at the given indexes with their text and markup,
+        without scripts, styles and attributes other than id and class.
+
+        :return: Dictionary index -> li string.
+        """
+        items = html.fromstring(lista_html).xpath('//ul[@id="listaMensajes"]/li')
+        rows = {}
+        for index in indexes:
+            if index >= len(items):
+                continue
+            li = items[index]
+            etree.strip_elements(li, *DROPPED_TAGS, with_tail=False)
+            for element in li.iter():
+                for attribute in list(element.attrib):
+                    if attribute not in ("id", "class"):
+                        del element.attrib[attribute]
+            rows[index] = " ".join(etree.tostring(li, encoding="unicode", with_tail=False).split())
+        return rows
+
+    def escalate(self, driver, rows):
+        """
+        Completes the rows the selectors could not read with one LLM call over their markup.
+        Rows seen before are served from the LLM extractor cache.
+
+        :return: Rows completed by the LLM (the fields read by the selectors are kept).
+        """
+        lista_html = driver.find_element(By.XPATH, '//ul[@id="listaMensajes"]').get_attribute("outerHTML")
+        markup = self.fallback_rows(lista_html, [row["index"] for row in rows])
+        llm = self.llm()
+
+        hashes = {row["index"]: llm.row_hash(markup[row["index"]]) for row in rows if row["index"] in markup}
+        results = {index: llm.cached(h) for index, h in hashes.items()}
+        pending = [index for index, result in results.items() if result is None]
+        if pending:
+            extracted = llm.extract_chunk([markup[index] for index in pending])
+            # The schema types the id as an integer: match without the leading zeros
+            by_id = {str(item.get("id")).lstrip("0"): item for item in extracted}
+            for row in rows:
+                index = row["index"]
+                if index in pending and str(row.get("id") or "").lstrip("0") in by_id:
+                    results[index] = dict(by_id[str(row["id"]).lstrip("0")], id=row["id"])
+                    llm.remember(hashes[index], results[index])
+
+        tipos, tipos_read = None, False
+        completed = []
+        for row in rows:
+            result = results.get(row["index"])
+            if result is None:
+                continue
+            merged = dict(row)
+            for field in ("subject", "type"):
+                if not merged.get(field):
+                    merged[field] = result.get(field)
+            if parse_sunat_date(merged.get("publish_date")) is None:
+                merged["publish_date"] = result.get("publish_date")
+
+            if not row.get("type") and merged.get("type"):
+                # The LLM may name a tipo the persistence does not know
+                if not tipos_read:
+                    tipos, tipos_read = self.known_types(), True
+                if tipos is not None and merged["type"] not in tipos:
+                    logger.warning(f"Tipo de notificación desconocido devuelto por el LLM: {merged['type']}")
+                    merged["type"] = None
+            completed.append(merged)
+        return completed
+
+    def list_rows(self, driver):
+        rows = [row for row in self.read_rows(driver) if row.get("id") or row.get("subject")]
+        parsed = [row for row in rows if self.is_parsed(row)]
+        failed = [row for row in rows if not self.is_parsed(row)]
+
+        completed = []
+        if failed:
+            logger.info(f"Filas no reconocidas por los selectores, se envían al LLM: {len(failed)} de {len(rows)}")
+            try:
+                completed = [row for row in self.escalate(driver, failed) if self.is_parsed(row)]
+            except Exception as e:
+                logger.error(f"No se pudo extraer las filas con el LLM: {e}")
+            recovered = {row["index"] for row in completed}
+            for row in failed:
+                if row["index"] in recovered:
+                    continue
+                if self.is_readable(row):
+                    # Dropping it would let a newer row move the watermark past it
+                    logger.warning(f"Notificación no completada por el LLM, se conservan los selectores: {row}")
+                    parsed.append(row)
+                else:
+                    logger.warning(f"Notificación no reconocida, se omite: {row}")
+
+        metrics.count_rows("selectors", len(parsed))
+        metrics.count_rows("llm", len(completed))
+        metrics.count_rows("unparsed", len(rows) - len(parsed) - len(completed))
+        if rows:
+            logger.info(f"Fallback LLM: {len(failed)}/{len(rows)} filas ({len(failed) / len(rows):.1%}), "
+                        f"recuperadas: {len(completed)}")
+
+        # The LLM (and dateutil) may return other formats: the persistence expects dd/mm/YYYY HH:MM:SS
+        rows = []
+        for row in parsed + completed:
+            publish_date = format_sunat_date(row.get("publish_date"))
+            if publish_date is None:
+                logger.warning(f"Notificación sin fecha de publicación, se omite: {row}")
+                continue
+            rows.append(dict(row, publish_date=publish_date))
+
+        # Keep the list order (newest-first) for the incremental scan
+        return sorted(rows, key=lambda row: row["index"])
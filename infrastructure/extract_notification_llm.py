@@ -1,14 +1,38 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 from langchain.chains import (create_extraction_chain,
                               create_extraction_chain_pydantic)
 # from langchain_community.chat_models import ChatOpenAI
 from langchain_openai import ChatOpenAI
+from lxml import etree, html
 from selenium.webdriver.common.by import By
 
 from application.extract_notification_base import ExtractNotificationBase
-import os
+from application.incremental_scanner import IncrementalScanner, format_sunat_date
+from infrastructure.state_store import StateStore
+
+logger = logging.getLogger(__name__)
+
+# Rough size of a token for the chunk budget (Spanish text and short tags)
+CHARS_PER_TOKEN = 4
+
 
 class ExtractNotificationLLM(ExtractNotificationBase):
-    def __init__(self):
+    def __init__(self, config=None, llm=None, chain=None):
+        """
+        Extracts the notifications of listaMensajes with an LLM extraction chain.
+        The list is reduced to the fields of the schema, rows already extracted are served from a cache keyed
+        by the hash of the row, and the new rows are sent in token-budgeted chunks processed concurrently.
+
+        :param config: config.ini loaded ([LLM] model, chunk_tokens, max_concurrency).
+        :param llm: (Optional) Chat model; ChatOpenAI by default.
+        :param chain: (Optional) Object with run(text) -> [{"listaMensajes": [...]}], e.g. a fake chain for tests.
+        """
         super().__init__()
         self.notification_schema = {
             "$schema": "http://json-schema.org/draft-07/schema#",
@@ -51,17 +75,139 @@ class ExtractNotificationLLM(ExtractNotificationBase):
             "additionalProperties": False
             }
 
-        openai_api_key = os.getenv('OPENAI_API_KEY')
+        model = config.get("LLM", "model", fallback="gpt-4o-mini") if config else "gpt-4o-mini"
+        self.chunk_tokens = config.getint("LLM", "chunk_tokens", fallback=2000) if config else 2000
+        self.max_concurrency = config.getint("LLM", "max_concurrency", fallback=4) if config else 4
+
+        if llm is None and chain is None:
+            openai_api_key = os.getenv('OPENAI_API_KEY')
+            llm = ChatOpenAI(temperature=0, model=model,
+                             openai_api_key=openai_api_key)
+        self.llm = llm
+        self.chain = chain or create_extraction_chain(schema=self.notification_schema, llm=self.llm)
+
+        # Row hash -> extracted row; persisted in the state store when it is configured
+        self.state = StateStore.from_config(config) if config else None
+        self._cache = {}
+        self._cache_lock = threading.Lock()
+
+    @staticmethod
+    def minify_rows(lista_html):
+        """
+        Reduces every li of listaMensajes to the fields of the schema (id, subject, date, tag),
+        dropping scripts, styles, attributes and layout markup.
+
+        :return: List of minified li strings, in the list order.
+        """
+        document = html.fromstring(lista_html)
+        rows = []
+        for li in document.xpath('//ul[@id="listaMensajes"]/li'):
+            row = etree.Element("li", id=li.get("id") or "")
+            for tag, xpath in (("a", './/a[contains(concat(" ", @class, " "), " linkMensaje ")]'),
+                               ("small", './/small[contains(concat(" ", @class, " "), " fecPublica ")]'),
+                               ("span", './/span[contains(@class, "label tag")]')):
+                found = li.xpath(xpath)
+                if found:
+                    etree.SubElement(row, tag).text = " ".join(found[0].text_content().split())
+            rows.append(etree.tostring(row, encoding="unicode"))
+        return rows
+
+    @staticmethod
+    def row_hash(row):
+        return hashlib.sha256(row.encode("utf-8")).hexdigest()
+
+    def chunks(self, rows):
+        """
+        Groups the minified rows in chunks of at most chunk_tokens (estimated) tokens.
+        """
+        budget = self.chunk_tokens * CHARS_PER_TOKEN
+        chunk, size = [], 0
+        for row in rows:
+            if chunk and size + len(row) > budget:
+                yield chunk
+                chunk, size = [], 0
+            chunk.append(row)
+            size += len(row)
+        if chunk:
+            yield chunk
+
+    def cached(self, row_hash):
+        with self._cache_lock:
+            if row_hash in self._cache:
+                return self._cache[row_hash]
+        if self.state is not None:
+            stored = self.state.llm_row(row_hash)
+            if stored is not None:
+                return json.loads(stored)
+        return None
+
+    def remember(self, row_hash, result):
+        with self._cache_lock:
+            self._cache[row_hash] = result
+        if self.state is not None:
+            self.state.add_llm_row(row_hash, json.dumps(result))
+
+    def extract_chunk(self, chunk):
+        """
+        Runs the extraction chain over one chunk of minified rows.
+        """
+        text = '<ul id="listaMensajes">' + "".join(chunk) + "</ul>"
+        results = self.chain.run(text)
+        extracted = []
+        for result in results or []:
+            extracted.extend(result.get("listaMensajes", []) if isinstance(result, dict) else [])
+        return extracted
+
+    def extract_rows(self, lista_html):
+        """
+        Extracts the rows of the list HTML, calling the LLM only for rows not seen before.
+
+        :return: Rows as returned by the schema, in the list order.
+        """
+        rows = self.minify_rows(lista_html)
+        hashes = [self.row_hash(row) for row in rows]
+        results = {h: self.cached(h) for h in hashes}
+        new_rows = [row for row, h in zip(rows, hashes) if results[h] is None]
+        logger.info(f"LLM rows: {len(rows)}, cached: {len(rows) - len(new_rows)}, to extract: {len(new_rows)}")
+
+        if new_rows:
+            chunks = list(self.chunks(new_rows))
+            with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(chunks))) as executor:
+                extracted = [item for items in executor.map(self.extract_chunk, chunks) for item in items]
 
-        self.llm = ChatOpenAI(temperature=0, model="gpt-4o-mini",
-                        openai_api_key=openai_api_key)
+            # Match the results back to their rows by id to cache them (the schema types the id as an integer)
+            by_id = {str(item.get("id")).lstrip("0"): item for item in extracted}
+            for row, h in zip(rows, hashes):
+                if results[h] is None:
+                    row_id = (html.fromstring(row).get("id") or "").lstrip("0")
+                    if row_id in by_id:
+                        results[h] = dict(by_id[row_id], id=html.fromstring(row).get("id"))
+                        self.remember(h, results[h])
 
-    def extract(self, session):
-        session.automator.driver.switch_to.frame(session.automator.driver.find_element(By.NAME, "iframeApplication"))
+        return [results[h] for h in hashes if results[h] is not None]
 
-        notification_elements = session.automator.get_element(By.XPATH, '//ul[@id="listaMensajes"]').get_attribute("outerHTML")
-        results = create_extraction_chain(schema=self.notification_schema, llm=self.llm).run(notification_elements)
+    def extract(self, session, context=None):
+        driver = session.automator.driver
+        driver.switch_to.frame(driver.find_element(By.NAME, "iframeApplication"))
+        try:
+            notification_elements = session.automator.get_element(By.XPATH, '//ul[@id="listaMensajes"]').get_attribute("outerHTML")
+        finally:
+            driver.switch_to.default_content()
 
-        session.automator.driver.switch_to.default_content()
+        rows = self.extract_rows(notification_elements)
+        expected = len(self.minify_rows(notification_elements))
+        if len(rows) < expected:
+            self.mark_incomplete(context, f"El LLM no devolvió {expected - len(rows)} de {expected} notificaciones")
 
-        return results[0]['listaMensajes']
+        notifications = []
+        for row in rows:
+            # The schema asks for a date-time: the persistence expects dd/mm/YYYY HH:MM:SS
+            publish_date = format_sunat_date(row.get("publish_date"))
+            if publish_date is None:
+                logger.warning(f"Notificación sin fecha de publicación, se omite: {row}")
+                continue
+            notifications.append(dict(row, publish_date=publish_date, url_archivo=row.get("url_attachment") or ""))
+        if context is not None:
+            scanner = IncrementalScanner(context.get("last_date"), context.get("watermark"))
+            notifications = list(scanner.scan([notifications], lambda n: n["id"], lambda n: n["publish_date"]))
+        return notifications
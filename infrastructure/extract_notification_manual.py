@@ -1,4 +1,4 @@
-from bs4 import BeautifulSoup
+from lxml import html
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
@@ -6,184 +6,225 @@ import logging
 import os
 import time
 # from PyPDF2 import PdfReader
-from io import BytesIO
-import requests
 
 from application.http_session_rpa import HttpSessionRpa
 from application.extract_notification_base import ExtractNotificationBase
-
-from google.cloud import storage
-import logging
-from dateutil import parser
+from application.incremental_scanner import IncrementalScanner
+from application.host_limiter import host_limiter
+from cross_cutting import metrics
+from infrastructure.attachment_pipeline import AttachmentPipeline
+from infrastructure.state_store import StateStore
 
 logger = logging.getLogger(__name__)
 
+# Rows of listaMensajes (id, subject, date, tag) in a single WebDriver round trip
+LIST_ROWS_SCRIPT = """
+var items = document.querySelectorAll('#listaMensajes > li');
+var text = function (li, selector) {
+    var node = li.querySelector(selector);
+    return node ? node.textContent.trim() : null;
+};
+return Array.prototype.map.call(items, function (li, index) {
+    return {
+        index: index,
+        id: li.id,
+        subject: text(li, 'a.linkMensaje'),
+        publish_date: text(li, 'small.fecPublica'),
+        type: text(li, 'div > span[class*="label tag"]')
+    };
+});
+"""
+
+# goArchivoDescarga(idArchivo, indMensaje, idMensaje) parameters of the opened message
+ATTACHMENTS_SCRIPT = """
+var links = document.querySelectorAll('a[href*="goArchivoDescarga"]');
+return Array.prototype.map.call(links, function (a) {
+    var match = /goArchivoDescarga\\(([^)]*)\\)/.exec(a.getAttribute('href'));
+    return match ? match[1].split(',').map(function (p) { return p.trim(); }) : null;
+});
+"""
+
 class ExtractNotificationManual(ExtractNotificationBase):
     def __init__(self, config):
         self.config = config
-
-    # @staticmethod
-    def upload_to_gcs(self, pdf_content: bytes, destination_path: str):
-        bucket_name = "notificaciones-sunat-store"
-
-        try:
-            client = storage.Client(project="estudios-contables")
-            bucket = client.bucket(bucket_name)
-
-            blob = bucket.blob(destination_path)
-            blob.upload_from_file(pdf_content, content_type="application/pdf")
-
-            logger.info(f"Archivo subido a gs://{bucket_name}/{destination_path}")
-
-        except Exception as e:
-            logger.error(f"Error al subir archivo a GCS: {e}")
-
-    def download_attachment(self, page_source, cookies_dict, notification_type, context):
-        soup_detail = BeautifulSoup(page_source, 'html.parser')
-
-        download_links = soup_detail.find_all('a', href=lambda x: x and "goArchivoDescarga" in x)
-        gcs_paths = []
-
-        for download_link in download_links:
-            onclick_text = download_link['href']
-            params = onclick_text.split('goArchivoDescarga(')[1].split(')')[0].split(',')
-            id_archivo, ind_mensaje, id_mensaje = [p.strip() for p in params]
-
-            logger.info(f"Descargando archivo - ID Mensaje: {id_mensaje}, ID Archivo: {id_archivo}, Ind Mensaje: {ind_mensaje}")
-
-            data = {
-                "accion": "archivo",
-                "idMensaje": id_mensaje,
-                "idArchivo": id_archivo,
-                "sistema": ind_mensaje,
-                "indMensaje": "5"
+        self.attachments = AttachmentPipeline(config)
+        # Notifications already persisted are not opened again (None when [STATE] state_db is not set)
+        self.state = StateStore.from_config(config)
+        # "script": one execute_script per list/detail; "html": parse the outerHTML with lxml
+        self.list_mode = config.get("EXTRACTOR", "list_mode", fallback="script")
+        self.visor_url = config["WEBSITE"].get(
+            "url_visor", "https://ww1.sunat.gob.pe/ol-ti-itvisornoti/visor").rstrip("/")
+
+    @staticmethod
+    def attachment_params(page_source):
+        """
+        Returns the (id_archivo, ind_mensaje, id_mensaje) of the goArchivoDescarga links of a message detail.
+        """
+        document = html.fromstring(page_source)
+
+        params = []
+        for href in document.xpath('//a[contains(@href, "goArchivoDescarga")]/@href'):
+            values = href.split('goArchivoDescarga(')[1].split(')')[0].split(',')
+            params.append(tuple(p.strip() for p in values))
+        return params
+
+    @staticmethod
+    def parse_rows(lista_html):
+        """
+        Parses the rows of listaMensajes from its HTML (fallback when the script is not available).
+
+        :param lista_html: outerHTML of the ul#listaMensajes.
+        :return: List of rows {"index", "id", "subject", "publish_date", "type"}.
+        """
+        document = html.fromstring(lista_html)
+
+        def text(li, xpath):
+            found = li.xpath(xpath)
+            return found[0].text_content().strip() if found else None
+
+        return [
+            {
+                "index": index,
+                "id": li.get("id"),
+                "subject": text(li, './/a[contains(concat(" ", @class, " "), " linkMensaje ")]'),
+                "publish_date": text(li, './/small[contains(concat(" ", @class, " "), " fecPublica ")]'),
+                "type": text(li, './/div/span[contains(@class, "label tag")]'),
             }
-            url = self.config["WEBSITE"]["url_download_attach"]
-            response = requests.post(url, data=data, cookies=cookies_dict)
-
-            if response.status_code == 200:
-                content_type = response.headers.get('Content-Type')
-                content_disposition = response.headers.get('Content-Disposition', '')
-
-                filename = "{}_{}_{}".format(id_mensaje, id_archivo, ind_mensaje)
-                if "filename=" in content_disposition:
-                    filename += "_" + content_disposition.split("filename=")[-1].strip().replace('"', '')
-
-                # file_path = os.path.join("descargas", filename)
-                # os.makedirs("descargas", exist_ok=True)
-                # with open(file_path, "wb") as f:
-                #     f.write(response.content)
-                # logger.info(f"Archivo guardado: {file_path}")
-
-                if "application/pdf" in content_type:
-                    try:
-                        pdf_bytes = BytesIO(response.content)
-                        gcs_path = f"{context['estudio_contable_ruc']}/{context['ruc']}/{notification_type}/{filename}".replace(" ", "_")
-                        self.upload_to_gcs(pdf_bytes, gcs_path)
-                        gcs_paths.append("gs://notificaciones-sunat-store/" + gcs_path)
-                        # pdf_text = "".join(page.extract_text() or "" for page in reader.pages)
-                        # logger.info(f"Texto extraído del PDF:{pdf_text[:1000]}")
-                    except Exception as e:
-                        gcs_path = None
-                        logger.warning(f"Error al subir el PDF a GCS: {e}")
-                else:
-                    logger.info(f"Archivo descargado, pero no es un PDF. Tipo de contenido: {content_type}")
-            else:
-                logger.warning(f"No se pudo descargar el archivo {id_archivo}, status: {response.status_code}")
-
-        return gcs_paths
+            for index, li in enumerate(document.xpath('//ul[@id="listaMensajes"]/li'))
+        ]
+
+    def skip_processed(self, rows, ruc, id_of):
+        """
+        Drops the rows whose notification was already persisted in a previous run.
+        """
+        if self.state is None or not rows:
+            return rows
+        processed = self.state.processed_ids(ruc, [id_of(row) for row in rows])
+        if processed:
+            logger.info(f"Notificaciones ya procesadas, se omiten: {len(processed)}")
+        return [row for row in rows if str(id_of(row)) not in processed]
+
+    @metrics.stage("list_extraction")
+    def read_rows(self, driver):
+        """
+        Reads all the rows of listaMensajes in one round trip (execute_script),
+        or from the list outerHTML when the script fails or mode is "html".
+        """
+        if self.list_mode == "script":
+            try:
+                rows = driver.execute_script(LIST_ROWS_SCRIPT)
+                if rows is not None:
+                    return rows
+            except Exception as e:
+                logger.warning(f"No se pudo leer la lista con script, se usa el HTML: {e}")
+
+        lista_html = driver.find_element(By.XPATH, '//ul[@id="listaMensajes"]').get_attribute("outerHTML")
+        return self.parse_rows(lista_html)
+
+    def list_rows(self, driver):
+        """
+        Returns the rows of listaMensajes that can be processed (with id or subject, and a publish date).
+        """
+        rows = [row for row in self.read_rows(driver) if row.get("id") or row.get("subject")]
+
+        dated_rows = []
+        for row in rows:
+            if not row.get("publish_date"):
+                logger.warning(f"Notificación sin fecha de publicación, se omite: {row}")
+                continue
+            dated_rows.append(row)
+        return dated_rows
+
+    def close(self):
+        self.attachments.close()
+
+    def read_attachment_params(self, driver):
+        """
+        Reads the attachment parameters of the opened message (contenedorMensaje) in one round trip.
+        """
+        if self.list_mode == "script":
+            try:
+                params = driver.execute_script(ATTACHMENTS_SCRIPT)
+                if params is not None:
+                    return [tuple(p) for p in params if p and len(p) == 3]
+            except Exception as e:
+                logger.warning(f"No se pudo leer los adjuntos con script, se usa el HTML: {e}")
+
+        return self.attachment_params(driver.page_source)
 
     def extract(self, session: HttpSessionRpa, context):
+        return list(self.iter_extract(session, context))
+
+    def iter_extract(self, session: HttpSessionRpa, context):
         # url = "https://ww1.sunat.gob.pe/ol-ti-itvisornoti/visor/bajarArchivo"
-        notification_data = []
+        # Opened notifications waiting for their attachments; handed over in the list order
+        waiting = []
+        extracted = 0
+        driver = session.automator.driver
 
         try:
-            WebDriverWait(session.automator.driver, 10).until(
+            WebDriverWait(driver, 10).until(
                 EC.frame_to_be_available_and_switch_to_it((By.NAME, "iframeApplication"))
             )
 
-            lista = session.automator.driver.find_element(By.XPATH, '//ul[@id="listaMensajes"]')
-            if not lista.text:
-                return notification_data
+            dated_rows = self.list_rows(driver)
+            if not dated_rows:
+                return
 
-            notification_elements = WebDriverWait(session.automator.driver, 10).until(
-                EC.visibility_of_all_elements_located((By.XPATH, '//ul[@id="listaMensajes"]/li')))
-
-            def is_recent_than(notification, last_date):
-                if last_date is None:
-                    return True
-                    
-                item = BeautifulSoup(notification.get_attribute("outerHTML"), 'html.parser')
-                
-                try:
-                    # Parse both dates
-                    valid_last_date = parser.parse(last_date)
-                    item_date = parser.parse(item.find('small', class_="text-muted fecPublica").text, parser.parserinfo(dayfirst=True))
-                    
-                    # Make both timezone-aware or both timezone-naive
-                    if valid_last_date.tzinfo is not None and item_date.tzinfo is None:
-                        # If last_date has timezone but item_date doesn't, make item_date timezone-aware
-                        item_date = item_date.replace(tzinfo=valid_last_date.tzinfo)
-                    elif valid_last_date.tzinfo is None and item_date.tzinfo is not None:
-                        # If item_date has timezone but last_date doesn't, make last_date timezone-aware
-                        valid_last_date = valid_last_date.replace(tzinfo=item_date.tzinfo)
-                    
-                    return item_date >= valid_last_date
-                except Exception as e:
-                    logger.warning(f"Error comparing dates: {e}")
-                    return True  # Default to including the notification if there's an error
-                
-            new_elements = [n for n in notification_elements
-                        if is_recent_than(n, context["last_date"])
-                    ]
-            logger.info(f"Nuevas Notificaciones: {len(new_elements)}")
+            # The list is newest-first: stop at the first message older than the watermark
+            scanner = IncrementalScanner(context["last_date"], context.get("watermark"))
+            new_rows = list(scanner.scan([dated_rows], lambda r: r["id"], lambda r: r["publish_date"]))
+            new_rows = self.skip_processed(new_rows, context["ruc"], lambda r: r["id"])
+            logger.info(f"Nuevas Notificaciones: {len(new_rows)}")
             logger.info(f"Última Notificación: {context['last_date']}")
 
-            for notification in new_elements:
-                # logger.debug(notification.get_attribute("outerHTML"))
-                soup = BeautifulSoup(notification.get_attribute("outerHTML"), 'html.parser')
-
-                subject = soup.find('a', class_="linkMensaje text-muted").text
-                publish_date = soup.find('small', class_="text-muted fecPublica").text
-                notification_id = notification.get_property('id') 
-                notification_type = "SIN TIPO"
-                if len(soup.select('div>span[class*="label tag"]')) > 0:
-                    notification_type = soup.select('div>span[class*="label tag"]')[0].text
+            for row in new_rows:
+                notification_type = row.get("type") or "SIN TIPO"
 
                 try:
-                    link_element = notification.find_element(By.CLASS_NAME, "linkMensaje")
-                    link_element.click()
+                    with metrics.stage("detail_click"), host_limiter.slot(self.visor_url):
+                        link_element = driver.find_element(
+                            By.XPATH, f'(//ul[@id="listaMensajes"]/li)[{row["index"] + 1}]//a[contains(@class, "linkMensaje")]')
+                        link_element.click()
                 except Exception as e:
-                    logger.warning(f"Elemento no encontrado: {e}")
+                    self.mark_incomplete(context, f"Elemento no encontrado de la notificación {row['id']}: {e}")
                     continue
 
+                notification_info = {
+                    "id": row["id"],
+                    "subject": row.get("subject") or "",
+                    "publish_date": row["publish_date"],
+                    "type": notification_type,
+                    "url_archivo": ""
+                }
+                waiting.append(notification_info)
+
                 try:
-                    session.automator.driver.switch_to.frame(session.automator.driver.find_element(By.NAME, "contenedorMensaje"))
-                    cookies_dict = {cookie['name']: cookie['value'] for cookie in session.automator.driver.get_cookies()}
+                    driver.switch_to.frame(driver.find_element(By.NAME, "contenedorMensaje"))
+                    cookies_dict = {cookie['name']: cookie['value'] for cookie in driver.get_cookies()}
 
-                    page_source = session.automator.driver.page_source
-                    gcs_paths = self.download_attachment(page_source, cookies_dict, notification_type, context)
+                    # Downloaded/uploaded in background while the next messages are clicked
+                    self.attachments.enqueue(notification_info, self.read_attachment_params(driver),
+                                             notification_type, context, cookies_dict)
                 except Exception as e:
                     logger.warning(f"No se pudo acceder al iframe del mensaje: {e}")
 
-                notification_info = {
-                    "id": notification_id,
-                    "subject": subject,
-                    "publish_date": publish_date,
-                    "type": notification_type,
-                    "url_archivo": ",".join(gcs_paths)
-                }
-                notification_data.append(notification_info)
-                
-                session.automator.driver.switch_to.default_content()
-                WebDriverWait(session.automator.driver, 10).until(EC.frame_to_be_available_and_switch_to_it((By.NAME, "iframeApplication")))
+                driver.switch_to.default_content()
+                WebDriverWait(driver, 10).until(EC.frame_to_be_available_and_switch_to_it((By.NAME, "iframeApplication")))
+
+                while waiting and self.attachments.completed(waiting[0]):
+                    extracted += 1
+                    yield waiting.pop(0)
 
         except TimeoutError as e:
-            logger.error(f"Error inesperado en el proceso de extracción: {e}")
+            self.mark_incomplete(context, f"Error inesperado en el proceso de extracción: {e}")
         # except Notfound
         except Exception as e:
-            logger.error(f"Error inesperado en el proceso de extracción: {e}")
+            self.mark_incomplete(context, f"Error inesperado en el proceso de extracción: {e}")
         finally:
             # session.automator.driver.quit()
-            session.automator.driver.switch_to.default_content()
-        return notification_data
+            driver.switch_to.default_content()
+            with metrics.stage("attachments_wait"):
+                self.attachments.join()
+        metrics.count_notifications("extracted", extracted + len(waiting))
+        yield from waiting
@@ -0,0 +1,139 @@
+import configparser
+import threading
+
+from application.browser_pool import BrowserPool
+from application.http_session_rpa import HttpSessionRpa
+from application.notification_sunat import NotificationSunat
+from application.watermark_store import WatermarkStore
+from infrastructure.extract_notification_manual import ExtractNotificationManual
+from infrastructure.save_notification_db import SaveNotificationDb
+from infrastructure.save_notification_excel import SaveNotificationExcel
+from infrastructure.run_journal import RunJournal
+from infrastructure.session_cookie_cache import SessionCookieCache
+from infrastructure.state_store import StateStore, StateWatermarkStore
+
+# JSON watermark stores by path: one per process, so its lock covers every thread
+_watermark_stores = {}
+_watermark_stores_lock = threading.Lock()
+
+
+def config_to_dict(config):
+    """
+    Converts a loaded config.ini into a plain dict so it can be sent to worker processes.
+
+    :param config: config.ini loaded.
+    :return: Dictionary of sections and their options.
+    """
+    return {section: dict(config[section]) for section in config.sections()}
+
+
+def config_from_dict(values):
+    """
+    Rebuilds a ConfigParser from the dict produced by config_to_dict.
+
+    :param values: Dictionary of sections and their options.
+    :return: ConfigParser instance.
+    """
+    config = configparser.ConfigParser()
+    config.read_dict(values)
+    return config
+
+
+def create_extractor(name, config):
+    """
+    Creates the notification extractor by name ("manual", "http", "llm" or "hybrid").
+    """
+    if name == "http":
+        from infrastructure.extract_notification_http import ExtractNotificationHttp
+        return ExtractNotificationHttp(config=config)
+    if name == "llm":
+        from infrastructure.extract_notification_llm import ExtractNotificationLLM
+        return ExtractNotificationLLM(config=config)
+    if name == "hybrid":
+        from infrastructure.extract_notification_hybrid import ExtractNotificationHybrid
+        return ExtractNotificationHybrid(config=config)
+    return ExtractNotificationManual(config=config)
+
+
+def create_persist(name, config):
+    """
+    Creates the notification persistence by name ("db" or "excel").
+    """
+    if name == "db":
+        return SaveNotificationDb(config=config)
+    return SaveNotificationExcel(config=config)
+
+
+def create_session(config, headless=True):
+    """
+    Creates a new browser session (one Chrome instance).
+    """
+    return HttpSessionRpa(headless=headless, config=config, session_cache=SessionCookieCache.from_config(config))
+
+
+def create_browser_pool(config):
+    """
+    Creates the pool of warm browsers ([BROWSER] pool_size, max_uses), or None when pool_size is 0.
+    """
+    size = config.getint("BROWSER", "pool_size", fallback=0)
+    if size <= 0:
+        return None
+    return BrowserPool(lambda: create_session(config),
+                       size=size,
+                       max_uses=config.getint("BROWSER", "max_uses", fallback=20),
+                       acquire_timeout=config.getint("BROWSER", "acquire_timeout", fallback=300))
+
+
+def create_watermark_store(config):
+    """
+    Returns the watermark store: in the [STATE] state_db store when it is configured,
+    otherwise the JSON file of [STATE] watermark_path (one instance per file in the process).
+    """
+    state = StateStore.from_config(config)
+    if state is not None:
+        return StateWatermarkStore(state)
+    path = config.get("STATE", "watermark_path", fallback="./state/watermarks.json")
+    with _watermark_stores_lock:
+        if path not in _watermark_stores:
+            _watermark_stores[path] = WatermarkStore(path)
+        return _watermark_stores[path]
+
+
+def create_notification_sunat(config, extractor, session, persist, settings, **options):
+    """
+    Creates the NotificationSunat of a job, batch worker or worker process with the [PROCESSING] settings,
+    the watermark store of config.ini and a session factory to replace a failed browser.
+
+    :param options: Other NotificationSunat arguments (estudio_contable_svc, worker_pool, progress, journal, ...);
+                    watermarks and session_factory override the defaults.
+    """
+    if "watermarks" not in options:
+        options["watermarks"] = create_watermark_store(config)
+    options.setdefault("session_factory", lambda: create_session(config))
+    options.setdefault("estudio_contable_svc", None)
+    return NotificationSunat(extractor,
+                             session,
+                             persist=persist,
+                             settings=settings,
+                             persist_batch_size=config.getint("PROCESSING", "persist_batch_size", fallback=20),
+                             persist_queue_size=config.getint("PROCESSING", "persist_queue_size", fallback=100),
+                             **options)
+
+
+def create_run_journal(config):
+    """
+    Creates the run journal (kept in the [STATE] state_db store), or None when the store is disabled.
+    """
+    return RunJournal.from_config(config)
+
+
+def create_work_queue(config):
+    """
+    Creates the RUC work queue ([QUEUE] backend; only "sqlite", which is single-host, for now).
+    """
+    backend = config.get("QUEUE", "backend", fallback="sqlite")
+    if backend != "sqlite":
+        raise ValueError(f"Unsupported queue backend {backend}")
+    from infrastructure.sqlite_work_queue import SqliteWorkQueue
+    return SqliteWorkQueue(config.get("QUEUE", "path", fallback="./state/queue.db"),
+                           max_attempts=config.getint("QUEUE", "max_attempts", fallback=3))
@@ -0,0 +1,93 @@
+import logging
+from datetime import datetime, timezone
+
+from infrastructure.state_store import StateStore
+
+logger = logging.getLogger(__name__)
+
+# Statuses of a RUC in a run; only "persisted" is finished work
+PENDING = "pending"
+EXTRACTED = "extracted"
+PERSISTED = "persisted"
+# Persisted except some notifications the backend rejected: retried like a failed RUC
+PARTIAL = "partial"
+FAILED = "failed"
+
+
+class RunJournal:
+    def __init__(self, store: StateStore):
+        """
+        Journal of the runs of every estudio contable and the status of each RUC (pending, extracted, persisted,
+        partial, failed with its reason), kept in the state store. A run that did not finish is resumed by the next one,
+        which only processes the RUCs not persisted yet.
+
+        :param store: StateStore holding the journal tables.
+        """
+        self.store = store
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Returns the journal of the [STATE] state_db store, or None when the store is not configured.
+        """
+        store = StateStore.from_config(config)
+        return cls(store) if store is not None else None
+
+    @staticmethod
+    def _now():
+        return datetime.now(timezone.utc).isoformat()
+
+    def start(self, estudio_contable_ruc, rucs):
+        """
+        Resumes the unfinished run of the estudio, or starts a new one.
+
+        :param estudio_contable_ruc: RUC of the Estudio Contable.
+        :param rucs: RUCs of the estudio.
+        :return: (run_id, RUCs to process); a resumed run leaves out the RUCs already persisted.
+        """
+        conn = self.store.connection()
+        row = conn.execute(
+            "SELECT run_id FROM journal_runs WHERE estudio_contable_ruc = ? AND finished_at IS NULL "
+            "ORDER BY run_id DESC LIMIT 1", (str(estudio_contable_ruc),)).fetchone()
+
+        if row is not None:
+            run_id = row[0]
+            done = {r[0] for r in conn.execute(
+                "SELECT ruc FROM journal_rucs WHERE run_id = ? AND status = ?", (run_id, PERSISTED))}
+            todo = [ruc for ruc in rucs if str(ruc) not in done]
+            logger.info(f"Resuming run {run_id} of {estudio_contable_ruc}: {len(done)} RUCs already persisted, "
+                        f"{len(todo)} to process")
+        else:
+            with conn:
+                run_id = conn.execute(
+                    "INSERT INTO journal_runs (estudio_contable_ruc, started_at) VALUES (?, ?)",
+                    (str(estudio_contable_ruc), self._now())).lastrowid
+            todo = list(rucs)
+
+        with conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO journal_rucs (run_id, ruc, status, updated_at) VALUES (?, ?, ?, ?)",
+                [(run_id, str(ruc), PENDING, self._now()) for ruc in todo])
+        return run_id, todo
+
+    def mark(self, run_id, ruc, status, reason=None):
+        with self.store.connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO journal_rucs (run_id, ruc, status, reason, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (run_id, str(ruc), status, reason, self._now()))
+
+    def finish(self, run_id):
+        """
+        Closes the run: the next run of the estudio starts from scratch. Failed RUCs are retried there.
+        """
+        with self.store.connection() as conn:
+            conn.execute("UPDATE journal_runs SET finished_at = ? WHERE run_id = ?", (self._now(), run_id))
+
+    def statuses(self, run_id):
+        """
+        Returns {ruc: {"status", "reason", "updated_at"}} of a run.
+        """
+        rows = self.store.connection().execute(
+            "SELECT ruc, status, reason, updated_at FROM journal_rucs WHERE run_id = ?", (run_id,)).fetchall()
+        return {ruc: {"status": status, "reason": reason, "updated_at": updated_at}
+                for ruc, status, reason, updated_at in rows}
@@ -1,6 +1,11 @@
 import logging
 from application.save_notification_base import SaveNotificationBase
+from application.reference_data_cache import reference_data_cache, TiposNotificacionIndex
+from application.rate_controller import rate_controller
+from cross_cutting import metrics
+from infrastructure.state_store import StateStore
 import requests
+from requests.adapters import HTTPAdapter
 from datetime import datetime, timezone
 import json
 
@@ -10,32 +15,138 @@ class SaveNotificationDb(SaveNotificationBase):
     def __init__(self, config=None):
         super().__init__()
         self.config = config
+        self.batch_size = config.getint("PERSIST", "batch_size", fallback=50)
+        self.bulk_path = config.get("PERSIST", "bulk_path", fallback="/notificaciones/bulk")
+        # None = not tried yet; False once the backend answered that the bulk route does not exist
+        self._bulk_supported = None
 
+        # Keep-alive session shared by all the calls to the persistence API
+        pool_size = config.getint("PERSIST", "pool_size", fallback=10)
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.http.mount("https://", adapter)
+        self.http.mount("http://", adapter)
+
+        self.cache = reference_data_cache
+        self.tipos_ttl = config.getint("CACHE", "tipos_notificacion_ttl", fallback=3600)
+        self.rucs_ttl = config.getint("CACHE", "rucs_ttl", fallback=3600)
+
+        # Ids already posted are not sent again (None when [STATE] state_db is not set)
+        self.state = StateStore.from_config(config)
+
+    @metrics.stage("persist")
     def save(self, notifications, ruc):
+        """
+        Saves the notifications of a RUC in batches.
+
+        Returns:
+        - dict: {"saved": [notification ids], "failed": [{"id": ..., "error": ...}], "skipped": [notification ids]}
+        """
         logger.info("Guardando en base de datos")
+        result = {"saved": [], "failed": [], "skipped": []}
+        if self.state is not None and notifications:
+            processed = self.state.processed_ids(ruc, [n["id"] for n in notifications])
+            result["skipped"] = [n["id"] for n in notifications if str(n["id"]) in processed]
+            notifications = [n for n in notifications if str(n["id"]) not in processed]
+        if not notifications:
+            if self.state is not None:
+                self.state.record_run(ruc)
+            return result
+
+        ruc_number = ruc
 
-        # Get all the Notificacion Types
-        notificacion_types = self.call_get_notificacion_types_endpoint()
+        # Get all the Notificacion Types (indexed by name)
+        tipos_index = self.get_tipos_notificacion_index()
 
         # Get the Ruc object
         ruc = self.call_get_ruc_endpoint(ruc)
 
+        payloads = []
         for notification in notifications:
-            tipo_notificacion = [t for t in notificacion_types if str(t['nombre']).upper() == str(notification["type"]).upper()]
-            if len(tipo_notificacion) == 0:
-                tipo_notificacion = [t for t in notificacion_types if str(t['nombre']).upper() == 'SIN TIPO']
-            self.call_create_notificacion_endpoint(
+            tipo_notificacion = tipos_index.get(notification["type"])
+            payloads.append(self.build_notificacion_payload(
                 notification["id"],
                 notification["subject"],
                 datetime.strptime(notification["publish_date"], "%d/%m/%Y %H:%M:%S").isoformat(),
                 ruc["id"],
-                tipo_notificacion[0]["id"],
+                tipo_notificacion["id"],
                 False,
                 datetime.now(timezone.utc).isoformat(),
                 'EXTRACT_PROCESS',
-                notification["url_archivo"]
-            )
-            logger.info(f"Notification saved: {notification['id']}")
+                notification.get("url_archivo")
+            ))
+
+        for start in range(0, len(payloads), self.batch_size):
+            batch = payloads[start:start + self.batch_size]
+            if self._bulk_supported is not False:
+                try:
+                    saved = self.call_create_notificaciones_bulk_endpoint(batch)
+                except requests.RequestException as e:
+                    # The API may have stored the batch: posting the items again could duplicate them.
+                    # Reported as failed, so the watermark / state store retry it in a later run
+                    logger.error(f"Bulk save of {len(batch)} notifications failed: {e}")
+                    result["failed"].extend({"id": p["notificacion_id"], "error": str(e)} for p in batch)
+                    continue
+                if saved:
+                    result["saved"].extend(p["notificacion_id"] for p in batch)
+                    continue
+
+            # No bulk route (or the batch was rejected): post one by one to know which items fail
+            for payload in batch:
+                try:
+                    self.call_create_notificacion_endpoint(**payload)
+                    result["saved"].append(payload["notificacion_id"])
+                except requests.RequestException as e:
+                    logger.error(f"Error saving notification {payload['notificacion_id']}: {e}")
+                    result["failed"].append({"id": payload["notificacion_id"], "error": str(e)})
+
+        if self.state is not None:
+            self.state.mark_processed(ruc_number, result["saved"])
+            self.state.record_run(ruc_number, "ok" if not result["failed"] else "partial")
+
+        metrics.count_notifications("saved", len(result["saved"]))
+        metrics.count_notifications("failed", len(result["failed"]))
+        metrics.count_notifications("skipped", len(result["skipped"]))
+        logger.info(f"Notifications saved: {len(result['saved'])}, failed: {len(result['failed'])}, "
+                    f"skipped: {len(result['skipped'])}")
+        return result
+
+    def call_create_notificaciones_bulk_endpoint(self, payloads):
+        """
+        Calls the bulk create endpoint with a list of notificaciones.
+
+        Parameters:
+        - payloads (list): Payloads built with build_notificacion_payload.
+
+        Returns:
+        - bool: True when the whole batch was saved, False when it has to be sent item by item
+          (no bulk route, or the batch was rejected by validation, so nothing was stored).
+
+        Raises:
+        - requests.RequestException: When the outcome is unknown (connection error, timeout, 5xx, 408, 429):
+          the API may have stored the batch, so it must not be posted again item by item.
+        """
+        base_url = self.config["URLS"]["persist_base_url"]
+        url = f"{base_url.rstrip('/')}/{self.bulk_path.lstrip('/')}"
+        logger.info(f"Calling endpoint: {url} ({len(payloads)} notificaciones)")
+
+        # A bulk post takes longer with the size of the batch: not congestion by itself
+        with rate_controller.request(url, target_latency=rate_controller.transfer_target_latency) as call:
+            response = self.http.post(url, json=payloads)
+            call.done(response)
+
+        if response.status_code in (404, 405):
+            logger.info("The persistence API has no bulk route, saving one by one")
+            self._bulk_supported = False
+            return False
+        if 400 <= response.status_code < 500 and response.status_code not in (408, 429):
+            logger.warning(f"Bulk save rejected with status {response.status_code}, falling back to single saves")
+            return False
+        # 5xx, 408 and 429: the batch may or may not have been stored
+        response.raise_for_status()
+
+        self._bulk_supported = True
+        return True
 
     def call_get_ruc_endpoint(self, ruc):
         """
@@ -53,16 +164,9 @@ class SaveNotificationDb(SaveNotificationBase):
         # Construct the endpoint URL
         base_url = self.config["URLS"]["persist_base_url"]
         url = f"{base_url.rstrip('/')}/rucs/{ruc}"
-        logger.info(f"Calling endpoint: {url}")
-
-        # Send the GET request
-        response = requests.get(url)
 
-        # Raise an exception for HTTP error responses
-        response.raise_for_status()
-
-        # Return the response as JSON
-        return json.loads(response.text)
+        # Send the GET request (cached, revalidated with ETag once expired)
+        return self.cache.get_json(url, http=self.http, ttl=self.rucs_ttl)
 
     def call_get_notificacion_types_endpoint(self):
         """
@@ -71,24 +175,28 @@ class SaveNotificationDb(SaveNotificationBase):
         Returns:
         - dict: JSON response from the API.
 
+        Raises:
+        - requests.HTTPError: If the request fails.
+        """
+        return self.get_tipos_notificacion_index().tipos
+
+    def get_tipos_notificacion_index(self):
+        """
+        Returns the tipos de notificación indexed by upper-cased name (cached, see ReferenceDataCache).
+
+        Returns:
+        - TiposNotificacionIndex: Index of the tipos.
+
         Raises:
         - requests.HTTPError: If the request fails.
         """
         # Construct the endpoint URL
         base_url = self.config["URLS"]["persist_base_url"]
         url = f"{base_url.rstrip('/')}/tipos_notificacion?skip=0&limit=100"
-        logger.info(f"Calling endpoint: {url}")
-
-        # Send the GET request
-        response = requests.get(url)
 
-        # Raise an exception for HTTP error responses
-        response.raise_for_status()
+        return self.cache.get_json(url, http=self.http, ttl=self.tipos_ttl, transform=TiposNotificacionIndex)
 
-        # Return the response as JSON
-        return json.loads(response.text)
-
-    def call_create_notificacion_endpoint(self,
+    def build_notificacion_payload(self,
         notificacion_id: str,
         asunto: str,
         fecha_publicacion: str = None,
@@ -100,7 +208,7 @@ class SaveNotificationDb(SaveNotificationBase):
         url_archivo: str = None
     ):
         """
-        Calls the create_notificacion_endpoint FastAPI endpoint.
+        Builds the payload of a notificacion for the create endpoints.
         
         Parameters:
         - notificacion_id (str): Notification identifier.
@@ -111,12 +219,10 @@ class SaveNotificationDb(SaveNotificationBase):
         - eliminado (bool, optional): Flag indicating if the notification is marked as deleted.
         - fecha_creacion (str, optional): Creation timestamp in ISO 8601 format.
         - usuario_creador (str, optional): Username of the creator.
+        - url_archivo (str, optional): Comma separated gs:// paths of the attachments.
         
         Returns:
-        - dict: JSON response from the API.
-        
-        Raises:
-        - requests.HTTPError: If the request fails.
+        - dict: Payload without the keys whose value is None.
         """
         # Set default creation timestamp if not provided
         if fecha_creacion is None:
@@ -136,7 +242,32 @@ class SaveNotificationDb(SaveNotificationBase):
         }
         
         # Remove keys where the value is None
-        payload = {key: value for key, value in payload.items() if value is not None}
+        return {key: value for key, value in payload.items() if value is not None}
+
+    def call_create_notificacion_endpoint(self,
+        notificacion_id: str,
+        asunto: str,
+        fecha_publicacion: str = None,
+        ruc_id: int = None,
+        tipo_id: int = None,
+        eliminado: bool = False,
+        fecha_creacion: str = None,
+        usuario_creador: str = None,
+        url_archivo: str = None
+    ):
+        """
+        Calls the create_notificacion_endpoint FastAPI endpoint.
+        
+        Parameters: see build_notificacion_payload.
+        
+        Returns:
+        - dict: JSON response from the API.
+        
+        Raises:
+        - requests.HTTPError: If the request fails.
+        """
+        payload = self.build_notificacion_payload(notificacion_id, asunto, fecha_publicacion, ruc_id, tipo_id,
+                                                  eliminado, fecha_creacion, usuario_creador, url_archivo)
         
         # Construct the endpoint URL
         base_url = self.config["URLS"]["persist_base_url"]
@@ -144,8 +275,10 @@ class SaveNotificationDb(SaveNotificationBase):
         logger.info(f"Calling endpoint: {url}")
         logger.debug(json.dumps(payload, indent=2))
 
-        # Send the POST request
-        response = requests.post(url, json=payload)
+        # Send the POST request (paced by the shared rate controller)
+        with rate_controller.request(url) as call:
+            response = self.http.post(url, json=payload)
+            call.done(response)
         
         # Raise an exception for HTTP error responses
         response.raise_for_status()
@@ -1,18 +1,103 @@
 from application.save_notification_base import SaveNotificationBase
 from datetime import datetime
+import csv
+import logging
 import os
-import pandas as pd
+import threading
+import uuid
+
+from openpyxl import Workbook
+
+logger = logging.getLogger(__name__)
+
+# Columns of the export; other keys of the notifications are not written
+COLUMNS = ["ruc", "id", "subject", "publish_date", "type", "url_archivo"]
+
 
 class SaveNotificationExcel(SaveNotificationBase):
     def __init__(self, config=None):
+        """
+        Streams the notifications of a run into one file, appending every RUC as it finishes
+        instead of holding the whole run in memory:
+        xlsx: write-only workbook with a sheet per RUC (rows are spooled to disk, the file is written on close);
+        csv: one file with a ruc column, flushed after every RUC;
+        parquet: one row group per RUC.
+
+        :param config: config.ini loaded ([LOCAL_STORE] path, format).
+        """
         super().__init__()
         self.config = config
+        self.format = config["LOCAL_STORE"].get("format", "xlsx").lower()
+        if self.format not in ("xlsx", "csv", "parquet"):
+            raise ValueError(f"Unsupported [LOCAL_STORE] format: {self.format}")
+        self.path = None
+        self._writer = None
+        self._file = None
+        self._sheets = {}
+        self._lock = threading.Lock()
 
-    def save(self, notifications, id):   
+    def _open(self):
         os.makedirs(self.config["LOCAL_STORE"]['path'], exist_ok=True)
-        # with open(f'{file_path}/notifica_{id_name_part}_{datetime.now().strftime("%Y.%m.%d_%H.%M.%S")}.json', 'w') as json_file:
-        #     json.dump(notifications, json_file, indent=4)
+        # One file per run: jobs, batch/queue threads and worker processes each write their own
+        self.path = (f"{self.config['LOCAL_STORE']['path']}/notificaciones_"
+                     f"{datetime.now().strftime('%Y.%m.%d_%H.%M.%S')}_{os.getpid()}_{uuid.uuid4().hex[:8]}.{self.format}")
+        if self.format == "xlsx":
+            self._writer = Workbook(write_only=True)
+        elif self.format == "csv":
+            self._file = open(self.path, "x", newline="", encoding="utf-8")
+            self._writer = csv.DictWriter(self._file, fieldnames=COLUMNS, extrasaction="ignore")
+            self._writer.writeheader()
+        logger.info(f"Exportando notificaciones en {self.path}")
+
+    def _parquet_table(self, rows):
+        import pyarrow as pa
+
+        return pa.Table.from_pylist([{column: row.get(column) for column in COLUMNS} for row in rows],
+                                    schema=pa.schema([(column, pa.string()) for column in COLUMNS]))
+
+    def save(self, notifications, id):
+        rows = [dict({key: "" if value is None else str(value) for key, value in notification.items()}, ruc=str(id))
+                for notification in notifications]
+        with self._lock:
+            if self.path is None:
+                self._open()
+
+            if self.format == "xlsx":
+                sheet = self._sheets.get(str(id))
+                if sheet is None:
+                    sheet = self._sheets[str(id)] = self._writer.create_sheet(title=str(id)[:31])
+                    sheet.append(COLUMNS)
+                for row in rows:
+                    sheet.append([row.get(column, "") for column in COLUMNS])
+            elif self.format == "csv":
+                self._writer.writerows(rows)
+                self._file.flush()
+            elif rows:
+                import pyarrow.parquet as pq
 
-        df = pd.DataFrame(notifications)
-        df.to_excel(f"{self.config['LOCAL_STORE']['path']}/notificaciones_{id}_{datetime.now().strftime('%Y.%m.%d_%H.%M.%S')}.xlsx")
+                table = self._parquet_table(rows)
+                if self._writer is None:
+                    self._writer = pq.ParquetWriter(self.path, table.schema)
+                self._writer.write_table(table)
+        logger.info(f"Notificaciones exportadas del RUC {id}: {len(rows)}")
 
+    def close(self):
+        """
+        Completes the file of the run; the next save starts a new one.
+        """
+        with self._lock:
+            if self.path is None:
+                return
+            if self.format == "xlsx":
+                self._writer.save(self.path)
+            elif self.format == "csv":
+                self._file.close()
+            elif self._writer is not None:
+                self._writer.close()
+            else:
+                logger.info("Exportación sin notificaciones, no se crea el archivo parquet")
+            logger.info(f"Exportación completada: {self.path}")
+            self.path = None
+            self._writer = None
+            self._file = None
+            self._sheets = {}
@@ -1,15 +1,18 @@
 import os
+import fnmatch
+import threading
 import time
 import configparser
 import platform
 
-# from selenium import webdriver
+from selenium import webdriver as plain_webdriver
 from seleniumwire import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.chrome.service import Service as ChromeService
 from selenium.webdriver.chrome.options import Options
+from selenium.common.exceptions import TimeoutException
 from webdriver_manager.chrome import ChromeDriverManager
 import logging
 
@@ -17,6 +20,165 @@ import logging
 # logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+DEFAULT_STEP_TIMEOUT = 20
+
+_chromedriver_path = None
+_chromedriver_lock = threading.Lock()
+
+
+def resolve_chromedriver(config=None):
+    """
+    Returns the chromedriver binary, resolved once per process.
+    A pinned path ([BROWSER] chromedriver_path or CHROMEDRIVER_PATH) is used as is, offline;
+    otherwise ChromeDriverManager is asked once (it checks the latest version over the network).
+    """
+    global _chromedriver_path
+    with _chromedriver_lock:
+        if _chromedriver_path is None:
+            pinned = os.getenv("CHROMEDRIVER_PATH")
+            if config is not None and config.has_section("BROWSER"):
+                pinned = config.get("BROWSER", "chromedriver_path", fallback="") or pinned
+            if pinned and os.path.exists(pinned):
+                _chromedriver_path = pinned
+            else:
+                if pinned:
+                    logger.warning(f"Pinned chromedriver {pinned} not found, resolving with ChromeDriverManager")
+                _chromedriver_path = ChromeDriverManager().install()
+            logger.info(f"Chromedriver: {_chromedriver_path}")
+        return _chromedriver_path
+
+
+class NetworkIdle:
+    """
+    Expected condition: the document is loaded and no jQuery/fetch activity has been seen for `idle` seconds.
+    """
+    SCRIPT = (
+        "return document.readyState === 'complete' && "
+        "(!window.jQuery || window.jQuery.active === 0) && "
+        "performance.getEntriesByType('resource').length;"
+    )
+
+    def __init__(self, idle=0.5):
+        self.idle = idle
+        self._resources = None
+        self._since = None
+
+    def __call__(self, driver):
+        resources = driver.execute_script(self.SCRIPT)
+        now = time.monotonic()
+        if resources is False:
+            self._resources, self._since = None, None
+            return False
+        if resources != self._resources:
+            # A new resource finished loading: restart the quiet period
+            self._resources, self._since = resources, now
+            return False
+        return now - self._since >= self.idle
+
+
+class CapturePolicy:
+    def __init__(self, mode="off", scopes=None, max_requests=200, max_bytes=20 * 1024 * 1024):
+        """
+        What the selenium-wire proxy records.
+
+        :param mode: "off" (plain selenium, no proxy), "scoped" (only URLs matching scopes) or "full".
+        :param scopes: Regular expressions of the URLs captured in "scoped" mode.
+        :param max_requests: Requests kept in memory; the oldest are dropped first.
+        :param max_bytes: Response bytes kept in memory; the capture is cleared when exceeded.
+        """
+        if mode not in ("off", "scoped", "full"):
+            raise ValueError(f"Unsupported capture mode {mode}. Use 'off', 'scoped' or 'full'.")
+        self.mode = mode
+        self.scopes = scopes or []
+        self.max_requests = max_requests
+        self.max_bytes = max_bytes
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        if config is None or not config.has_section("CAPTURE"):
+            return cls()
+        scopes = [s.strip() for s in config.get("CAPTURE", "scopes", fallback="").replace("\n", ",").split(",") if s.strip()]
+        return cls(mode=config.get("CAPTURE", "mode", fallback="off"),
+                   scopes=scopes,
+                   max_requests=config.getint("CAPTURE", "max_requests", fallback=200),
+                   max_bytes=config.getint("CAPTURE", "max_bytes", fallback=20 * 1024 * 1024))
+
+    @property
+    def enabled(self):
+        return self.mode != "off"
+
+    def seleniumwire_options(self):
+        return {"request_storage": "memory", "request_storage_max_size": self.max_requests}
+
+    def install(self, driver):
+        """
+        Counts the response bytes as the proxy records them and clears the capture once max_bytes is exceeded.
+        """
+        def response_interceptor(request, response):
+            with self._lock:
+                self._bytes += len(response.body or b"")
+                if self._bytes <= self.max_bytes:
+                    return
+                total, self._bytes = self._bytes, 0
+            logger.warning(f"Network capture over {self.max_bytes} bytes ({total}), clearing it")
+            del driver.requests
+        driver.response_interceptor = response_interceptor
+
+    def reset(self):
+        with self._lock:
+            self._bytes = 0
+
+
+class BlockingProfile:
+    def __init__(self, blocked=None, allowed=None):
+        """
+        URLs the browser does not load (images, fonts, media, trackers), as CDP wildcard patterns ("*" = anything).
+
+        :param blocked: Patterns of the URLs dropped.
+        :param allowed: Patterns always loaded even if they match a blocked one (what login and listaMensajes need).
+                        Only honored when the proxy intercepts the requests ([CAPTURE] mode = full).
+        """
+        self.blocked = blocked or []
+        self.allowed = allowed or []
+
+    @staticmethod
+    def _patterns(config, option):
+        value = config.get("BLOCKING", option, fallback="")
+        return [p.strip() for p in value.replace("\n", ",").split(",") if p.strip()]
+
+    @classmethod
+    def from_config(cls, config):
+        if config is None or not config.getboolean("BLOCKING", "enabled", fallback=False):
+            return None
+        return cls(blocked=cls._patterns(config, "blocked"), allowed=cls._patterns(config, "allowed"))
+
+    def is_blocked(self, url):
+        if any(fnmatch.fnmatchcase(url, pattern) for pattern in self.allowed):
+            return False
+        return any(fnmatch.fnmatchcase(url, pattern) for pattern in self.blocked)
+
+    def apply(self, driver, proxied):
+        """
+        Installs the profile on the driver. With the proxy capturing everything an interceptor aborts the blocked
+        requests (honoring the allowlist); otherwise CDP Network.setBlockedURLs drops them in the browser.
+        """
+        if proxied:
+            def interceptor(request):
+                if self.is_blocked(request.url):
+                    request.abort()
+            driver.request_interceptor = interceptor
+        else:
+            # setBlockedURLs has no exceptions: the allowlist cannot be applied without the proxy
+            if self.allowed:
+                logger.warning("Resource blocking through CDP: the allowed patterns are ignored "
+                               "(they need [CAPTURE] mode = full); keep the blocked patterns away from them")
+            driver.execute_cdp_cmd("Network.enable", {})
+            driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": self.blocked})
+        logger.info(f"Resource blocking: {len(self.blocked)} patterns, {len(self.allowed)} allowed")
+
+
 class SeleniumRpa:
     def __init__(self, browser="chrome", options=None, timeout=60, headless=False, config=None):
         """
@@ -26,6 +188,11 @@ class SeleniumRpa:
         :param options: Browser options. Default is None.
         :param timeout: Timeout for waiting on elements. Default is 30 seconds.
         """
+        self.capture = CapturePolicy.from_config(config)
+        # Plain selenium when nothing has to be captured: no proxy in front of the browser
+        driver_module = webdriver if self.capture.enabled else plain_webdriver
+        wire_options = {"seleniumwire_options": self.capture.seleniumwire_options()} if self.capture.enabled else {}
+
         logger.info(f"Python version: {platform.python_version()}")
         logger.info(f"Architecture: {platform.architecture()}")
         if 'PROCESSOR_ARCHITECTURE' in os.environ:
@@ -58,28 +225,39 @@ class SeleniumRpa:
 
             # self._driver = webdriver.Chrome(
             #     service=ChromeService(ChromeDriverManager().install()), options=options)
-            self._driver = webdriver.Chrome(
-                service=ChromeService(ChromeDriverManager().install()), 
-                options=chrome_options)
+            self._driver = driver_module.Chrome(
+                service=ChromeService(resolve_chromedriver(config)),
+                options=chrome_options,
+                **wire_options)
             logger.info(f"Chrome Driverversion: {self._driver.capabilities['chrome']['chromedriverVersion'].split(' ')}")
 
         elif browser.lower() == "firefox":
             from selenium.webdriver.firefox.service import Service as FirefoxService
             from webdriver_manager.firefox import GeckoDriverManager
 
-            options = options or webdriver.FirefoxOptions()
+            options = options or driver_module.FirefoxOptions()
             if headless:
                 options.add_argument("--headless")
-            self._driver = webdriver.Firefox(
-                service=FirefoxService(GeckoDriverManager().install()), options=options
+            self._driver = driver_module.Firefox(
+                service=FirefoxService(GeckoDriverManager().install()), options=options, **wire_options
             )
         else:
             raise ValueError("Unsupported browser. Use 'chrome' or 'firefox'.")
-        logger.info("Selenium WebDriver initialized.")
+        logger.info(f"Selenium WebDriver initialized. Capture: {self.capture.mode}")
+        if self.capture.mode == "scoped":
+            self._driver.scopes = self.capture.scopes
+        if self.capture.enabled:
+            self.capture.install(self._driver)
+
+        self.blocking = BlockingProfile.from_config(config)
+        if self.blocking is not None and browser.lower() == "chrome":
+            # Out-of-scope requests are not intercepted by selenium-wire, so "scoped" blocks through CDP too
+            self.blocking.apply(self._driver, proxied=self.capture.mode == "full")
 
         # self._driver.maximize_window()
         self.wait = WebDriverWait(self._driver, timeout)
         self.config = config
+        self.step_timings = []
 
     @property
     def driver(self):
@@ -229,6 +407,16 @@ class SeleniumRpa:
         """
         Automates a workflow based on a sequence of tasks.
 
+        Each task may declare an "until" condition (or a list of conditions) with an optional "timeout";
+        the task then returns as soon as the condition holds instead of sleeping a fixed "delay".
+        Supported conditions:
+            {"condition": "visible" | "invisible" | "clickable" | "present", "by": ..., "value": ...}
+            {"condition": "frame_available", "by": ..., "value": ...}
+            {"condition": "url_changes"}
+            {"condition": "url_contains", "value": ...}
+            {"condition": "network_idle", "idle": 0.5}
+        The latency of every task is appended to self.step_timings.
+
         :param url: The URL to start automation.
         :param tasks: A list of tasks (e.g., "click", "enter_text").
         """
@@ -239,6 +427,8 @@ class SeleniumRpa:
             action_type = task["action"]
             by = task.get("by")
             value = task.get("value")
+            start = time.perf_counter()
+            previous_url = self._driver.current_url if "until" in task else None
 
             if action_type == "click":
                 self.click_element(by, value)
@@ -249,7 +439,88 @@ class SeleniumRpa:
             elif action_type == "navigate":
                 self.open_page(task["url"])
 
-            time.sleep(task.get("delay", 2))  # Optional delay between actions
+            timed_out = False
+            if "until" in task:
+                timed_out = not self.wait_for(task["until"], task.get("timeout", DEFAULT_STEP_TIMEOUT), previous_url)
+            else:
+                time.sleep(task.get("delay", 2))  # Optional delay between actions
+
+            elapsed = time.perf_counter() - start
+            self.step_timings.append({"action": action_type, "value": value or task.get("url"),
+                                      "seconds": elapsed, "timed_out": timed_out})
+            logger.debug(f"Step {action_type} {value or task.get('url')}: {elapsed:.3f}s{' (timeout)' if timed_out else ''}")
+
+    def wait_for(self, conditions, timeout, previous_url=None):
+        """
+        Waits until all the conditions hold.
+
+        :param conditions: A condition dict or a list of them (see execute_workflow).
+        :param timeout: Maximum seconds to wait for all of them.
+        :param previous_url: URL before the action, used by "url_changes".
+        :return: True when the conditions hold, False on timeout.
+        """
+        if isinstance(conditions, dict):
+            conditions = [conditions]
+
+        deadline = time.monotonic() + timeout
+        for condition in conditions:
+            remaining = max(deadline - time.monotonic(), 0.1)
+            try:
+                WebDriverWait(self._driver, remaining, poll_frequency=0.2).until(
+                    self._expected_condition(condition, previous_url))
+            except TimeoutException:
+                logger.warning(f"Condition not met after {timeout}s: {condition}")
+                return False
+        return True
+
+    def _expected_condition(self, condition, previous_url):
+        kind = condition["condition"]
+        locator = (condition.get("by"), condition.get("value"))
+
+        if kind == "visible":
+            return EC.visibility_of_element_located(locator)
+        if kind == "invisible":
+            return EC.invisibility_of_element_located(locator)
+        if kind == "clickable":
+            return EC.element_to_be_clickable(locator)
+        if kind == "present":
+            return EC.presence_of_element_located(locator)
+        if kind == "frame_available":
+            # Only checks the frame is there and displayed; does not switch into it
+            return EC.visibility_of_element_located(locator)
+        if kind == "url_changes":
+            return EC.url_changes(previous_url)
+        if kind == "url_contains":
+            return EC.url_contains(condition["value"])
+        if kind == "network_idle":
+            return NetworkIdle(condition.get("idle", 0.5))
+        raise ValueError(f"Unsupported wait condition: {kind}")
+
+    def captured_requests(self):
+        """
+        Requests recorded by the proxy (empty when the capture is off).
+        """
+        if not self.capture.enabled:
+            return []
+        return self._driver.requests
+
+    def clear_capture(self):
+        """
+        Drops the recorded requests (called between RUCs so memory does not grow with every mailbox).
+        """
+        if self.capture.enabled:
+            del self._driver.requests
+            self.capture.reset()
+
+    def is_alive(self):
+        """
+        Health check: the browser answers a trivial script.
+        """
+        try:
+            return self._driver.execute_script("return 1") == 1
+        except Exception as e:
+            logger.warning(f"Browser health check failed: {e}")
+            return False
 
     def quit(self):
         """Closes the browser and ends the session."""
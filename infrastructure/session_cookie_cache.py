@@ -0,0 +1,96 @@
+import json
+import logging
+import os
+import tempfile
+import time
+
+from cryptography.fernet import Fernet, InvalidToken
+
+logger = logging.getLogger(__name__)
+
+
+class SessionCookieCache:
+    def __init__(self, path, key, ttl_seconds=1200):
+        """
+        Encrypted on-disk cache of the authenticated browser cookies, one file per RUC.
+
+        :param path: Directory where the encrypted files are stored.
+        :param key: Fernet key (urlsafe base64, 32 bytes) used to encrypt the files.
+        :param ttl_seconds: Maximum age of a cached session.
+        """
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._fernet = Fernet(key)
+        os.makedirs(self.path, exist_ok=True)
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Builds the cache from the [SESSION_CACHE] section of config.ini.
+        The encryption key is read from the SESSION_CACHE_KEY environment variable.
+
+        :return: SessionCookieCache, or None when the cache is disabled or no key is configured.
+        """
+        if not config.has_section("SESSION_CACHE") or not config.getboolean("SESSION_CACHE", "enabled", fallback=False):
+            return None
+
+        key = os.getenv("SESSION_CACHE_KEY")
+        if not key:
+            logger.warning("SESSION_CACHE is enabled but SESSION_CACHE_KEY is not set. Session cache disabled.")
+            return None
+
+        return cls(config["SESSION_CACHE"].get("path", "./session_cache"),
+                   key,
+                   config.getint("SESSION_CACHE", "ttl_seconds", fallback=1200))
+
+    def _file(self, ruc):
+        return os.path.join(self.path, f"{ruc}.session")
+
+    def get(self, ruc):
+        """
+        Returns the cached cookies of the RUC, or None when missing, expired or unreadable.
+        """
+        file_path = self._file(ruc)
+        if not os.path.exists(file_path):
+            return None
+
+        try:
+            with open(file_path, "rb") as f:
+                entry = json.loads(self._fernet.decrypt(f.read()))
+        except (InvalidToken, ValueError, OSError) as e:
+            logger.warning(f"Invalid session cache for RUC {ruc}: {e}")
+            self.invalidate(ruc)
+            return None
+
+        now = time.time()
+        if now - entry["saved_at"] > self.ttl_seconds:
+            logger.info(f"Session cache expired for RUC {ruc}")
+            self.invalidate(ruc)
+            return None
+
+        cookies = [c for c in entry["cookies"] if not c.get("expires") or c["expires"] <= 0 or c["expires"] > now]
+        return cookies or None
+
+    def put(self, ruc, cookies):
+        """
+        Stores (encrypted) the cookies of the RUC.
+        """
+        data = self._fernet.encrypt(json.dumps({"saved_at": time.time(), "cookies": cookies}).encode("utf-8"))
+
+        # Write to a temp file and rename, so a concurrent reader never sees a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=self.path)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.chmod(tmp_path, 0o600)
+            os.replace(tmp_path, self._file(ruc))
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        logger.info(f"Session cached for RUC {ruc}")
+
+    def invalidate(self, ruc):
+        try:
+            os.remove(self._file(ruc))
+        except FileNotFoundError:
+            pass
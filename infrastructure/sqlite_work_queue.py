@@ -0,0 +1,149 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+from application.work_queue import WorkQueue
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    estudio_contable_ruc TEXT NOT NULL,
+    ruc TEXT NOT NULL,
+    status TEXT NOT NULL,
+    worker_id TEXT,
+    lease_expires_at REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    outcome TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, id);
+"""
+
+QUEUED = "queued"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+
+class SqliteWorkQueue(WorkQueue):
+    def __init__(self, path, max_attempts=3):
+        """
+        WorkQueue in a SQLite file (WAL) for the workers and processes of a single host;
+        every claim runs in an IMMEDIATE transaction so two workers never lease the same task.
+        WAL locking relies on shared memory and does not work on network filesystems (NFS, SMB, cloud volumes),
+        so replicas on different hosts cannot share the file: they need another WorkQueue backend.
+
+        :param path: SQLite database file.
+        :param max_attempts: Claims of a task before it is marked as failed.
+        """
+        self.path = path
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.connection().executescript(SCHEMA)
+
+    def connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit: transactions are opened explicitly with BEGIN IMMEDIATE
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _now():
+        return datetime.now(timezone.utc).isoformat()
+
+    def _transaction(self):
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        return conn
+
+    def enqueue(self, estudio_contable_ruc, rucs):
+        conn = self._transaction()
+        try:
+            active = {row[0] for row in conn.execute(
+                "SELECT ruc FROM tasks WHERE estudio_contable_ruc = ? AND status IN (?, ?)",
+                (str(estudio_contable_ruc), QUEUED, LEASED))}
+            new = [str(ruc) for ruc in dict.fromkeys(rucs) if str(ruc) not in active]
+            conn.executemany(
+                "INSERT INTO tasks (estudio_contable_ruc, ruc, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                [(str(estudio_contable_ruc), ruc, QUEUED, self._now(), self._now()) for ruc in new])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        logger.info(f"Queued {len(new)} RUCs of {estudio_contable_ruc}")
+        return len(new)
+
+    def claim(self, worker_id, lease_seconds):
+        now = time.time()
+        conn = self._transaction()
+        try:
+            row = conn.execute(
+                "SELECT id, estudio_contable_ruc, ruc, attempts FROM tasks "
+                "WHERE (status = ? OR (status = ? AND lease_expires_at < ?)) AND attempts < ? "
+                "ORDER BY id LIMIT 1", (QUEUED, LEASED, now, self.max_attempts)).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE tasks SET status = ?, worker_id = ?, lease_expires_at = ?, attempts = attempts + 1, "
+                "updated_at = ? WHERE id = ?", (LEASED, worker_id, now + lease_seconds, self._now(), row[0]))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return {"id": row[0], "estudio_contable_ruc": row[1], "ruc": row[2], "attempts": row[3] + 1}
+
+    def _update_leased(self, task_id, worker_id, sql, params):
+        cursor = self.connection().execute(
+            f"UPDATE tasks SET {sql}, updated_at = ? WHERE id = ? AND worker_id = ? AND status = ?",
+            list(params) + [self._now(), task_id, worker_id, LEASED])
+        return cursor.rowcount == 1
+
+    def heartbeat(self, task_id, worker_id, lease_seconds):
+        return self._update_leased(task_id, worker_id, "lease_expires_at = ?", [time.time() + lease_seconds])
+
+    def complete(self, task_id, worker_id, outcome):
+        if not self._update_leased(task_id, worker_id, "status = ?, outcome = ?, error = NULL",
+                                   [DONE, json.dumps(outcome, default=str)]):
+            logger.warning(f"Task {task_id} was no longer leased by {worker_id} when completed")
+
+    def fail(self, task_id, worker_id, error):
+        conn = self.connection()
+        row = conn.execute("SELECT attempts FROM tasks WHERE id = ?", (task_id,)).fetchone()
+        status = FAILED if row is not None and row[0] >= self.max_attempts else QUEUED
+        self._update_leased(task_id, worker_id, "status = ?, error = ?, lease_expires_at = NULL", [status, str(error)])
+
+    def requeue_expired(self):
+        now = time.time()
+        conn = self._transaction()
+        try:
+            failed = conn.execute(
+                "UPDATE tasks SET status = ?, error = 'lease expired', updated_at = ? "
+                "WHERE status = ? AND lease_expires_at < ? AND attempts >= ?",
+                (FAILED, self._now(), LEASED, now, self.max_attempts)).rowcount
+            requeued = conn.execute(
+                "UPDATE tasks SET status = ?, worker_id = NULL, lease_expires_at = NULL, updated_at = ? "
+                "WHERE status = ? AND lease_expires_at < ?", (QUEUED, self._now(), LEASED, now)).rowcount
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if requeued or failed:
+            logger.info(f"Expired leases: {requeued} requeued, {failed} failed")
+        return requeued
+
+    def stats(self):
+        rows = self.connection().execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
@@ -0,0 +1,224 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+from application.watermark_store import WatermarkStore
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS processed_notifications (
+    ruc TEXT NOT NULL,
+    notification_id TEXT NOT NULL,
+    processed_at TEXT NOT NULL,
+    PRIMARY KEY (ruc, notification_id)
+);
+CREATE TABLE IF NOT EXISTS attachment_hashes (
+    sha256 TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    stored_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS runs (
+    ruc TEXT PRIMARY KEY,
+    last_run_at TEXT NOT NULL,
+    status TEXT
+);
+CREATE TABLE IF NOT EXISTS llm_rows (
+    row_hash TEXT PRIMARY KEY,
+    result TEXT NOT NULL,
+    stored_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS watermarks (
+    ruc TEXT PRIMARY KEY,
+    date TEXT NOT NULL,
+    ids TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS journal_runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    estudio_contable_ruc TEXT NOT NULL,
+    started_at TEXT NOT NULL,
+    finished_at TEXT
+);
+CREATE TABLE IF NOT EXISTS journal_rucs (
+    run_id INTEGER NOT NULL,
+    ruc TEXT NOT NULL,
+    status TEXT NOT NULL,
+    reason TEXT,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (run_id, ruc)
+);
+"""
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+class StateStore:
+    def __init__(self, path):
+        """
+        Embedded incremental state (SQLite in WAL mode): notifications already persisted per RUC,
+        SHA-256 of the attachments already stored, the last run of every RUC and the run journal (see RunJournal).
+        Every thread uses its own connection; WAL lets the worker processes read while one writes.
+
+        :param path: SQLite database file.
+        """
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self.connection() as conn:
+            conn.executescript(SCHEMA)
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Returns the store of [STATE] state_db, shared by every component of the process, or None if not configured.
+        """
+        path = config.get("STATE", "state_db", fallback="")
+        if not path:
+            return None
+        with _stores_lock:
+            if path not in _stores:
+                _stores[path] = cls(path)
+            return _stores[path]
+
+    def connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def processed_ids(self, ruc, notification_ids):
+        """
+        Returns the subset of notification_ids already persisted for the RUC.
+        """
+        ids = [str(i) for i in notification_ids]
+        if not ids:
+            return set()
+        placeholders = ",".join("?" * len(ids))
+        rows = self.connection().execute(
+            f"SELECT notification_id FROM processed_notifications WHERE ruc = ? AND notification_id IN ({placeholders})",
+            [str(ruc)] + ids).fetchall()
+        return {row[0] for row in rows}
+
+    def mark_processed(self, ruc, notification_ids):
+        now = datetime.now(timezone.utc).isoformat()
+        with self.connection() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO processed_notifications (ruc, notification_id, processed_at) VALUES (?, ?, ?)",
+                [(str(ruc), str(i), now) for i in notification_ids])
+
+    def attachment_path(self, sha256):
+        """
+        Returns the gs:// path already holding this content, or None.
+        """
+        row = self.connection().execute(
+            "SELECT path FROM attachment_hashes WHERE sha256 = ?", (sha256,)).fetchone()
+        return row[0] if row else None
+
+    def add_attachment(self, sha256, path):
+        with self.connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO attachment_hashes (sha256, path, stored_at) VALUES (?, ?, ?)",
+                         (sha256, path, datetime.now(timezone.utc).isoformat()))
+
+    def llm_row(self, row_hash):
+        """
+        Returns the JSON extracted by the LLM for a row (by content hash), or None.
+        """
+        row = self.connection().execute("SELECT result FROM llm_rows WHERE row_hash = ?", (row_hash,)).fetchone()
+        return row[0] if row else None
+
+    def add_llm_row(self, row_hash, result):
+        with self.connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO llm_rows (row_hash, result, stored_at) VALUES (?, ?, ?)",
+                         (row_hash, result, datetime.now(timezone.utc).isoformat()))
+
+    def watermark(self, ruc):
+        """
+        Returns the watermark of the RUC {"date": ISO date, "ids": [...]}, or None.
+        """
+        row = self.connection().execute("SELECT date, ids FROM watermarks WHERE ruc = ?", (str(ruc),)).fetchone()
+        return {"date": row[0], "ids": json.loads(row[1])} if row else None
+
+    def advance_watermark(self, ruc, date, ids):
+        """
+        Moves the watermark of the RUC to date (never back); the ids of the same date are merged.
+        Read and upsert run in one IMMEDIATE transaction, so concurrent writers do not lose updates.
+
+        :return: False when the stored watermark is newer.
+        """
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT date, ids FROM watermarks WHERE ruc = ?", (str(ruc),)).fetchone()
+            ids = set(ids)
+            if row is not None:
+                current = datetime.fromisoformat(row[0])
+                if current > date:
+                    conn.rollback()
+                    return False
+                if current == date:
+                    ids |= set(json.loads(row[1]))
+            conn.execute(
+                "INSERT INTO watermarks (ruc, date, ids, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(ruc) DO UPDATE SET date = excluded.date, ids = excluded.ids, updated_at = excluded.updated_at",
+                (str(ruc), date.isoformat(), json.dumps(sorted(ids)), datetime.now(timezone.utc).isoformat()))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return True
+
+    def record_run(self, ruc, status="ok"):
+        with self.connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO runs (ruc, last_run_at, status) VALUES (?, ?, ?)",
+                         (str(ruc), datetime.now(timezone.utc).isoformat(), status))
+
+    def last_run(self, ruc):
+        """
+        Returns {"last_run_at": ISO date, "status": ...} of the RUC, or None if it never ran.
+        """
+        row = self.connection().execute(
+            "SELECT last_run_at, status FROM runs WHERE ruc = ?", (str(ruc),)).fetchone()
+        return {"last_run_at": row[0], "status": row[1]} if row else None
+
+
+class StateAttachmentManifest:
+    def __init__(self, store: StateStore):
+        """
+        AttachmentManifest backed by the state store, so the content hashes are shared across processes.
+        """
+        self.store = store
+
+    def get(self, sha256):
+        return self.store.attachment_path(sha256)
+
+    def add(self, sha256, gcs_path):
+        self.store.add_attachment(sha256, gcs_path)
+
+
+class StateWatermarkStore(WatermarkStore):
+    def __init__(self, store: StateStore):
+        """
+        WatermarkStore backed by the state store: one row per RUC, shared by every thread and process.
+        """
+        super().__init__(store.path)
+        self.store = store
+
+    def get(self, ruc):
+        return self.store.watermark(ruc)
+
+    def advance(self, ruc, notifications):
+        found = self.newest(notifications)
+        if found is None:
+            return
+        newest, ids = found
+        if self.store.advance_watermark(ruc, newest, ids):
+            logger.info(f"Watermark RUC {ruc}: {newest.isoformat()}")
@@ -4,11 +4,12 @@ from logging.handlers import RotatingFileHandler, TimedRotatingFileHandler
 from application.estudio_contable_not_found_error import EstudioContableNotFoundError
 from application.estudio_contable_service import EstudioContableService
 from application.http_session_rpa import HttpSessionRpa
-from application.notification_sunat import NotificationSunat
-from infrastructure.extract_notification_manual import ExtractNotificationManual
-from infrastructure.extract_notification_llm import ExtractNotificationLLM
-from infrastructure.save_notification_db import SaveNotificationDb
-from infrastructure.save_notification_excel import SaveNotificationExcel
+from application.ruc_worker_pool import RucWorkerPool
+from application.batch_runner import BatchRunner
+from application.queue_worker import QueueWorker
+from application.host_limiter import host_limiter
+from application.rate_controller import rate_controller
+from infrastructure import notification_factory
 from common.parameter_arguments import parse_opt
 from cross_cutting.settings import Settings
 
@@ -16,6 +17,7 @@ import os
 import pandas as pd
 import logging
 import configparser
+import threading
 
 from dotenv import load_dotenv, find_dotenv
 load_dotenv(find_dotenv())
@@ -23,6 +25,8 @@ load_dotenv(find_dotenv())
 # Load configuration from config.ini
 config = configparser.ConfigParser()
 config.read("config.ini")
+host_limiter.configure(config)
+rate_controller.configure(config)
 
 # Configure logging
 os.makedirs("logs", exist_ok=True)
@@ -39,52 +43,161 @@ logging.getLogger("selenium.webdriver.remote.remote_connection").setLevel(level=
 logging.getLogger("hpack.table").setLevel(level=logging.WARNING)
 logger = logging.getLogger(__name__)
 
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from cross_cutting import metrics
+from application.job_manager import JobManager
+
 app = FastAPI()
-@app.post("/")
+job_manager = JobManager(max_workers=config.getint("JOBS", "max_workers", fallback=2),
+                         max_jobs=config.getint("JOBS", "max_jobs", fallback=200))
+# Extractor of every job, batch and queue worker ([EXTRACTOR] name)
+extractor_name = config.get("EXTRACTOR", "name", fallback="manual")
+# Warm browsers shared by the jobs of the API; created at startup
+browser_pool = None
+# RUC work queue of this host (SQLite), and the queue workers of this replica
+work_queue = None
+queue_stop = threading.Event()
+queue_threads = []
+
+@app.on_event("startup")
+def startup():
+    global browser_pool, work_queue
+    browser_pool = notification_factory.create_browser_pool(config)
+    if browser_pool is not None:
+        browser_pool.start()
+
+    work_queue = notification_factory.create_work_queue(config)
+    for i in range(config.getint("QUEUE", "workers", fallback=0)):
+        worker = QueueWorker(work_queue, EstudioContableService(config=config), notification_factory, config,
+                             extractor_name=extractor_name,
+                             lease_seconds=config.getint("QUEUE", "lease_seconds", fallback=600),
+                             heartbeat_seconds=config.getint("QUEUE", "heartbeat_seconds", fallback=60),
+                             poll_seconds=config.getint("QUEUE", "poll_seconds", fallback=5))
+        thread = threading.Thread(target=worker.run, args=(queue_stop,), name=f"queue-worker-{i}", daemon=True)
+        thread.start()
+        queue_threads.append(thread)
+
+@app.on_event("shutdown")
+def shutdown():
+    job_manager.shutdown()
+    queue_stop.set()
+    if browser_pool is not None:
+        browser_pool.close()
+
+@app.post("/", status_code=202)
 async def root(request: Request):
-    try:
-        data = await request.json()
-        ESTUDIO_CONTABLE_RUC = data.get("ESTUDIO_CONTABLE_RUC")
-        if ESTUDIO_CONTABLE_RUC is None:
-            raise HTTPException(status_code=400, detail="Please provide a RUC")
-        os.environ["ESTUDIO_CONTABLE_RUC"] = ESTUDIO_CONTABLE_RUC
-        logger.info(f"ESTUDIO_CONTABLE_RUC: {os.environ["ESTUDIO_CONTABLE_RUC"]}")
-        main()
-        return {"message": "Notification processing completed"}
-    except EstudioContableNotFoundError as e:
-        logger.exception(str(e))
-        raise HTTPException(status_code=404, detail=str(e))
-    except Exception as ex:
-        logger.exception(str(ex))
-        raise HTTPException(status_code=500, detail=str(ex))
+    data = await request.json()
+    ESTUDIO_CONTABLE_RUC = data.get("ESTUDIO_CONTABLE_RUC")
+    if ESTUDIO_CONTABLE_RUC is None:
+        raise HTTPException(status_code=400, detail="Please provide a RUC")
+    logger.info(f"ESTUDIO_CONTABLE_RUC: {ESTUDIO_CONTABLE_RUC}")
+    job_id = job_manager.submit(run_job, {"estudio_contable_ruc": ESTUDIO_CONTABLE_RUC})
+    return {"job_id": job_id, "status_url": f"/jobs/{job_id}"}
+
+@app.post("/batch", status_code=202)
+async def batch(request: Request):
+    data = await request.json()
+    estudios = data.get("ESTUDIOS_CONTABLES")
+    if not estudios or not (estudios == "all" or isinstance(estudios, list)):
+        raise HTTPException(status_code=400, detail='Please provide ESTUDIOS_CONTABLES: a list of RUCs or "all"')
+    logger.info(f"ESTUDIOS_CONTABLES: {estudios}")
+    job_id = job_manager.submit(run_batch, {"estudios": estudios})
+    return {"job_id": job_id, "status_url": f"/jobs/{job_id}"}
+
+@app.post("/queue", status_code=202)
+async def enqueue(request: Request):
+    data = await request.json()
+    estudios = data.get("ESTUDIOS_CONTABLES")
+    if not estudios or not (estudios == "all" or isinstance(estudios, list)):
+        raise HTTPException(status_code=400, detail='Please provide ESTUDIOS_CONTABLES: a list of RUCs or "all"')
+    # The estudio API and the queue database are blocking: kept off the event loop
+    return await run_in_threadpool(enqueue_estudios, estudios)
+
+def enqueue_estudios(estudios):
+    # Only the estudio and the RUC are queued: the workers read the credentials when they claim the task
+    svc = EstudioContableService(config=config)
+    if estudios == "all":
+        estudios = [estudio["numero_ruc"] for estudio in svc.get_estudios_contables()]
+    # Every estudio is validated before queueing any, so an unknown one does not leave the request half queued
+    rucs = {}
+    for estudio in estudios:
+        try:
+            rucs[estudio] = [context["RUC"] for context in svc.get_rucs_by_estudio_contable(estudio)]
+        except EstudioContableNotFoundError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+    queued = {estudio: work_queue.enqueue(estudio, estudio_rucs) for estudio, estudio_rucs in rucs.items()}
+    return {"queued": queued, "stats": work_queue.stats()}
+
+@app.get("/queue")
+def queue_stats():
+    return work_queue.stats()
+
+@app.get("/metrics")
+def get_metrics():
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
+def run_job(progress, estudio_contable_ruc):
+    main(estudio_contable_ruc=estudio_contable_ruc, progress=progress)
+
+def run_batch(progress, estudios):
+    runner = BatchRunner(config,
+                         EstudioContableService(config=config),
+                         notification_factory,
+                         workers=config.getint("BATCH", "workers", fallback=4),
+                         extractor_name=extractor_name,
+                         progress=progress)
+    return runner.run(estudios)
    
-def main():
+def main(estudio_contable_ruc=None, progress=None):
     # parser = parse_opt()
     # args = parser.parse_args()
     # logger.info(f"Args: {args}")
-    args_extractor = "manual"
+    args_extractor = extractor_name
     args_save_to = "db"
-    settings = Settings()
-
-    extractor = ExtractNotificationManual(config=config)
-    # if args.extractor == "llm":
-    if args_extractor == "llm":
-        extractor = ExtractNotificationLLM()
-
-    save = SaveNotificationExcel(config=config)
-    # if args.save_to == "db":
-    if args_save_to == "db":
-        save = SaveNotificationDb(config=config)
-
-    process_sunat = NotificationSunat(
-        extractor, 
-        HttpSessionRpa(headless=True, config=config),
-        persist=save,
+    # Per-job settings: the RUC of the request overrides the environment without modifying it
+    settings = Settings(ESTUDIO_CONTABLE_RUC=estudio_contable_ruc) if estudio_contable_ruc else Settings()
+
+    extractor = notification_factory.create_extractor(args_extractor, config)
+    save = notification_factory.create_persist(args_save_to, config)
+
+    # With more than one worker every worker process opens its own browser session
+    workers = config.getint("PROCESSING", "workers", fallback=1)
+    if workers > 1:
+        worker_pool = RucWorkerPool(workers, config, extractor_name=args_extractor, save_to=args_save_to)
+        run_notifications(extractor, None, save, settings, progress, worker_pool=worker_pool)
+    elif browser_pool is not None:
+        # Borrowed warm browser: the pool recycles it if the job fails
+        with browser_pool.lease() as session:
+            run_notifications(extractor, session, save, settings, progress, close_session=False,
+                              release_session=browser_pool.release)
+    else:
+        run_notifications(extractor, notification_factory.create_session(config), save, settings, progress)
+
+def run_notifications(extractor, session, save, settings, progress, worker_pool=None, close_session=True,
+                      release_session=None):
+    process_sunat = notification_factory.create_notification_sunat(
+        config,
+        extractor,
+        session,
+        save,
+        settings,
         estudio_contable_svc=EstudioContableService(config=config),
-        settings=settings)
+        worker_pool=worker_pool,
+        progress=progress,
+        close_session=close_session,
+        journal=notification_factory.create_run_journal(config),
+        release_session=release_session)
 
-    process_sunat.process_notification()
+    return process_sunat.process_notification()
 
 
 if __name__ == "__main__":
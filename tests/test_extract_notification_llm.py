@@ -0,0 +1,98 @@
+import configparser
+
+import pytest
+from lxml import html
+
+pytest.importorskip("langchain")
+pytest.importorskip("langchain_openai")
+
+from infrastructure.extract_notification_llm import CHARS_PER_TOKEN, ExtractNotificationLLM
+
+
+def row(li_id, subject, date="09/10/2026 09:00:00", tag="VALORES"):
+    return (f'<li id="{li_id}" class="list-group-item" onclick="goMensaje({li_id})">'
+            f'<script>track({li_id})</script><style>.x {{}}</style>'
+            f'<div class="row"><span class="label tag tag-1">{tag}</span></div>'
+            f'<a class="linkMensaje text-muted" href="#">  {subject}  </a>'
+            f'<small class="fecPublica">{date}</small><img src="icon.png"></li>')
+
+
+def lista(*rows):
+    return '<ul id="listaMensajes">' + "".join(rows) + "</ul>"
+
+
+class FakeChain:
+    """
+    Extraction chain answering from the minified rows it receives, recording every call.
+    """
+    def __init__(self):
+        self.calls = []
+
+    def run(self, text):
+        self.calls.append(text)
+        items = []
+        for li in html.fromstring(text).xpath("//li"):
+            items.append({"id": int(li.get("id")),
+                          "subject": li.findtext("a"),
+                          "publish_date": li.findtext("small"),
+                          "type": li.findtext("span")})
+        return [{"listaMensajes": items}]
+
+
+def make_extractor(chunk_tokens=2000, max_concurrency=1):
+    config = configparser.ConfigParser()
+    config.read_dict({"LLM": {"chunk_tokens": str(chunk_tokens), "max_concurrency": str(max_concurrency)},
+                      "STATE": {"state_db": ""}})
+    chain = FakeChain()
+    return ExtractNotificationLLM(config=config, chain=chain), chain
+
+
+def test_minify_rows_keeps_only_the_schema_fields():
+    rows = ExtractNotificationLLM.minify_rows(lista(row("101", "Resolución"), row("102", "Valor")))
+
+    assert rows == [
+        '<li id="101"><a>Resolución</a><small>09/10/2026 09:00:00</small><span>VALORES</span></li>',
+        '<li id="102"><a>Valor</a><small>09/10/2026 09:00:00</small><span>VALORES</span></li>',
+    ]
+
+
+def test_chunks_respect_the_token_budget():
+    extractor, _ = make_extractor(chunk_tokens=10)
+    budget = 10 * CHARS_PER_TOKEN
+    rows = ["x" * 15] * 5 + ["y" * (budget + 5)]
+
+    chunks = list(extractor.chunks(rows))
+
+    assert chunks == [["x" * 15] * 2, ["x" * 15] * 2, ["x" * 15], ["y" * (budget + 5)]]
+    assert all(sum(map(len, chunk)) <= budget for chunk in chunks if len(chunk) > 1)
+
+
+def test_cached_rows_do_not_reach_the_chain():
+    extractor, chain = make_extractor()
+
+    first = extractor.extract_rows(lista(row("101", "A"), row("102", "B")))
+    second = extractor.extract_rows(lista(row("103", "C"), row("101", "A"), row("102", "B")))
+
+    assert [r["id"] for r in first] == ["101", "102"]
+    assert [r["id"] for r in second] == ["103", "101", "102"]
+    assert len(chain.calls) == 2
+    assert 'id="103"' in chain.calls[1]
+    assert 'id="101"' not in chain.calls[1] and 'id="102"' not in chain.calls[1]
+
+
+def test_rows_are_matched_by_id_without_leading_zeros():
+    extractor, chain = make_extractor()
+
+    rows = extractor.extract_rows(lista(row("000123", "Con ceros"), row("45", "Sin ceros")))
+
+    assert [(r["id"], r["subject"]) for r in rows] == [("000123", "Con ceros"), ("45", "Sin ceros")]
+    assert len(chain.calls) == 1
+
+
+def test_chunks_are_sent_separately_and_merged_in_list_order():
+    extractor, chain = make_extractor(chunk_tokens=20, max_concurrency=2)
+
+    rows = extractor.extract_rows(lista(*(row(str(i), f"Asunto {i}") for i in range(1, 5))))
+
+    assert [r["id"] for r in rows] == ["1", "2", "3", "4"]
+    assert len(chain.calls) > 1
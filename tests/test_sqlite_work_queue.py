@@ -0,0 +1,122 @@
+import threading
+import time
+
+from infrastructure.sqlite_work_queue import SqliteWorkQueue
+
+
+def make_queue(tmp_path, max_attempts=3):
+    return SqliteWorkQueue(str(tmp_path / "queue.db"), max_attempts=max_attempts)
+
+
+def expire(queue, task_id):
+    queue.connection().execute("UPDATE tasks SET lease_expires_at = ? WHERE id = ?", (time.time() - 1, task_id))
+
+
+def test_enqueue_skips_rucs_already_queued_or_leased(tmp_path):
+    queue = make_queue(tmp_path)
+
+    assert queue.enqueue("E1", ["1", "2", "2"]) == 2
+    queue.claim("w1", 60)
+    assert queue.enqueue("E1", ["1", "2", "3"]) == 1
+    assert queue.enqueue("E2", ["1"]) == 1
+    assert queue.stats() == {"queued": 3, "leased": 1}
+
+
+def test_claim_leases_the_oldest_task_once(tmp_path):
+    queue = make_queue(tmp_path)
+    queue.enqueue("E1", ["1", "2"])
+
+    first = queue.claim("w1", 60)
+    second = queue.claim("w2", 60)
+
+    assert (first["ruc"], first["attempts"]) == ("1", 1)
+    assert second["ruc"] == "2"
+    assert queue.claim("w3", 60) is None
+
+
+def test_concurrent_claims_never_share_a_task(tmp_path):
+    queue = make_queue(tmp_path)
+    queue.enqueue("E1", [str(ruc) for ruc in range(50)])
+    claimed = []
+
+    def worker(worker_id):
+        while True:
+            task = queue.claim(worker_id, 60)
+            if task is None:
+                return
+            claimed.append(task["id"])
+
+    threads = [threading.Thread(target=worker, args=(f"w{i}",)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(claimed) == sorted(set(claimed))
+    assert len(claimed) == 50
+
+
+def test_expired_lease_is_claimed_by_another_worker(tmp_path):
+    queue = make_queue(tmp_path)
+    queue.enqueue("E1", ["1"])
+    task = queue.claim("w1", 60)
+
+    assert queue.claim("w2", 60) is None
+    expire(queue, task["id"])
+    reclaimed = queue.claim("w2", 60)
+
+    assert (reclaimed["id"], reclaimed["attempts"]) == (task["id"], 2)
+    # The first worker lost its lease: its heartbeat and completion are ignored
+    assert queue.heartbeat(task["id"], "w1", 60) is False
+    queue.complete(task["id"], "w1", {"status": "ok"})
+    assert queue.stats() == {"leased": 1}
+
+
+def test_heartbeat_extends_the_lease(tmp_path):
+    queue = make_queue(tmp_path)
+    queue.enqueue("E1", ["1"])
+    task = queue.claim("w1", 1)
+
+    assert queue.heartbeat(task["id"], "w1", 60) is True
+    expires = queue.connection().execute("SELECT lease_expires_at FROM tasks").fetchone()[0]
+    assert expires > time.time() + 30
+
+
+def test_complete_marks_the_task_done(tmp_path):
+    queue = make_queue(tmp_path)
+    queue.enqueue("E1", ["1"])
+    task = queue.claim("w1", 60)
+
+    queue.complete(task["id"], "w1", {"status": "ok"})
+
+    assert queue.stats() == {"done": 1}
+    assert queue.enqueue("E1", ["1"]) == 1
+
+
+def test_failed_task_is_requeued_until_max_attempts(tmp_path):
+    queue = make_queue(tmp_path, max_attempts=2)
+    queue.enqueue("E1", ["1"])
+
+    queue.fail(queue.claim("w1", 60)["id"], "w1", "boom")
+    assert queue.stats() == {"queued": 1}
+    queue.fail(queue.claim("w1", 60)["id"], "w1", "boom")
+
+    assert queue.stats() == {"failed": 1}
+    assert queue.claim("w1", 60) is None
+
+
+def test_requeue_expired(tmp_path):
+    queue = make_queue(tmp_path, max_attempts=2)
+    queue.enqueue("E1", ["1", "2"])
+    first = queue.claim("w1", 60)
+    # The second task is on its last attempt when its lease expires
+    second = queue.claim("w2", 60)
+    queue.fail(second["id"], "w2", "boom")
+    second = queue.claim("w2", 60)
+    assert second["attempts"] == 2
+    expire(queue, first["id"])
+    expire(queue, second["id"])
+
+    assert queue.requeue_expired() == 1
+    assert queue.stats() == {"queued": 1, "failed": 1}
+    assert queue.claim("w3", 60)["id"] == first["id"]